@@ -0,0 +1,62 @@
+import copy
+
+import jax
+import jax.numpy as jnp
+from jax.custom_batching import custom_vmap
+
+
+# Some targets have a batched_logdensity_fn(X), which evaluates the log density of all the chains at once (X has shape (num_chains, ndims), the output (num_chains, )),
+# e.g. GermanCredit computes the logits of all the chains with one matrix-matrix product, instead of a matrix-vector product for each chain.
+#
+# The samplers are written for a single chain and are vmapped (or shard_mapped) over the chains, so they never call batched_logdensity_fn themselves.
+# with_batched_logdensity(model) returns a copy of the model whose logdensity_fn is the same function of a single chain,
+# but when it (or its gradient) is vmapped, the chains are evaluated with batched_logdensity_fn:
+#
+#     model = with_batched_logdensity(GermanCredit())
+#     jax.vmap(jax.value_and_grad(model.logdensity_fn))(X) # = one call of batched_logdensity_fn and of its gradient
+#
+# Models without batched_logdensity_fn are returned unchanged.
+
+
+def batched(logdensity_fn, batched_logdensity_fn):
+    """logdensity_fn which is evaluated with batched_logdensity_fn when vmapped. Forward and reverse mode derivatives are supported."""
+
+    def batched_value_and_grad_fn(X):
+        # the chains are independent, so the gradient of the sum is the gradient of each chain
+        return batched_logdensity_fn(X), jax.grad(lambda X: jnp.sum(batched_logdensity_fn(X)))(X)
+
+    def vmap_rule(fn, batched_fn):
+        def rule(axis_size, in_batched, x):
+            out = batched_fn(x) if in_batched[0] else fn(x)
+            return out, jax.tree_util.tree_map(lambda _: in_batched[0], out)
+        return rule
+
+    value = custom_vmap(logdensity_fn)
+    value.def_vmap(vmap_rule(logdensity_fn, batched_logdensity_fn))
+
+    value_and_grad = custom_vmap(jax.value_and_grad(logdensity_fn))
+    value_and_grad.def_vmap(vmap_rule(jax.value_and_grad(logdensity_fn), batched_value_and_grad_fn))
+
+    # the derivatives are not taken through custom_vmap: the jvp is the (batched) gradient times the tangent, which is linear in the tangent, so reverse mode works as well
+    @jax.custom_jvp
+    def fn(x):
+        return value(x)
+
+    @fn.defjvp
+    def fn_jvp(primals, tangents):
+        l, g = value_and_grad(primals[0])
+        return l, jnp.dot(g, tangents[0])
+
+    # jitted, such that the data of the model are arguments and not constants of custom_vmap, which the evaluation counter (eval_counter.py) can not handle in loops
+    return jax.jit(fn)
+
+
+def with_batched_logdensity(model):
+    """shallow copy of the model whose logdensity_fn uses model.batched_logdensity_fn under vmap. Models without batched_logdensity_fn are returned as they are."""
+
+    if not hasattr(model, 'batched_logdensity_fn'):
+        return model
+
+    batched_model = copy.copy(model)
+    batched_model.logdensity_fn = batched(model.logdensity_fn, model.batched_logdensity_fn)
+    return batched_model
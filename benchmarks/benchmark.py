@@ -16,7 +16,11 @@ import jax.numpy as jnp
 import pandas as pd
 import scipy
 from jax.flatten_util import ravel_pytree
-from .metrics import benchmark, grid_search, grid_search_only_L
+from .metrics import benchmark, benchmark_sweep, grid_search, grid_search_only_L
+from benchmarks import results_store
+from benchmarks.compilation import enable_compilation_cache
+from benchmarks.parallel import shard_chains
+from benchmarks.scheduler import Job, estimated_cost, run_jobs
 
 from blackjax.adaptation.mclmc_adaptation import MCLMCAdaptationState
 from blackjax.adaptation.adjusted_mclmc_adaptation import adjusted_mclmc_make_L_step_size_adaptation
@@ -74,7 +78,47 @@ from blackjax.mcmc.integrators import (
 from blackjax.util import run_inference_algorithm, store_only_expectation_values
 
 
-def run_benchmarks(batch_size, models, key_index=1, do_grid_search=True, do_non_grid_search=True, integrators = ["mclachlan"], return_ess_corr=True, do_fast_grid_search=False, do_grid_search_for_unadjusted=False, pvmap=jax.pmap, folder = 'results', num_tuning_steps=1000, do_nuts=False, do_adjusted_mclmc = True, do_adjusted_hmc = False, do_unadjusted_mclmc = False, do_adjusted_mclmc_with_nuts_tuning=False):
+class ResultsTable:
+    """rows of benchmark results of one model and key_index. Each row is written to the results store (see benchmarks/results_store.py) as soon as it is computed, 
+        so a pre-empted job only loses the configuration it was running.
+        With resume=True, the configurations which are already in the store are reported as done, so that they can be skipped."""
+
+    def __init__(self, store, model, key_index, columns, resume=False):
+        self.store = store
+        self.key_index = key_index
+        self.columns = columns
+
+        self.completed = results_store.completed_configs(store, model, key_index) if resume else set()
+        if self.completed:
+            print(f"resuming {model.name}{model.ndims}: {len(self.completed)} configurations already done")
+
+    def done(self, config):
+        return config in self.completed
+
+    def add(self, config, row, **extra):
+        """extra: values of columns of the store which are not in self.columns, e.g. compile_time"""
+        results_store.append(self.store, [{**dict(zip(self.columns, row)), **extra, 'config': config, 'key_index': self.key_index}])
+        self.completed.add(config)
+
+
+def config_id(model, sampler, integrator_type, tuning, key_index):
+    """identifies a row of the results: the model, the sampler, the integrator, the tuning configuration and the key"""
+    return f"{model.name}{model.ndims}:{sampler}:{integrator_type}:{tuning}:{key_index}"
+
+
+def run_benchmarks(batch_size, models, key_index=1, do_grid_search=True, do_non_grid_search=True, integrators = ["mclachlan"], return_ess_corr=True, do_fast_grid_search=False, do_grid_search_for_unadjusted=False, pvmap=shard_chains, folder = 'results', num_tuning_steps=1000, do_nuts=False, do_adjusted_mclmc = True, do_adjusted_hmc = False, do_unadjusted_mclmc = False, do_adjusted_mclmc_with_nuts_tuning=False, tuning_cache=None, resume=False, early_stopping=None, bias_recording=None, num_workers=1, compilation_cache=True):
+    """results are appended to the results store in folder/store (see benchmarks/results_store.py)
+        resume: skip the configurations of this key_index which are already in the store, e.g. when rerunning a pre-empted job
+        early_stopping: passed to benchmark, stops the runs once the bias has crossed the ESS threshold for good
+        bias_recording: passed to benchmark, keeps the bias only at some checkpoints to save memory
+        num_workers: number of configurations which run at the same time, each on its own group of devices (see benchmarks/scheduler.py).
+            The configurations of all the models are first collected in a list of jobs, and then run, the most expensive ones first.
+        compilation_cache: store the compiled programs on disk and reuse them in the next runs (see benchmarks/compilation.py)"""
+
+    if compilation_cache:
+        enable_compilation_cache()
+
+    store = os.path.join(folder, 'store')
 
     keys_for_not_grid, keys_for_grid, keys_for_fast_grid = jax.random.split(jax.random.key(key_index), 3)
 
@@ -86,164 +130,374 @@ def run_benchmarks(batch_size, models, key_index=1, do_grid_search=True, do_non_
     # do_nuts = False
 
     num_chains = batch_size  # 1 + batch_size//model.ndims
-    
-    for model in models:
-        print(f"Running benchmark for {model.name} with {model.ndims} dimensions")
 
+    def pvmap_on(devices):
+        # the chains of a job only use the devices of its worker
+        return partial(shard_chains, devices=devices) if pvmap is shard_chains else pvmap
 
 
-        if do_fast_grid_search:
-            results = defaultdict(tuple)
-            # for i,(integrator_type, sampler_type) in enumerate(itertools.product(integrators, ['adjusted_hmc', 'mclmc', 'adjusted_mclmc'])):
-            for i,(integrator_type, sampler_type) in enumerate(itertools.product(integrators, ['adjusted_mchmc', 'adjusted_mclmc'])):
+    def fast_grid_job(model, results, config, integrator_type, sampler_type, key, devices):
 
-                keys_for_fast_grid = jax.random.fold_in(keys_for_fast_grid, i)
+        L, step_size, ess, ess_avg, ess_corr_avg, rate, edge = grid_search_only_L(
+            model=model,
+            sampler=sampler_type,
+            num_steps=models[model][sampler_type],
+            num_chains=batch_size,
+            integrator_type=integrator_type,
+            key=key,
+            grid_size=10,
+            grid_iterations=2,
+            opt='max',
+            tuning_cache=tuning_cache,
+            pvmap=pvmap_on(devices),
+        )
 
-                L, step_size, ess, ess_avg, ess_corr_avg, rate, edge = grid_search_only_L(
-                    model=model,
-                    sampler=sampler_type,
-                    num_steps=models[model][sampler_type],
-                    num_chains=batch_size,
-                    integrator_type=integrator_type,
-                    key=keys_for_fast_grid,
-                    grid_size=10,
-                    grid_iterations=2,
-                    opt='max'
+        print(f"fast grid search edge {edge}")
+        print(f"fast grid search L {L}, step_size {step_size}")
+
+        results.add(config,
+                (
+                    model.name,
+                    model.ndims,
+                    f"{sampler_type}:fast_grid{edge}",
+                    jnp.nanmean(L).item(),
+                    jnp.nanmean(step_size).item(),
+                    integrator_type,
+                    f"gridsearch",
+                    rate.mean().item(),
+                    False,
+                    1 / np.inf,
+                    ess_avg.item(),
+                    0,
+                    0,
+                    0,
+                    models[model][sampler_type],
+                    num_chains,
+                    True,
+                    1,
+                    num_tuning_steps,
+                    ess.item(),
                 )
+            )
 
-                print(f"fast grid search edge {edge}")
-                print(f"fast grid search L {L}, step_size {step_size}")
 
-                results[
-                        (
-                            model.name,
-                            model.ndims,
-                            f"{sampler_type}:fast_grid{edge}",
-                            jnp.nanmean(L).item(),
-                            jnp.nanmean(step_size).item(),
-                            integrator_type,
-                            f"gridsearch",
-                            rate.mean().item(),
-                            False,
-                            1 / np.inf,
-                            ess_avg.item(),
-                            0,
-                            0,
-                            0,
-                            models[model][sampler_type],
-                            num_chains,
-                            True,
-                            1,
-                            num_tuning_steps,
-                        )
-                    ] = ess.item()
-                
+    def grid_job(model, results, config, integrator_type, sampler_type, key, devices):
 
-            df = pd.Series(results).reset_index()
-            df.columns = [
-                "model", "dims", "sampler", "L", "step_size", "integrator", "tuning", "acc_rate", "preconditioning", "inv_L_prop", "ess_avg", "ess_corr_avg", "ess_corr_min", "ess_corr_inv_mean", "num_steps", "num_chains", "worst", "num_windows", "num_tuning_steps", "ESS"]
-            # df.result = df.result.apply(lambda x: x[0].item())
-            # df.model = df.model.apply(lambda x: x[1])
-            df.to_csv(os.path.join(folder,f"fastgridresults{model.name}{model.ndims}{key_index}.csv"), index=False)
+        (
+            grid_key,
+            bench_key,
+        ) = jax.random.split(key, 2)
+
+        out, edge, state_after_tuning = grid_search(
+            model=model,
+            sampler_type=sampler_type,
+            num_steps = models[model][sampler_type],
+            num_chains=batch_size,
+            integrator_type=integrator_type,
+            # x=blackjax_adjusted_mclmc_sampler_params.L*2,
+            # y=blackjax_adjusted_mclmc_sampler_params.step_size*2,
+            # # x=3.316967,
+            # # y=0.390205,
+            # delta_x=blackjax_adjusted_mclmc_sampler_params.L*2 - 0.1,
+            # delta_y=blackjax_adjusted_mclmc_sampler_params.step_size*2 - 0.1,
+            key=grid_key,
+            grid_size=6,
+            num_iter=3,
+            pvmap=pvmap_on(devices),
+            tuning_cache=tuning_cache,
+        )
 
-             
+        # ess = undefined
 
+        # print("BENCHMARK after finding optimal params with grid \n\n\n")
+        # ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _ = benchmark(
+        #     model,
+        #     adjusted_mclmc_no_tuning(
+        #         integrator_type=integrator_type,
+        #         step_size=out[1],
+        #         L=out[0],
+        #         inverse_mass_matrix=1.0,
+        #         initial_state=state_after_tuning,
+        #         return_ess_corr=return_ess_corr,
+        #     ),
+        #     bench_key,
+        #     n=models[model][sampler_type],
+        #     batch=num_chains,
+        #     pvmap=pvmap,
+        # )
+        # print(f"best from grid search adjusted {ess}")
 
-        if do_grid_search:
-            results = defaultdict(tuple)
-            print(
-                f"NUMBER OF CHAINS for {model.name} and adjusted_mclmc is {num_chains}"
+        results.add(config,
+            (
+                model.name,
+                model.ndims,
+                f"adjusted_mclmc:grid_edge{edge}",
+                jnp.nanmean(params.L).item(),
+                jnp.nanmean(params.step_size).item(),
+                integrator_type,
+                f"gridsearch",
+                acceptance_rate.mean().item(),
+                preconditioning,
+                1 / L_proposal_factor,
+                ess_avg,
+                ess_corr.mean().item(),
+                ess_corr.min().item(),
+                (1/(1/ess_corr).mean()).item(),
+                models[model][sampler_type],
+                num_chains,
+                True,
+                1,
+                0,
+                ess,
             )
-            for i, (integrator_type, sampler_type) in enumerate(itertools.product(integrators, ['adjusted_mclmc'])):
+        )
 
 
-                ####### run adjusted_mclmc with standard tuning + grid search
-                keys_for_grid = jax.random.fold_in(keys_for_grid, i)
-                (
-                    grid_key,
-                    bench_key,
-                ) = jax.random.split(keys_for_grid, 2)
+    def unadjusted_mclmc_job(model, results, config, integrator_type, num_windows, preconditioning, num_tuning_steps, key, devices):
+
+        timings = {}
+        ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, bias_avg, bias_max, tuning_integrator_steps = benchmark(
+            model,
+            unadjusted_mclmc(integrator_type=integrator_type, preconditioning=preconditioning, num_windows=num_windows, return_ess_corr=return_ess_corr,num_tuning_steps=num_tuning_steps),
+            key,
+            n=models[model]["mclmc"],
+            batch=num_chains,
+            pvmap=pvmap_on(devices),
+            tuning_cache=tuning_cache,
+            timings=timings,
+            early_stopping=early_stopping,
+            bias_recording=bias_recording,
+        )
 
+        results.add(config,
+            (
+                model.name,
+                model.ndims,
+                "mclmc:st3",
+                params.L.mean().item(),
+                params.step_size.mean().item(),
+                integrator_type,
+                "standard",
+                1.0,
+                preconditioning,
+                0,
+                ess_avg,
+                ess_corr.mean().item(),
+                ess_corr.min().item(),
+                (1/(1/ess_corr).mean()).item(),
+                models[model]["mclmc"],
+                num_chains,
+                False,
+                num_windows,
+                num_tuning_steps,
+                tuning_integrator_steps,
+                ess,
+            ),
+            bias_avg=bias_avg,
+            bias_max=bias_max,
+            **timings,
+        )
+        print(f"unadjusted mclmc with tuning, grads to low bias avg {grads_to_low_avg}")
+
+
+    def adjusted_mclmc_job(model, results, config, integrator_type, target_acc_rate, L_proposal_factor, random_trajectory_length, max, tuning_factor, num_windows, preconditioning, num_tuning_steps_mams, key, devices):
+
+        print(f"running adjusted mclmc with target acceptance rate {target_acc_rate}, L_proposal_factor {L_proposal_factor}, max {max}, num_windows {num_windows}")
+
+        timings = {}
+        ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, bias_avg, bias_max, tuning_integrator_steps = benchmark(
+            model,
+            adjusted_mclmc(
+                integrator_type=integrator_type, preconditioning=preconditioning, frac_tune3=0.0, L_proposal_factor=L_proposal_factor,
+                target_acc_rate=target_acc_rate, return_ess_corr=return_ess_corr, max=max, num_windows=num_windows, random_trajectory_length=random_trajectory_length,
+                tuning_factor=tuning_factor,
+                num_tuning_steps=num_tuning_steps_mams),
+            key,
+            n=models[model]["adjusted_mclmc"],
+            batch=num_chains,
+            pvmap=pvmap_on(devices),
+            tuning_cache=tuning_cache,
+            timings=timings,
+            early_stopping=early_stopping,
+            bias_recording=bias_recording,
+        )
 
+        print(f"ess {ess}, ess_corr avg {ess_corr.mean()}, ess_corr min {ess_corr.min()}, ess_corr inv mean {1/(1/ess_corr).mean()}")
+        results.add(config,
+            (
+                model.name,
+                model.ndims,
+                "adjusted_mclmc:" + str(target_acc_rate)+str(tuning_factor),
+                jnp.nanmean(params.L).item(),
+                jnp.nanmean(params.step_size).item(),
+                (integrator_type),
+                "standard",
+                acceptance_rate.mean().item(),
+                preconditioning,
+                1 / L_proposal_factor,
+                ess_avg,
+                ess_corr.mean().item(),
+                ess_corr.min().item(), (1/(1/ess_corr).mean()).item(),
+                models[model]["adjusted_mclmc"],
+                num_chains,
+                max,
+                num_windows,
+                num_tuning_steps_mams,
+                tuning_integrator_steps,
+                ess,
+            ),
+            bias_avg=bias_avg,
+            bias_max=bias_max,
+            **timings,
+        )
 
 
-                
+    def adjusted_mclmc_with_nuts_tuning_job(model, results, config, integrator_type, target_acc_rate, L_proposal_factor, random_trajectory_length, alba_tuning, max, tuning_factor, num_windows, preconditioning, key, devices):
+
+        print(f"running adjusted mclmc with target acceptance rate {target_acc_rate}, L_proposal_factor {L_proposal_factor}, max {max}, num_windows {num_windows}")
+
+        timings = {}
+        ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, bias_avg, bias_max, tuning_integrator_steps = benchmark(
+            model,
+            adjusted_mclmc_with_nuts_tuning(
+                integrator_type=integrator_type, preconditioning=preconditioning, frac_tune3=0.0, L_proposal_factor=L_proposal_factor,
+                target_acc_rate=target_acc_rate, return_ess_corr=return_ess_corr, max=max, num_windows=num_windows, random_trajectory_length=random_trajectory_length,
+                tuning_factor=tuning_factor,
+                num_tuning_steps=20000,
+                alba_tuning=alba_tuning),
+            key,
+            n=models[model]["adjusted_mclmc"],
+            batch=num_chains,
+            pvmap=pvmap_on(devices),
+            tuning_cache=tuning_cache,
+            timings=timings,
+            early_stopping=early_stopping,
+            bias_recording=bias_recording,
+        )
 
-                out, edge, state_after_tuning = grid_search(
-                    model=model,
-                    sampler_type=sampler_type,
-                    num_steps = models[model][sampler_type],
-                    num_chains=batch_size,
-                    integrator_type=integrator_type,
-                    # x=blackjax_adjusted_mclmc_sampler_params.L*2,
-                    # y=blackjax_adjusted_mclmc_sampler_params.step_size*2,
-                    # # x=3.316967,
-                    # # y=0.390205,
-                    # delta_x=blackjax_adjusted_mclmc_sampler_params.L*2 - 0.1,
-                    # delta_y=blackjax_adjusted_mclmc_sampler_params.step_size*2 - 0.1,
-                    key=grid_key,
-                    grid_size=6,
-                    num_iter=3,
-                    pvmap=pvmap,
-                )
+        print(f"ess {ess}, ess_corr avg {ess_corr.mean()}, ess_corr min {ess_corr.min()}, ess_corr inv mean {1/(1/ess_corr).mean()}")
+        results.add(config,
+            (
+                model.name,
+                model.ndims,
+                f"adjusted_mclmc_with_nuts_tuning_alba_{alba_tuning}:" + str(target_acc_rate)+str(tuning_factor),
+                jnp.nanmean(params.L).item(),
+                jnp.nanmean(params.step_size).item(),
+                (integrator_type),
+                "standard",
+                acceptance_rate.mean().item(),
+                preconditioning,
+                1 / L_proposal_factor,
+                ess_avg,
+                ess_corr.mean().item(),
+                ess_corr.min().item(), (1/(1/ess_corr).mean()).item(),
+                models[model]["adjusted_mclmc"],
+                num_chains,
+                max,
+                num_windows,
+                0,
+                tuning_integrator_steps,
+                ess,
+            ),
+            bias_avg=bias_avg,
+            bias_max=bias_max,
+            **timings,
+        )
 
-                # ess = undefined
-
-                # print("BENCHMARK after finding optimal params with grid \n\n\n")
-                # ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _ = benchmark(
-                #     model,
-                #     adjusted_mclmc_no_tuning(
-                #         integrator_type=integrator_type,
-                #         step_size=out[1],
-                #         L=out[0],
-                #         inverse_mass_matrix=1.0,
-                #         initial_state=state_after_tuning,
-                #         return_ess_corr=return_ess_corr,
-                #     ),
-                #     bench_key,
-                #     n=models[model][sampler_type],
-                #     batch=num_chains,
-                #     pvmap=pvmap,
-                # )
-                # print(f"best from grid search adjusted {ess}")
 
-                
+    def nuts_job(model, results, config, integrator_type, preconditioning, num_tuning_steps, key, devices):
+
+        ####### run nuts
+        timings = {}
+        ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, bias_avg, bias_max, tuning_integrator_steps = benchmark(
+            model,
+            nuts(target_acc_rate=0.8, integrator_type=integrator_type, preconditioning=preconditioning,return_ess_corr=return_ess_corr, num_tuning_steps=num_tuning_steps),
+            key,
+            n=models[model]["nuts"],
+            batch=num_chains,
+            pvmap=pvmap_on(devices),
+            tuning_cache=tuning_cache,
+            timings=timings,
+            early_stopping=early_stopping,
+            bias_recording=bias_recording,
+        )
+        print(f"nuts, grads to low avg {grads_to_low_avg}")
 
-                results[
-                    (
-                        model.name,
-                        model.ndims,
-                        f"adjusted_mclmc:grid_edge{edge}",
-                        jnp.nanmean(params.L).item(),
-                        jnp.nanmean(params.step_size).item(),
-                        integrator_type,
-                        f"gridsearch",
-                        acceptance_rate.mean().item(),
-                        preconditioning,
-                        1 / L_proposal_factor,
-                        ess_avg,
-                        ess_corr.mean().item(),
-                        ess_corr.min().item(),
-                        (1/(1/ess_corr).mean()).item(),
-                        models[model][sampler_type],
-                        num_chains,
-                        True,
-                        1,
-                        0,
-                    )
-                ] = ess
-            
-            ##### save grid results
-            df = pd.Series(results).reset_index()
-            df.columns = [
-                "model", "dims", "sampler", "L", "step_size", "integrator", "tuning", "acc_rate", "preconditioning", "inv_L_prop", "ess_avg", "ess_corr_avg", "ess_corr_min", "ess_corr_inv_mean", "num_steps", "num_chains", "worst", "num_windows", "num_tuning_steps", "ESS"]
-            # df.result = df.result.apply(lambda x: x[0].item())
-            # df.model = df.model.apply(lambda x: x[1])
-            df.to_csv(os.path.join(folder, f"gridresults{model.name}{model.ndims}{key_index}.csv"), index=False)
+        results.add(config,
+            (
+                model.name,
+                model.ndims,
+                "nuts",
+                params["L"].mean().item(),
+                params["step_size"].mean().item(),
+                integrator_type,
+                "standard",
+                acceptance_rate.mean().item(),
+                preconditioning,
+                0,
+                ess_avg,
+                ess_corr.mean().item(),
+                ess_corr.min().item(), (1/(1/ess_corr).mean()).item(),
+                models[model]["nuts"],
+                num_chains,
+                None,
+                -1,
+                num_tuning_steps,
+                tuning_integrator_steps,
+                ess,
+            ),
+            bias_avg=bias_avg,
+            bias_max=bias_max,
+            **timings,
+        )
+
+        # jax.debug.print("num_tuning_grads {x}", x=num_tuning_grads)
+
+
+    # all the configurations, in the order in which a sequential run does them. The keys are the same as if they were run one by one.
+    jobs = []
+
+    for model in models:
+        print(f"Collecting benchmarks for {model.name} with {model.ndims} dimensions")
+
+        if do_fast_grid_search:
+            results = ResultsTable(store, model, key_index, [
+                "model", "dims", "sampler", "L", "step_size", "integrator", "tuning", "acc_rate", "preconditioning", "inv_L_prop", "ess_avg", "ess_corr_avg", "ess_corr_min", "ess_corr_inv_mean", "num_steps", "num_chains", "worst", "num_windows", "num_tuning_steps", "ESS"], resume=resume)
+            # for i,(integrator_type, sampler_type) in enumerate(itertools.product(integrators, ['adjusted_hmc', 'mclmc', 'adjusted_mclmc'])):
+            for i,(integrator_type, sampler_type) in enumerate(itertools.product(integrators, ['adjusted_mchmc', 'adjusted_mclmc'])):
+
+                keys_for_fast_grid = jax.random.fold_in(keys_for_fast_grid, i)
+
+                config = config_id(model, sampler_type + ":fast_grid", integrator_type, (10, 2, models[model][sampler_type], num_chains), key_index)
+                if results.done(config):
+                    continue
+
+                jobs.append(Job(config, 10 * 2 * estimated_cost(model, models[model][sampler_type], num_chains),
+                                partial(fast_grid_job, model, results, config, integrator_type, sampler_type, keys_for_fast_grid)))
+
+
+        if do_grid_search:
+            results = ResultsTable(store, model, key_index, [
+                "model", "dims", "sampler", "L", "step_size", "integrator", "tuning", "acc_rate", "preconditioning", "inv_L_prop", "ess_avg", "ess_corr_avg", "ess_corr_min", "ess_corr_inv_mean", "num_steps", "num_chains", "worst", "num_windows", "num_tuning_steps", "ESS"], resume=resume)
+            print(
+                f"NUMBER OF CHAINS for {model.name} and adjusted_mclmc is {num_chains}"
+            )
+            for i, (integrator_type, sampler_type) in enumerate(itertools.product(integrators, ['adjusted_mclmc'])):
+
+                ####### run adjusted_mclmc with standard tuning + grid search
+                keys_for_grid = jax.random.fold_in(keys_for_grid, i)
+
+                config = config_id(model, sampler_type + ":grid", integrator_type, (6, 3, models[model][sampler_type], num_chains), key_index)
+                if results.done(config):
+                    continue
+
+                jobs.append(Job(config, 6**2 * 3 * estimated_cost(model, models[model][sampler_type], num_chains),
+                                partial(grid_job, model, results, config, integrator_type, sampler_type, keys_for_grid)))
 
         if  do_non_grid_search:
-            results = defaultdict(tuple)
-        
+            results = ResultsTable(store, model, key_index, [
+               "model", "dims", "sampler", "L", "step_size", "integrator", "tuning", "acc_rate", "preconditioning", "inv_L_prop", "ess_avg", "ess_corr_avg", "ess_corr_min", "ess_corr_inv_mean", "num_steps", "num_chains", "worst", "num_windows", "num_tuning_steps", "tuning_integrator_steps", "ESS"], resume=resume)
+
             for i,integrator_type in enumerate(integrators):
 
                 # keys_for_not_grid = jax.random.split(keys_for_not_grid, 1)[0]
@@ -254,160 +508,57 @@ def run_benchmarks(batch_size, models, key_index=1, do_grid_search=True, do_non_
 
 
                 if do_unadjusted_mclmc:
-                    
+
                     for j,(num_windows, preconditioning) in enumerate(itertools.product([2], [True])):
                         unadjusted_with_tuning_key = jax.random.fold_in(unadjusted_with_tuning_key, j)
-                        ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _, tuning_integrator_steps = benchmark(
-                            model,
-                            unadjusted_mclmc(integrator_type=integrator_type, preconditioning=preconditioning, num_windows=num_windows, return_ess_corr=return_ess_corr,num_tuning_steps=num_tuning_steps),
-                            unadjusted_with_tuning_key,
-                            n=models[model]["mclmc"],
-                            batch=num_chains,
-                            pvmap=pvmap,
-                            
-                        )
-                        
-                        results[
-                            (
-                                model.name, 
-                                model.ndims, 
-                                "mclmc:st3", 
-                                params.L.mean().item(), 
-                                params.step_size.mean().item(), 
-                                integrator_type, 
-                                "standard", 
-                                1.0, 
-                                preconditioning, 
-                                0, 
-                                ess_avg, 
-                                ess_corr.mean().item(), 
-                                ess_corr.min().item(), 
-                                (1/(1/ess_corr).mean()).item(), 
-                                models[model]["mclmc"], 
-                                num_chains, 
-                                False, 
-                                num_windows, 
-                                num_tuning_steps,
-                                tuning_integrator_steps
-                            )
-                        ] = ess
-                        print(f"unadjusted mclmc with tuning, grads to low bias avg {grads_to_low_avg}")
-                    
-               
+
+                        config = config_id(model, "mclmc", integrator_type, (num_windows, preconditioning, num_tuning_steps, models[model]["mclmc"], num_chains), key_index)
+                        if results.done(config):
+                            continue
+
+                        jobs.append(Job(config, estimated_cost(model, models[model]["mclmc"], num_chains),
+                                        partial(unadjusted_mclmc_job, model, results, config, integrator_type, num_windows, preconditioning, num_tuning_steps, unadjusted_with_tuning_key)))
+
+
 
                     ####### run adjusted_mclmc with standard tuning
-                
+
                 if do_adjusted_mclmc:
                     for j, (target_acc_rate, (L_proposal_factor, random_trajectory_length), (max, tuning_factor), num_windows, preconditioning, num_tuning_steps_mams) in enumerate(itertools.product(
                             [0.9], [(jnp.inf, True),], [('avg', 1.3), ], [5,], [False],  [10000],
                         )):  # , 3., 1.25, 0.5] ):
                         ####### run adjusted_mclmc with standard tuning
-                    
 
-                            print(f"running adjusted mclmc with target acceptance rate {target_acc_rate}, L_proposal_factor {L_proposal_factor}, max {max}, num_windows {num_windows}")
+                            adjusted_with_tuning_key = jax.random.fold_in(adjusted_with_tuning_key, j)
 
+                            config = config_id(model, "adjusted_mclmc", integrator_type, (target_acc_rate, L_proposal_factor, random_trajectory_length, max, tuning_factor, num_windows, preconditioning, num_tuning_steps_mams, models[model]["adjusted_mclmc"], num_chains), key_index)
+                            if results.done(config):
+                                continue
 
-                            adjusted_with_tuning_key = jax.random.fold_in(adjusted_with_tuning_key, j)
+                            jobs.append(Job(config, estimated_cost(model, models[model]["adjusted_mclmc"], num_chains),
+                                            partial(adjusted_mclmc_job, model, results, config, integrator_type, target_acc_rate, L_proposal_factor, random_trajectory_length, max, tuning_factor, num_windows, preconditioning, num_tuning_steps_mams, adjusted_with_tuning_key)))
 
-                            ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _, tuning_integrator_steps = benchmark(
-                                model,
-                                adjusted_mclmc(
-                                    integrator_type=integrator_type, preconditioning=preconditioning, frac_tune3=0.0, L_proposal_factor=L_proposal_factor,
-                                    target_acc_rate=target_acc_rate, return_ess_corr=return_ess_corr, max=max, num_windows=num_windows, random_trajectory_length=random_trajectory_length,
-                                    tuning_factor=tuning_factor,
-                                    num_tuning_steps=num_tuning_steps_mams),
-                                adjusted_with_tuning_key,
-                                n=models[model]["adjusted_mclmc"],
-                                batch=num_chains,
-                                pvmap=pvmap,
-                                
-                            )
-                                
-                            print(f"ess {ess}, ess_corr avg {ess_corr.mean()}, ess_corr min {ess_corr.min()}, ess_corr inv mean {1/(1/ess_corr).mean()}")
-                            results[
-                                (
-                                    model.name,
-                                    model.ndims,
-                                    "adjusted_mclmc:" + str(target_acc_rate)+str(tuning_factor),
-                                    jnp.nanmean(params.L).item(),
-                                    jnp.nanmean(params.step_size).item(),
-                                    (integrator_type),
-                                    "standard",
-                                    acceptance_rate.mean().item(),
-                                    preconditioning,
-                                    1 / L_proposal_factor,
-                                    ess_avg,
-                                    ess_corr.mean().item(),
-                                    ess_corr.min().item(), (1/(1/ess_corr).mean()).item(),
-                                    models[model]["adjusted_mclmc"],
-                                    num_chains,
-                                    max,
-                                    num_windows,
-                                    num_tuning_steps_mams,
-                                    tuning_integrator_steps
-                                )
-                            ] = ess
-
-                    print("done with adjusted mclmc")
-                
                 if do_adjusted_mclmc_with_nuts_tuning:
                     for j, (target_acc_rate, (L_proposal_factor, random_trajectory_length, alba_tuning), (max, tuning_factor), num_windows, preconditioning) in enumerate(itertools.product(
                             [0.9], [(jnp.inf, True, True), (5.0, True, True)], [('avg', 1.3)], [2,], [True],
                         )):  # , 3., 1.25, 0.5] ):
                         ####### run adjusted_mclmc with standard tuning
-                    
 
-                            print(f"running adjusted mclmc with target acceptance rate {target_acc_rate}, L_proposal_factor {L_proposal_factor}, max {max}, num_windows {num_windows}")
+                            adjusted_with_tuning_key = jax.random.fold_in(adjusted_with_tuning_key, j)
 
+                            config = config_id(model, f"adjusted_mclmc_with_nuts_tuning_alba_{alba_tuning}", integrator_type, (target_acc_rate, L_proposal_factor, random_trajectory_length, max, tuning_factor, num_windows, preconditioning, 20000, models[model]["adjusted_mclmc"], num_chains), key_index)
+                            if results.done(config):
+                                continue
+
+                            jobs.append(Job(config, estimated_cost(model, models[model]["adjusted_mclmc"], num_chains),
+                                            partial(adjusted_mclmc_with_nuts_tuning_job, model, results, config, integrator_type, target_acc_rate, L_proposal_factor, random_trajectory_length, alba_tuning, max, tuning_factor, num_windows, preconditioning, adjusted_with_tuning_key)))
 
-                            adjusted_with_tuning_key = jax.random.fold_in(adjusted_with_tuning_key, j)
 
-                            ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _, tuning_integrator_steps = benchmark(
-                                model,
-                                adjusted_mclmc_with_nuts_tuning(
-                                    integrator_type=integrator_type, preconditioning=preconditioning, frac_tune3=0.0, L_proposal_factor=L_proposal_factor,
-                                    target_acc_rate=target_acc_rate, return_ess_corr=return_ess_corr, max=max, num_windows=num_windows, random_trajectory_length=random_trajectory_length,
-                                    tuning_factor=tuning_factor,
-                                    num_tuning_steps=20000,
-                                    alba_tuning=alba_tuning),
-                                adjusted_with_tuning_key,
-                                n=models[model]["adjusted_mclmc"],
-                                batch=num_chains,
-                                pvmap=pvmap,
-                                
-                            )
-                                
-                            print(f"ess {ess}, ess_corr avg {ess_corr.mean()}, ess_corr min {ess_corr.min()}, ess_corr inv mean {1/(1/ess_corr).mean()}")
-                            results[
-                                (
-                                    model.name,
-                                    model.ndims,
-                                    f"adjusted_mclmc_with_nuts_tuning_alba_{alba_tuning}:" + str(target_acc_rate)+str(tuning_factor),
-                                    jnp.nanmean(params.L).item(),
-                                    jnp.nanmean(params.step_size).item(),
-                                    (integrator_type),
-                                    "standard",
-                                    acceptance_rate.mean().item(),
-                                    preconditioning,
-                                    1 / L_proposal_factor,
-                                    ess_avg,
-                                    ess_corr.mean().item(),
-                                    ess_corr.min().item(), (1/(1/ess_corr).mean()).item(),
-                                    models[model]["adjusted_mclmc"],
-                                    num_chains,
-                                    max,
-                                    num_windows,
-                                    0,
-                                    tuning_integrator_steps
-                                )
-                            ] = ess
-
-                        
                 # if do_adjusted_hmc:
                 #     for j, (target_acc_rate, max, num_windows, tuning_factor, preconditioning) in enumerate(itertools.product(
                 #             [0.9], ['avg'], [1,2,3], [1.3], [True, False]
                 #         )):  # , 3., 1.25, 0.5] ):
-                            
+
                 #             print(f"running adjusted hmc with max {max}, num_windows {num_windows}")
 
 
@@ -416,17 +567,17 @@ def run_benchmarks(batch_size, models, key_index=1, do_grid_search=True, do_non_
                 #             ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _ = benchmark(
                 #                 model,
                 #                 adjusted_hmc(
-                #                     integrator_type=integrator_type, preconditioning=preconditioning, frac_tune3=0.0, 
-                #                     return_ess_corr=return_ess_corr, max=max, num_windows=num_windows, 
+                #                     integrator_type=integrator_type, preconditioning=preconditioning, frac_tune3=0.0,
+                #                     return_ess_corr=return_ess_corr, max=max, num_windows=num_windows,
                 #                     tuning_factor=tuning_factor,
                 #                     num_tuning_steps=num_tuning_steps),
                 #                 adjusted_with_tuning_key,
                 #                 n=models[model]["adjusted_hmc"],
                 #                 batch=num_chains,
                 #                 pvmap=pvmap,
-                                
+
                 #             )
-                                
+
                 #             print(f"ess {ess}, ess_corr avg {ess_corr.mean()}, ess_corr min {ess_corr.min()}, ess_corr inv mean {1/(1/ess_corr).mean()}")
                 #             results[
                 #                 (
@@ -451,58 +602,23 @@ def run_benchmarks(batch_size, models, key_index=1, do_grid_search=True, do_non_
                 #                 )
                 #             ] = ess
 
-                    
+
                 # print("done with adjusted hmc")
             if do_nuts:
-                print("running nuts")
 
-                for i, (integrator_type, preconditioning, num_tuning_steps) in enumerate(itertools.product(["velocity_verlet"], [True], [10000,])):
+                for i, (integrator_type, preconditioning, num_tuning_steps_nuts) in enumerate(itertools.product(["velocity_verlet"], [True], [10000,])):
                     nuts_key_with_tuning = jax.random.fold_in(nuts_key_with_tuning, i)
-                    ####### run nuts
-                    ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _, tuning_integrator_steps = benchmark(
-                        model,
-                        nuts(target_acc_rate=0.8, integrator_type=integrator_type, preconditioning=preconditioning,return_ess_corr=return_ess_corr, num_tuning_steps=num_tuning_steps),
-                        nuts_key_with_tuning,
-                        n=models[model]["nuts"],
-                        batch=num_chains,
-                        pvmap=pvmap,
-                    )
-                    print(f"nuts, grads to low avg {grads_to_low_avg}")
-                    
-                    results[
-                        (
-                            model.name,
-                            model.ndims,
-                            "nuts",
-                            params["L"].mean().item(),
-                            params["step_size"].mean().item(),
-                            integrator_type,
-                            "standard",
-                            acceptance_rate.mean().item(),
-                            preconditioning,
-                            0,
-                            ess_avg,
-                            ess_corr.mean().item(),
-                            ess_corr.min().item(), (1/(1/ess_corr).mean()).item(),
-                            models[model]["nuts"],
-                            num_chains,
-                            None,
-                            -1,
-                            num_tuning_steps,
-                            tuning_integrator_steps
-                        )
-                    ] = ess
 
-                    # jax.debug.print("num_tuning_grads {x}", x=num_tuning_grads)
+                    config = config_id(model, "nuts", integrator_type, (0.8, preconditioning, num_tuning_steps_nuts, models[model]["nuts"], num_chains), key_index)
+                    if results.done(config):
+                        continue
 
-            print("done with nuts, ready to save")
-            df = pd.Series(results).reset_index()
-            df.columns = [
-               "model", "dims", "sampler", "L", "step_size", "integrator", "tuning", "acc_rate", "preconditioning", "inv_L_prop", "ess_avg", "ess_corr_avg", "ess_corr_min", "ess_corr_inv_mean", "num_steps", "num_chains", "worst", "num_windows", "num_tuning_steps", "tuning_integrator_steps", "ESS"]
-            # df.result = df.result.apply(lambda x: x[0].item())
-            # df.model = df.model.apply(lambda x: x[1])
-            df.to_csv(os.path.join(folder, f"nongridresults{model.name}{model.ndims}{key_index}.csv" ) ,index=False)
-            print(f"saved results to {model.name}{model.ndims}{key_index}.csv")
+                    jobs.append(Job(config, estimated_cost(model, models[model]["nuts"], num_chains),
+                                    partial(nuts_job, model, results, config, integrator_type, preconditioning, num_tuning_steps_nuts, nuts_key_with_tuning)))
+
+    print(f"running {len(jobs)} benchmarks on {num_workers} workers")
+    run_jobs(jobs, num_workers)
+    print(f"results saved to {store}")
         
 
 
@@ -746,23 +862,25 @@ def bayes_opt():
     # def f(L, stepsize):
     #     return L-stepsize
     
+    # L and the step size are arguments of the compiled program, so all the proposals share one compilation
+    run_sampler = benchmark_sweep(
+        model=model,
+        sampler_fn=lambda L, step_size: adjusted_mclmc_no_tuning(
+            integrator_type=integrator_type,
+            initial_state=blackjax_state_after_tuning,
+            inverse_mass_matrix=blackjax_adjusted_mclmc_sampler_params.inverse_mass_matrix,
+            L=L,
+            step_size=step_size,
+            L_proposal_factor=L_proposal_factor,
+        ),
+        n=num_steps,
+        batch=num_chains,
+    )
+
     def make_f(key):
         def f(L, stepsize):
 
-                    ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _,_ = benchmark(
-                        model=model,
-                        sampler=adjusted_mclmc_no_tuning(
-                            integrator_type=integrator_type,
-                            initial_state=blackjax_state_after_tuning,
-                            inverse_mass_matrix=blackjax_adjusted_mclmc_sampler_params.inverse_mass_matrix,
-                            L=L,
-                            step_size=stepsize,
-                            L_proposal_factor=L_proposal_factor,
-                        ),
-                        key=key,
-                        n=num_steps,
-                        batch=num_chains,
-                    )
+                    ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _, _ = run_sampler(key, L, stepsize)
                     # jax.debug.print("{x} ESS", x=ess)
                     # jax.debug.print("{x} L stepsize", x=(L, stepsize))
                     return ess
@@ -792,7 +910,7 @@ def bayes_opt():
     
     print(opt_state.best_params)
 
-    ess, ess_avg, ess_corr, _, acceptance_rate, grads_to_low_avg, _,_ = benchmark(
+    ess, ess_avg, ess_corr, _, acceptance_rate, grads_to_low_avg, _, _, _ = benchmark(
         model,
         adjusted_mclmc_no_tuning(
             integrator_type=integrator_type,
@@ -5,15 +5,13 @@ sys.path.append("./")
 sys.path.append("../blackjax")
 
 from benchmarks.benchmark import run_benchmarks
+from benchmarks.parallel import shard_chains
+from benchmarks.sampling_algorithms import BiasRecording, EarlyStopping
 from benchmarks.inference_models import Banana, Brownian, Funnel, Gaussian, GermanCredit, ItemResponseTheory, Rosenbrock, StochasticVolatility, rng_inference_gym_icg
 
-import os
-import jax 
 
 batch_size = 128
 
-os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=" + str(batch_size)
-num_cores = jax.local_device_count()
 
 models = {
 
@@ -37,4 +35,4 @@ models2 = {
         # Funnel(): {'mclmc': 200000, 'adjusted_mclmc': 10000000, 'adjusted_mchmc': 200000, 'adjusted_hmc': 200000, 'nuts': 100000},
     }
 
-run_benchmarks(batch_size=batch_size, models=models2, key_index=48, do_grid_search=False, do_fast_grid_search=False, do_non_grid_search=True, return_ess_corr=False, integrators = ["velocity_verlet"], pvmap=jax.pmap, num_tuning_steps=20000, do_nuts=True, do_adjusted_mclmc=False, do_adjusted_mclmc_with_nuts_tuning=True, do_unadjusted_mclmc=False)
+run_benchmarks(batch_size=batch_size, models=models2, key_index=48, do_grid_search=False, do_fast_grid_search=False, do_non_grid_search=True, return_ess_corr=False, integrators = ["velocity_verlet"], pvmap=shard_chains, num_tuning_steps=20000, do_nuts=True, do_adjusted_mclmc=False, do_adjusted_mclmc_with_nuts_tuning=True, do_unadjusted_mclmc=False, resume=True, early_stopping=EarlyStopping(block_size=4000), bias_recording=BiasRecording())
@@ -8,11 +8,7 @@ sys.path.append("../blackjax")
 from benchmarks.benchmark import run_benchmarks
 from benchmarks.inference_models import Brownian, Gaussian, GermanCredit, ItemResponseTheory, Rosenbrock, StochasticVolatility
 
-import os
-import jax 
 
-os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=" + str(128)
-num_cores = jax.local_device_count()
 
 models = {
     Gaussian(d, k, eigenvalues=eigenval_type): {'mclmc': 100000, 'adjusted_mclmc': 40000, 'adjusted_mchmc': 40000, 'adjusted_hmc': 40000, 'nuts': 40000}
@@ -8,11 +8,7 @@ sys.path.append("../blackjax")
 from benchmarks.benchmark import run_benchmarks
 from benchmarks.inference_models import Brownian, Gaussian, GermanCredit, ItemResponseTheory, Rosenbrock, StochasticVolatility
 
-import os
-import jax 
 
-os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=" + str(64)
-num_cores = jax.local_device_count()
 
 first_list = np.array([2,3,4,5,6,7,8,9])
 second_list = np.ceil(np.logspace(2, 5, num=10)).astype(int)[5:]
@@ -23,6 +19,7 @@ models = {model(d): {'mclmc': 10000, 'adjusted_mclmc': 10000, 'adjusted_mchmc':
         lambda d: Rosenbrock(d),
         lambda dim : Gaussian(dim, condition_number=100, eigenvalues='log'), 
         lambda dim: Gaussian(dim, condition_number=1., eigenvalues='linear'), 
+        # lambda dim: Gaussian(dim, condition_number=100, eigenvalues='log', numpy_seed=0, rotation='dct'), # rotated, O(d log d) per gradient
                                        ]
     }
 
@@ -0,0 +1,69 @@
+import os
+import time
+
+import jax
+
+
+# Persistent XLA compilation cache and ahead-of-time compilation of the sampler programs.
+#
+# The tuning and sampling scans of large models (StochasticVolatility, MixedLogit, ...) take minutes to compile.
+# With the persistent cache, a compiled program is stored on disk, keyed by its HLO (so by the model, the sampler and the shapes of the inputs),
+# and the next run of the same benchmark loads it instead of compiling it again.
+# aot_compile lowers and compiles a program before it runs, so that the compile time can be measured and reported on its own:
+# a cold start compiles from scratch, a warm start is served by the persistent cache.
+
+
+# number of programs that were found / not found in the persistent cache
+cache_events = {'hits': 0, 'misses': 0, 'listening': False}
+
+
+def count_cache_events(event, **kwargs):
+    if event == '/jax/compilation_cache/cache_hits':
+        cache_events['hits'] += 1
+    elif event == '/jax/compilation_cache/cache_misses':
+        cache_events['misses'] += 1
+
+
+def enable_compilation_cache(folder=None):
+    """store compiled programs on disk in folder (default: $JAX_COMPILATION_CACHE_DIR or ~/.cache/mclmc/jax)"""
+
+    if folder is None:
+        folder = os.environ.get('JAX_COMPILATION_CACHE_DIR', os.path.expanduser('~/.cache/mclmc/jax'))
+    os.makedirs(folder, exist_ok=True)
+    jax.config.update('jax_compilation_cache_dir', folder)
+    jax.config.update('jax_persistent_cache_min_compile_time_secs', 0.5)
+
+    if not cache_events['listening']:
+        jax.monitoring.register_event_listener(count_cache_events)
+        cache_events['listening'] = True
+
+
+def signature(args):
+    """shapes and dtypes of the arguments, e.g. 'float32[128,100], key<fry>[128]'"""
+    return ', '.join(f"{x.dtype}{list(x.shape)}" for x in jax.tree_util.tree_leaves(args))
+
+
+def aot_compile(fn, *args, name='program'):
+    """Lowers and compiles fn for the shapes of args.
+
+    Args:
+        fn: a jax.pmap-ed or jax.jit-ed function (anything else is jitted)
+        name: used in the report, typically model name and the stage (tuning, sampling)
+
+    Returns:
+        compiled: the compiled program, call it as compiled(*args)
+        compile_time: in seconds
+        start: 'cold' if the program had to be compiled by XLA, 'warm' if it was loaded from the cache
+    """
+
+    program = fn if hasattr(fn, 'lower') else jax.jit(fn)
+    hits, misses = cache_events['hits'], cache_events['misses']
+
+    tic = time.time()
+    compiled = program.lower(*args).compile()
+    compile_time = time.time() - tic
+
+    start = 'warm' if cache_events['hits'] > hits and cache_events['misses'] == misses else 'cold'
+    print(f"compiled {name} ({signature(args)}) in {compile_time:.2f}s, {start} start")
+
+    return compiled, compile_time, start
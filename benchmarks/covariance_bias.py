@@ -0,0 +1,130 @@
+import math
+from typing import NamedTuple
+
+import jax
+import jax.numpy as jnp
+
+
+# Bias of the covariance matrix, b = Tr[(I - Sigma^-1 C)^2] / d, where C = E[(x - E_x)(x - E_x)^T] is estimated from the samples of a single chain.
+#
+# Storing E[x_i x_j] with store_only_expectation_values (state_transform = jnp.outer(x, x)) adds a d x d outer product to the accumulator at every step
+# and computes the bias with two d x d matmuls at every saved step, which does not scale past d ~ 1000. Here instead:
+#   - the samples are collected in blocks of block_size steps and added to the accumulator with a single rank-k update X^T X (a matmul instead of k outer products),
+#   - the bias is only computed at the checkpoints,
+#   - with method='sketch', only C L Omega is accumulated, where L L^T = Sigma^-1 and Omega are rank random +-1 probe vectors (memory d x rank instead of d x d).
+#     Tr[(I - Sigma^-1 C)^2] = Tr[(I - L^T C L)^2] = E_omega |omega - L^T C L omega|^2 is then a Hutchinson estimate, with a relative error ~ sqrt(2 / rank).
+
+
+class CovarianceBias(NamedTuple):
+    """method: 'exact' (running average of the full covariance matrix) or 'sketch' (see above)
+    block_size: number of steps in one rank-k update of the accumulator (must divide steps_per_checkpoint, otherwise their gcd is used)
+    rank: number of probe vectors for method='sketch'
+    """
+
+    method: str = 'exact'
+    block_size: int = 100
+    rank: int = 64
+
+
+def precision(model):
+    """Sigma^-1 of the model: (d, ) if the covariance is diagonal, (d, d) otherwise"""
+
+    if not hasattr(model, 'inv_cov'):
+        raise Exception(f"{model.name} has no inverse covariance matrix (inv_cov), the covariance bias can not be computed. Gaussians with rotation='dct' do not store it.")
+    return model.inv_cov
+
+
+def exact_accumulator(model):
+
+    inv_cov = precision(model)
+
+    def init():
+        return jnp.zeros((model.ndims, model.ndims))
+
+    def update(cov, X, n, k=None):
+        """running average (as in Welford's algorithm), with the k new samples added at once (the other rows of X are zero), n is the number of samples including them"""
+        k = X.shape[0] if k is None else k
+        return jnp.where(n > 0, cov + (X.T @ X - k * cov) / jnp.maximum(n, 1), cov)
+
+    def bias(cov):
+        # Tr[(I - P)^2] = d - 2 Tr[P] + Tr[P P], with a single matmul
+        P = inv_cov[:, None] * cov if inv_cov.ndim == 1 else inv_cov @ cov
+        return (model.ndims - 2 * jnp.trace(P) + jnp.sum(P * P.T)) / model.ndims
+
+    return init, update, bias
+
+
+def sketch_accumulator(model, rank, key):
+
+    probes = jax.random.rademacher(key, (model.ndims, rank), dtype=float)
+
+    if hasattr(model, 'cov_cholesky'):
+        # L = K^-T, where K K^T = Sigma (see benchmarks/data_store.py), such that Sigma^-1 is never formed
+        K = model.cov_cholesky
+        projection = jax.scipy.linalg.solve_triangular(K, probes, lower=True, trans='T')
+        L_T = lambda sketch: jax.scipy.linalg.solve_triangular(K, sketch, lower=True)
+    elif precision(model).ndim == 1: # diagonal, L = sqrt(Sigma^-1)
+        L = jnp.sqrt(model.inv_cov)
+        projection = L[:, None] * probes
+        L_T = lambda sketch: L[:, None] * sketch
+    else:
+        L = jnp.linalg.cholesky(model.inv_cov)
+        projection = L @ probes
+        L_T = lambda sketch: L.T @ sketch
+
+    def init():
+        return jnp.zeros((model.ndims, rank))
+
+    def update(sketch, X, n, k=None):
+        """running average of C L Omega"""
+        k = X.shape[0] if k is None else k
+        return jnp.where(n > 0, sketch + (X.T @ (X @ projection) - k * sketch) / jnp.maximum(n, 1), sketch)
+
+    def bias(sketch):
+        residual = probes - L_T(sketch)
+        return jnp.sum(jnp.square(residual)) / (rank * model.ndims)
+
+    return init, update, bias
+
+
+def covariance_bias(model, alg, initial_state, key, num_checkpoints, steps_per_checkpoint, burn_in=0, config=CovarianceBias()):
+    """Runs alg for num_checkpoints * steps_per_checkpoint steps and computes the bias of the covariance matrix at the checkpoints.
+    The first burn_in steps are part of these steps, but their samples are not used (as with the burn_in of store_only_expectation_values).
+
+    Returns:
+        bias: array of shape (num_checkpoints, )
+        info: info of the last step before each checkpoint (as with blackjax.util.thinning)
+    """
+
+    sketch_key, key = jax.random.split(key)
+
+    if config.method == 'exact':
+        init, update, bias = exact_accumulator(model)
+    elif config.method == 'sketch':
+        init, update, bias = sketch_accumulator(model, config.rank, sketch_key)
+    else:
+        raise Exception("method = " + config.method + " is not implemented. Use 'exact' or 'sketch'.")
+
+    block_size = math.gcd(config.block_size, steps_per_checkpoint)
+    num_blocks = steps_per_checkpoint // block_size
+
+    def step(state, key):
+        state, info = alg.step(key, state)
+        return state, (model.transform(state.position) - model.E_x, info)
+
+    def block(carry, key):
+        state, accumulator, n, t = carry
+        state, (X, info) = jax.lax.scan(step, state, jax.random.split(key, block_size))
+        used = t + jnp.arange(block_size) >= burn_in
+        k = jnp.sum(used)
+        n = n + k
+        last_info = jax.tree_util.tree_map(lambda x: x[-1], info)
+        return (state, update(accumulator, X * used[:, None], n, k), n, t + block_size), last_info
+
+    def checkpoint(carry, key):
+        carry, info = jax.lax.scan(block, carry, jax.random.split(key, num_blocks))
+        return carry, (bias(carry[1]), jax.tree_util.tree_map(lambda x: x[-1], info))
+
+    _, (b, info) = jax.lax.scan(checkpoint, (initial_state, init(), 0, 0), jax.random.split(key, num_checkpoints))
+
+    return b, info
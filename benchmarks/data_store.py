@@ -0,0 +1,85 @@
+import functools
+import os
+
+import numpy as np
+
+
+# Datasets and ground truth of the targets in inference_models.py, loaded only when they are first used.
+#
+# The models declare them as lazy class attributes, so constructing a model (e.g. to get its name) does not touch the disk:
+#
+#     class GermanCredit(GroundTruthCovariance, GroundTruthMoments):
+#         features = lazy(lambda self: dataset('gc_features'))
+#
+# The .npy files are memory-mapped and every file is read at most once per process, also if there are many instances of the model.
+# Everything is kept as numpy arrays (memory-mapped where possible), never as jax arrays: the first access often happens while a function is traced,
+# and jax then uses the arrays as constants, so no tracer or device copy ends up in the caches.
+# The covariance matrix is factorized with a Cholesky decomposition instead of inverted. The factor is cached on disk (ground_truth/name/cov_cholesky.npy),
+# and computed again if cov.npz is newer than the cache.
+
+dirr = os.path.dirname(os.path.realpath(__file__)) + '/'
+
+
+def lazy(load):
+    """model attribute which is computed by load(model) on first access and then stored on the instance (it can still be overwritten)"""
+    return functools.cached_property(load)
+
+
+@functools.lru_cache(maxsize=None)
+def dataset(name):
+    """data/name.npy"""
+    return np.load(dirr + 'data/' + name + '.npy', mmap_mode='r')
+
+
+@functools.lru_cache(maxsize=None)
+def moments(name):
+    """E_x2, Var_x2 from ground_truth/name/moments.npy"""
+    E_x2, Var_x2 = np.load(dirr + 'ground_truth/' + name + '/moments.npy', mmap_mode='r')
+    return E_x2, Var_x2
+
+
+@functools.lru_cache(maxsize=None)
+def covariance(name):
+    """E_x, cov from ground_truth/name/cov.npz"""
+    cov_data = np.load(dirr + 'ground_truth/' + name + '/cov.npz')
+    return cov_data['x_avg'], cov_data['cov']
+
+
+@functools.lru_cache(maxsize=None)
+def cov_cholesky(name):
+    """lower triangular L with L L^T = cov"""
+
+    source = dirr + 'ground_truth/' + name + '/cov.npz'
+    cache = dirr + 'ground_truth/' + name + '/cov_cholesky.npy'
+    if os.path.isfile(cache) and os.path.getmtime(cache) >= os.path.getmtime(source):
+        return np.load(cache, mmap_mode='r')
+
+    L = np.linalg.cholesky(np.asarray(covariance(name)[1], dtype=np.float64))
+    try:
+        np.save(cache + '.tmp.npy', L)
+        os.replace(cache + '.tmp.npy', cache)
+    except OSError: # e.g. read-only checkout, the factor is then computed in every process
+        pass
+    return L
+
+
+@functools.lru_cache(maxsize=None)
+def inv_cov(name):
+    L_inv = np.linalg.solve(cov_cholesky(name), np.eye(len(cov_cholesky(name))))
+    return L_inv.T @ L_inv
+
+
+class GroundTruthCovariance:
+    """E_x, cov, cov_cholesky and inv_cov of a target with ground_truth/name/cov.npz"""
+
+    E_x = lazy(lambda self: covariance(self.name)[0])
+    cov = lazy(lambda self: covariance(self.name)[1])
+    cov_cholesky = lazy(lambda self: cov_cholesky(self.name))
+    inv_cov = lazy(lambda self: inv_cov(self.name))
+
+
+class GroundTruthMoments:
+    """E_x2, Var_x2 of a target with ground_truth/name/moments.npy"""
+
+    E_x2 = lazy(lambda self: moments(self.name)[0])
+    Var_x2 = lazy(lambda self: moments(self.name)[1])
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from benchmarks.parallel import shard_chains
+from benchmarks.tuning_cache import key_to_seed
+
+
+# Evaluates func(x, y, z, ..., key) on the full grid x \times y \times z ... for many random keys (realizations), distributed over all the devices of a cluster.
+#
+# Usage (see distributed.py):
+#     initialize()
+#     grid, func, save_name = setup()
+#     results = run_grid(grid, func, 'results/' + save_name, num_realizations=64)
+#     if results is not None: # only the first process returns the results
+#         jnp.save(save_name, results)
+#
+# The grid points and realizations are flattened into a list of work items, which is cut in shards of shard_size items.
+# Each process takes every process_count-th shard and evaluates it on its local devices (vmapped and split over the devices with shard_chains,
+# the last shard is padded, so any number of items and devices works). The processes do not communicate: as soon as a shard is done,
+# it is saved in folder/shard_00012.npz, and with resume=True the shards which are already on disk are skipped, e.g. after the job was pre-empted.
+# folder/grid.json identifies the run (grid values, key, number of realizations, shard size), shards of a different run are never reused.
+# When all the shards are on disk, the first process assembles them. If no new shard appears for timeout seconds (e.g. a process died), it fails with the missing shards.
+#
+# For testing without a cluster, launch_local(num_processes) runs the same script in several local cpu processes.
+
+
+def initialize():
+    """jax.distributed.initialize on a cluster. Does nothing in the processes started by launch_local (they are independent)."""
+
+    if 'GRID_PROCESS_ID' not in os.environ:
+        jax.distributed.initialize()
+
+
+def process_index():
+    return int(os.environ['GRID_PROCESS_ID']) if 'GRID_PROCESS_ID' in os.environ else jax.process_index()
+
+
+def process_count():
+    return int(os.environ['GRID_NUM_PROCESSES']) if 'GRID_NUM_PROCESSES' in os.environ else jax.process_count()
+
+
+def launch_local(num_processes, devices_per_process=1, argv=None):
+    """Runs the script (by default the one that is running, with the same arguments) in num_processes local processes on the cpu, each with devices_per_process devices,
+    as if they were the processes of a cluster job. Returns the exit code (nonzero if any of the processes failed)."""
+
+    argv = sys.argv if argv is None else argv
+    processes = []
+    for i in range(num_processes):
+        env = {**os.environ,
+               'GRID_PROCESS_ID': str(i), 'GRID_NUM_PROCESSES': str(num_processes),
+               'JAX_PLATFORMS': 'cpu', 'XLA_FLAGS': f'--xla_force_host_platform_device_count={devices_per_process}'}
+        processes.append(subprocess.Popen([sys.executable] + list(argv), env=env))
+
+    return max(process.wait() for process in processes)
+
+
+def shard_path(folder, index):
+    return os.path.join(folder, f'shard_{index:05d}.npz')
+
+
+def grid_metadata(grid, key, num_realizations, shard_size):
+    """identifies the run: the shards of runs with different metadata can not be mixed"""
+
+    grid_bytes = b''.join(np.asarray(x, dtype=np.float64).tobytes() + b';' for x in grid)
+    return {'grid_shape': [len(x) for x in grid], 'grid_hash': hashlib.sha256(grid_bytes).hexdigest(),
+            'key': key_to_seed(key), 'num_realizations': num_realizations, 'shard_size': shard_size}
+
+
+def check_metadata(folder, metadata, poll_interval=10, timeout=3600):
+    """the shards in the folder have to come from the same grid, otherwise resuming would mix different runs.
+        The first process writes the metadata of a new folder, the others wait for it."""
+
+    path = os.path.join(folder, 'grid.json')
+    if process_index() == 0 and not os.path.exists(path):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.replace(path + '.tmp', path)
+
+    tic = time.time()
+    while not os.path.exists(path):
+        if timeout is not None and time.time() - tic > timeout:
+            raise Exception(f"process 0 did not write {path} in {timeout}s")
+        time.sleep(poll_interval)
+
+    with open(path) as f:
+        saved = json.load(f)
+    if saved != metadata:
+        raise Exception(f"{folder} contains the shards of a different grid: {saved}, now running {metadata}. Use a different folder or delete it.")
+
+
+def run_grid(grid, func, folder, num_realizations=1, key=None, shard_size=None, resume=True, poll_interval=10, timeout=3600):
+    """Args:
+        grid: tuple of 1d arrays (x, y, z, ...), any number of them
+        func: function (x, y, z, ..., key) -> pytree of arrays, for a single grid point and a single random key
+        folder: where the shards are saved
+        num_realizations: number of random keys, the same keys are used at all grid points
+        key: random key from which the realizations are split, jax.random.key(42) by default
+        shard_size: number of work items in a shard, by default such that every process gets 4 shards
+        resume: skip the shards which are already in the folder
+        timeout: seconds after which the first process gives up if no new shard has appeared (or another process waits for the metadata), None to wait forever
+
+    Returns:
+        on the first process: pytree of arrays of shape (num_realizations, len(x), len(y), len(z), ..., output shape), None on the other processes
+    """
+
+    key = jax.random.key(42) if key is None else key
+    grid_shape = tuple(len(x) for x in grid)
+    num_items = num_realizations * math.prod(grid_shape)
+    num_processes, index = process_count(), process_index()
+    shard_size = -(-num_items // (4 * num_processes)) if shard_size is None else shard_size
+    num_shards = -(-num_items // shard_size)
+
+    os.makedirs(folder, exist_ok=True)
+    check_metadata(folder, grid_metadata(grid, key, num_realizations, shard_size), poll_interval, timeout)
+
+    # work item i is the grid point i % num_cells with the key i // num_cells
+    points = [np.asarray(x).reshape(-1) for x in np.meshgrid(*[np.asarray(x) for x in grid], indexing='ij')]
+    keys = jax.random.split(key, num_realizations)
+    num_cells = len(points[0]) if points else 1
+
+    execute = shard_chains(func)
+
+    for shard in range(index, num_shards, num_processes):
+        path = shard_path(folder, shard)
+        if resume and os.path.exists(path):
+            continue
+
+        # the last shard is padded with copies of the last item, such that all shards have the same shape and the program is only compiled once
+        items = np.minimum(np.arange(shard * shard_size, (shard + 1) * shard_size), num_items - 1)
+        num_valid = min(shard_size, num_items - shard * shard_size)
+
+        tic = time.time()
+        output = execute(*[jnp.asarray(x[items % num_cells]) for x in points], keys[items // num_cells])
+        leaves = [np.asarray(x)[:num_valid] for x in jax.tree_util.tree_leaves(output)]
+
+        np.savez(path + '.tmp.npz', *leaves)
+        os.replace(path + '.tmp.npz', path)
+        print(f"[{index}]: shard {shard + 1}/{num_shards} done in {time.time() - tic:.1f}s")
+
+    if index != 0:
+        return None
+
+    # wait for the other processes
+    missing = [shard for shard in range(num_shards) if not os.path.exists(shard_path(folder, shard))]
+    last_progress = time.time()
+    while missing:
+        if timeout is not None and time.time() - last_progress > timeout:
+            raise Exception(f"no new shard in {folder} for {timeout}s, missing shards: {missing}. Rerun with resume=True to compute them.")
+        time.sleep(poll_interval)
+        still_missing = [shard for shard in missing if not os.path.exists(shard_path(folder, shard))]
+        if len(still_missing) < len(missing):
+            last_progress = time.time()
+        missing = still_missing
+
+    return collect(folder, grid, func, num_realizations, num_shards)
+
+
+def collect(folder, grid, func, num_realizations, num_shards):
+    """assembles the shards in the folder"""
+
+    output_shape = jax.eval_shape(func, *[jnp.asarray(x)[0] for x in grid], jax.random.key(0))
+    treedef = jax.tree_util.tree_structure(output_shape)
+    grid_shape = tuple(len(x) for x in grid)
+
+    shards = [np.load(shard_path(folder, shard)) for shard in range(num_shards)]
+    leaves = [np.concatenate([s[f'arr_{i}'] for s in shards]).reshape(num_realizations, *grid_shape, *leaf.shape)
+              for i, leaf in enumerate(jax.tree_util.tree_leaves(output_shape))]
+
+    return jax.tree_util.tree_unflatten(treedef, leaves)
@@ -0,0 +1,82 @@
+import copy
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+
+# Counts the evaluations of the log density and of its gradient, for each chain, in the compiled program.
+#
+# The counter is a jax.Ref (a mutable array) which is created in the function of a single chain, so under vmap, pmap and shard_map each chain has its own.
+# The counted log density increments it on every evaluation, also inside while loops whose number of iterations differs between the chains
+# (nuts trajectories, early stopping): a vmapped while loop does not count the iterations of the chains which are already done.
+# The counts are read at the end of the chain and returned as an additional output, there is no host callback:
+#
+#     def chain(model, key):
+#         ...
+#     outputs, counts = jax.vmap(lambda key: counting(chain)(model, key))(keys) # counts[:, 0] value evaluations, counts[:, 1] gradient evaluations of each chain
+#
+# A call of jax.grad or jax.value_and_grad counts as one gradient evaluation and no value evaluation.
+# Only reverse mode derivatives of the counted log density are supported (this is what the samplers use),
+# and it can not be vmapped inside the chain (e.g. by pathfinder, which vmaps the log density over the samples of the ELBO).
+
+
+def counted(logdensity_fn, counts):
+    """logdensity_fn which adds its evaluations to counts, a jax.Ref of shape (2, ): [value evaluations, gradient evaluations]"""
+
+    @jax.custom_vjp
+    def fn(x):
+        counts[0] += 1
+        return logdensity_fn(x)
+
+    def fn_fwd(x):
+        counts[1] += 1
+        return jax.value_and_grad(logdensity_fn)(x)
+
+    def fn_bwd(grad, cotangent):
+        return (jax.tree_util.tree_map(lambda g: cotangent * g, grad), )
+
+    fn.defvjp(fn_fwd, fn_bwd)
+    return fn
+
+
+def counting(fn):
+    """fn(model, *args) of a single chain -> function with the same arguments which returns (fn(model, *args), counts),
+        where counts = [value evaluations, gradient evaluations] of model.logdensity_fn during fn"""
+
+    def counting_fn(model, *args, **kwargs):
+        counts = jax.new_ref(jnp.zeros(2, dtype=int))
+        counted_model = copy.copy(model)
+        counted_model.logdensity_fn = counted(model.logdensity_fn, counts)
+        output = fn(counted_model, *args, **kwargs)
+        return output, counts[...]
+
+    return counting_fn
+
+
+class EvalCounter:
+    """Evaluation counts of all the chains, separately for each stage (e.g. 'tuning', 'sampling'), summed over the runs which are added.
+
+    Usage:
+        counter = EvalCounter(num_chains)
+        outputs, counts = shard_chains(lambda key: counting(chain)(model, key))(keys)
+        counter.add('sampling', counts)
+        counter.result()['sampling']['grad'] # number of gradient evaluations of each chain
+    """
+
+    def __init__(self, num_chains):
+        self.num_chains = num_chains
+        self.counts = {}
+
+    def add(self, stage, counts):
+        """counts: the counts returned by counting(fn), shape (num_chains, 2)"""
+
+        if stage not in self.counts:
+            self.counts[stage] = {'value': np.zeros(self.num_chains, dtype=int), 'grad': np.zeros(self.num_chains, dtype=int)}
+        counts = np.asarray(counts)
+        self.counts[stage]['value'] += counts[:, 0]
+        self.counts[stage]['grad'] += counts[:, 1]
+
+    def result(self):
+        """{stage: {'value': array of shape (num_chains, ), 'grad': array of shape (num_chains, )}}"""
+        return self.counts
@@ -4,16 +4,16 @@ import time
 
 sys.path.append("./")
 sys.path.append("../blackjax")
-import os
 
 import jax
 import jax.numpy as jnp
 import blackjax
 
-os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=" + str(128)
-num_cores = jax.local_device_count()
 
 from metrics import benchmark
+from benchmarks.compilation import enable_compilation_cache
+from benchmarks.parallel import shard_chains
+from benchmarks.sampling_algorithms import BiasRecording, EarlyStopping
 from benchmarks.lattice import Phi4
 from benchmarks.sampling_algorithms import (
 
@@ -38,6 +38,9 @@ from benchmarks.inference_models import (
     StochasticVolatility,
 )
 
+# reuse the compiled programs of the previous runs (see benchmarks/compilation.py)
+enable_compilation_cache()
+
 model = Banana()
 # model = Gaussian(ndims=10,condition_number=1)
 # model = GermanCredit()
@@ -61,7 +64,7 @@ num_chains = 128
 #     key=jax.random.PRNGKey(1), 
 #     n=n,
 #     batch=num_chains, 
-#     pvmap=jax.pmap 
+#     pvmap=shard_chains 
 # )
 # toc = time.time()
 # print(f"Time elapsed {toc-tic}")
@@ -69,17 +72,19 @@ num_chains = 128
 # print(f"\nGradient calls for unadjusted MCLMC to reach standardized RMSE of X^2 of 0.1: {grads_to_low_max} (avg over {num_chains} chains and dimensions)")
 
 
-tic = time.time()
+timings = {}
 ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_max, _,bias, _ = benchmark(
     model=model,
     sampler=adjusted_mclmc(target_acc_rate=0.99, integrator_type="velocity_verlet", preconditioning=True, num_windows=2,num_tuning_steps=100000),
     key=jax.random.PRNGKey(1), 
     n=n,
     batch=num_chains, 
-    pvmap=jax.pmap 
+    pvmap=shard_chains,
+    timings=timings,
+    early_stopping=EarlyStopping(block_size=10000),
+    bias_recording=BiasRecording(),
 )
-toc = time.time()
-print(f"Time elapsed {toc-tic}")
+print(f"Time elapsed {timings['wall_time']} (compilation {timings['compile_time']}, tuning {timings['tuning_time']}, sampling {timings['sampling_time']}), ESS per second {timings['ess_per_second']}")
 
 print(f"\nacc rate 0.9, lprop inf, Gradient calls for adjusted MCLMC to reach standardized RMSE of X^2 of 0.1: {grads_to_low_max} (avg over {num_chains} chains and dimensions)")
 
@@ -94,7 +99,7 @@ ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_max, _,bias, _ = b
     key=jax.random.PRNGKey(1), 
     n=n,
     batch=num_chains, 
-    pvmap=jax.pmap 
+    pvmap=shard_chains 
 )
 toc = time.time()
 print(f"Time elapsed {toc-tic}")
@@ -110,7 +115,7 @@ ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_max, _,bias, _ = b
     key=jax.random.PRNGKey(1), 
     n=n,
     batch=num_chains, 
-    pvmap=jax.pmap 
+    pvmap=shard_chains 
 )
 toc = time.time()
 print(f"Time elapsed {toc-tic}")
@@ -126,7 +131,7 @@ ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_max, _,bias, _ = b
     key=jax.random.PRNGKey(1), 
     n=n,
     batch=num_chains, 
-    pvmap=jax.pmap 
+    pvmap=shard_chains 
 )
 toc = time.time()
 print(f"Time elapsed {toc-tic}")
@@ -3,17 +3,15 @@ import sys
 
 sys.path.append("./")
 sys.path.append("../blackjax")
-import os
 from benchmarks.benchmark import grid_search_only_L
 
 import jax
 import jax.numpy as jnp
 
-os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=" + str(128)
-num_cores = jax.local_device_count()
 
 
 from metrics import benchmark, grid_search, grid_search_langevin_mams
+from benchmarks.parallel import shard_chains
 from benchmarks.sampling_algorithms import (
 
     adjusted_mclmc_no_tuning,
@@ -73,7 +71,7 @@ results, edge, state = grid_search_langevin_mams(
     integrator_type='mclachlan',
     num_steps=num_steps,
     num_chains=num_chains,
-    pvmap=jax.pmap
+    pvmap=shard_chains
 )
 print(results[0], results[1])
 print(results[2])
@@ -148,7 +146,7 @@ raise Exception
 #                 key=jax.random.PRNGKey(1),
 #                 n=1000,
 #                 batch=2,
-#                 pvmap=jax.pmap,
+#                 pvmap=shard_chains,
 #             )
 
 # print(ess)
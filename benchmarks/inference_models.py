@@ -2,8 +2,10 @@
 import time
 import jax
 import jax.numpy as jnp
+from jax.scipy.fft import dct, idct
 import numpy as np
 import os
+from benchmarks import data_store
 #import numpyro.distributions as dist
 dirr = os.path.dirname(os.path.realpath(__file__)) + '/'
 
@@ -14,10 +16,16 @@ dirr = os.path.dirname(os.path.realpath(__file__)) + '/'
 #   - logdensity_fn: - log p of the target distribution
 #   - sample_init: a function to initialize the sampler (typically a random draw from the prior distribution). Takes a random key and returns a parameter vector.
 #   - transform: a map from the unconstrained to the constrained parameter space
+#
+# Optionally:
+#   - batched_logdensity_fn: logdensity_fn of many chains at once, X of shape (num_chains, ndims) -> (num_chains, ). 
+#     Data-heavy targets implement it with matrix-matrix products, see benchmarks/batching.py for how the samplers use it.
 # 
 # Most targets also have ground truth moments:
 #   - E_x2 = [E[x_i^2] for i in range(ndims)]
 #   - Var_x2 = [Var[x_i^2] for i in range(ndims)]
+#
+# Datasets and ground truth which are stored on disk are lazy attributes (see benchmarks/data_store.py): they are only loaded when they are first used.
 
 
 
@@ -27,7 +35,7 @@ class StochasticGaussian():
     """Gaussian distribution. It has zero mean and is therefore completely specified by the covariance matrix. """
 
 
-    def __init__(self, ndims, condition_number= 1, eigenvalues= 'log', numpy_seed=None, initialization= 'wide', stochastic_grad = 0.):
+    def __init__(self, ndims, condition_number= 1, eigenvalues= 'log', numpy_seed=None, initialization= 'wide', stochastic_grad = 0., rotation= 'dense'):
         """Args:
             
             ndims: dimensionality
@@ -42,6 +50,11 @@ class StochasticGaussian():
             
             numpy_seed: By default covariance matrix is diagonal. You can randomly rotate it by passing this argument. Seed is used to generate a random rotation for the covariance matrix.
             
+            rotation: How the covariance matrix is rotated (if numpy_seed is given). Can be one of the
+                                'dense': a random rotation matrix R, from the QR decomposition of a Gaussian matrix. O(ndims^3) to construct and O(ndims^2) per gradient.
+                                'dct': the covariance matrix is C^T D C, where C is the orthonormal discrete cosine transform and the eigenvalues in D are randomly permuted. 
+                                       The matrices are never formed: O(ndims log ndims) per gradient, which makes ndims ~ 10^6 practical. cov and inv_cov are not available.
+            
             initialization: Which strategy to use to initialize chains. Can be one of the
                                 'mode': start from the mode of the distribution (x=0).
                                 'posterior': start already in the target distribution.
@@ -75,15 +88,23 @@ class StochasticGaussian():
         if numpy_seed == None:  # diagonal covariance matrix
             self.E_x2 = eigs
             #self.R = jnp.eye(ndims)
+            rotate = lambda z: z
             self.inv_cov = 1. / eigs
             self.cov = eigs
             self.logdensity_fn = lambda x: -0.5 * jnp.sum(jnp.square(x) * self.inv_cov + jnp.sum(jax.random.normal(jax.random.PRNGKey(seed = time.time_ns() % (2**32)), shape=(x.shape))  * x))* stochastic_grad
 
-        else:  # randomly rotate
+        elif rotation == 'dct':  # randomly rotate, without forming the matrices
+            eigs = jnp.asarray(eigs)[rng.permutation(ndims)]
+            self.E_x2 = dct_diagonal(eigs)
+            rotate = lambda z: idct(z, norm= 'ortho') # C^T z
+            self.logdensity_fn = lambda x: -0.5 * jnp.sum(jnp.square(dct(x, norm= 'ortho')) / eigs)
+
+        elif rotation == 'dense':  # randomly rotate
             D = jnp.diag(eigs)
             inv_D = jnp.diag(1 / eigs)
             R, _ = jnp.array(np.linalg.qr(rng.randn(ndims, ndims)))  # random rotation
             self.R = R
+            rotate = lambda z: self.R @ z
             self.inv_cov = R @ inv_D @ R.T
             self.cov = R @ D @ R.T
             self.E_x2 = jnp.diagonal(R @ D @ R.T)
@@ -93,6 +114,9 @@ class StochasticGaussian():
 
             self.logdensity_fn = lambda x: -0.5 * x.T @ self.inv_cov @ x #+ jnp.sum(jax.random.normal(jax.random.PRNGKey(seed = time.time_ns() % (2**32)), shape=(x.shape)) * stochastic_grad * x)
 
+        else:
+            raise ValueError('rotation = '+ str(rotation) + ' is not a valid option.')
+
         self.E_x = jnp.zeros(ndims)
         self.Var_x2 = 2 * jnp.square(self.E_x2)
 
@@ -104,7 +128,7 @@ class StochasticGaussian():
             self.sample_init = lambda key: jnp.zeros(ndims)
 
         elif initialization == 'posterior':
-            self.sample_init = lambda key: self.R @ (jax.random.normal(key, shape=(ndims,)) * jnp.sqrt(eigs))
+            self.sample_init = lambda key: rotate(jax.random.normal(key, shape=(ndims,)) * jnp.sqrt(eigs))
 
         elif initialization == 'wide': # N(0, sigma_true_max)
             self.sample_init = lambda key: jax.random.normal(key, shape=(ndims,)) * jnp.max(jnp.sqrt(eigs)) #* 1.3
@@ -116,7 +140,7 @@ class Gaussian():
     """Gaussian distribution. It has zero mean and is therefore completely specified by the covariance matrix. """
 
 
-    def __init__(self, ndims, condition_number= 1, eigenvalues= 'log', numpy_seed=None, initialization= 'wide'):
+    def __init__(self, ndims, condition_number= 1, eigenvalues= 'log', numpy_seed=None, initialization= 'wide', rotation= 'dense'):
         """Args:
             
             ndims: dimensionality
@@ -131,6 +155,11 @@ class Gaussian():
             
             numpy_seed: By default covariance matrix is diagonal. You can randomly rotate it by passing this argument. Seed is used to generate a random rotation for the covariance matrix.
             
+            rotation: How the covariance matrix is rotated (if numpy_seed is given). Can be one of the
+                                'dense': a random rotation matrix R, from the QR decomposition of a Gaussian matrix. O(ndims^3) to construct and O(ndims^2) per gradient.
+                                'dct': the covariance matrix is C^T D C, where C is the orthonormal discrete cosine transform and the eigenvalues in D are randomly permuted. 
+                                       The matrices are never formed: O(ndims log ndims) per gradient, which makes ndims ~ 10^6 practical. cov and inv_cov are not available.
+            
             initialization: Which strategy to use to initialize chains. Can be one of the
                                 'mode': start from the mode of the distribution (x=0).
                                 'posterior': start already in the target distribution.
@@ -164,15 +193,23 @@ class Gaussian():
         if numpy_seed == None:  # diagonal covariance matrix
             self.E_x2 = eigs
             #self.R = jnp.eye(ndims)
+            rotate = lambda z: z
             self.inv_cov = 1. / eigs
             self.cov = eigs
             self.logdensity_fn = lambda x: -0.5 * jnp.sum(jnp.square(x) * self.inv_cov)
 
-        else:  # randomly rotate
+        elif rotation == 'dct':  # randomly rotate, without forming the matrices
+            eigs = jnp.asarray(eigs)[rng.permutation(ndims)]
+            self.E_x2 = dct_diagonal(eigs)
+            rotate = lambda z: idct(z, norm= 'ortho') # C^T z
+            self.logdensity_fn = lambda x: -0.5 * jnp.sum(jnp.square(dct(x, norm= 'ortho')) / eigs)
+
+        elif rotation == 'dense':  # randomly rotate
             D = jnp.diag(eigs)
             inv_D = jnp.diag(1 / eigs)
             R, _ = jnp.array(np.linalg.qr(rng.randn(ndims, ndims)))  # random rotation
             self.R = R
+            rotate = lambda z: self.R @ z
             self.inv_cov = R @ inv_D @ R.T
             self.cov = R @ D @ R.T
             self.E_x2 = jnp.diagonal(R @ D @ R.T)
@@ -182,6 +219,9 @@ class Gaussian():
 
             self.logdensity_fn = lambda x: -0.5 * x.T @ self.inv_cov @ x
 
+        else:
+            raise ValueError('rotation = '+ str(rotation) + ' is not a valid option.')
+
         self.E_x = jnp.zeros(ndims)
         self.Var_x2 = 2 * jnp.square(self.E_x2)
 
@@ -193,7 +233,7 @@ class Gaussian():
             self.sample_init = lambda key: jnp.zeros(ndims)
 
         elif initialization == 'posterior':
-            self.sample_init = lambda key: self.R @ (jax.random.normal(key, shape=(ndims,)) * jnp.sqrt(eigs))
+            self.sample_init = lambda key: rotate(jax.random.normal(key, shape=(ndims,)) * jnp.sqrt(eigs))
 
         elif initialization == 'wide': # N(0, sigma_true_max)
             self.sample_init = lambda key: jax.random.normal(key, shape=(ndims,)) * jnp.max(jnp.sqrt(eigs)) #* 1.3
@@ -403,7 +443,7 @@ class Funnel():
 
 
 
-class Funnel_with_Data():
+class Funnel_with_Data(data_store.GroundTruthCovariance):
 
     def __init__(self, d= 101, sigma= 1.):
 
@@ -418,8 +458,6 @@ class Funnel_with_Data():
         
         self.transform = lambda x: x
         
-        self.E_x, self.cov, self.inv_cov = load_cov(self.name, cov_only= True)
-        
 
     def simulate_data(self):
 
@@ -509,7 +547,7 @@ class Rosenbrock():
 
 
 
-class Brownian():
+class Brownian(data_store.GroundTruthCovariance, data_store.GroundTruthMoments):
     """
     log sigma_i ~ N(0, 2)
     log sigma_obs ~N(0, 2)
@@ -526,8 +564,6 @@ class Brownian():
         self.num_data = 30
         self.ndims = self.num_data + 2
 
-        self.E_x, self.E_x2, self.Var_x2, self.cov, self.inv_cov = load_cov(self.name)
-        
         self.data = jnp.array([0.21592641, 0.118771404, -0.07945447, 0.037677474, -0.27885845, -0.1484156, -0.3250906, -0.22957903,
                                -0.44110894, -0.09830782, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, -0.8786016, -0.83736074,
                                -0.7384849, -0.8939254, -0.7774566, -0.70238715, -0.87771565, -0.51853573, -0.6948214, -0.6202789])
@@ -548,6 +584,15 @@ class Brownian():
         return -lik - prior_x - prior_logsigma
 
 
+    def batched_logdensity_fn(self, X):
+        
+        lik = 0.5 * jnp.exp(-2 * X[:, 1]) * jnp.sum(self.observable * jnp.square(X[:, 2:] - self.data), axis=1) + X[:, 1] * self.num_observable
+        prior_x = 0.5 * jnp.exp(-2 * X[:, 0]) * (X[:, 2] ** 2 + jnp.sum(jnp.square(X[:, 3:] - X[:, 2:-1]), axis=1)) + X[:, 0] * self.num_data
+        prior_logsigma = 0.5 * jnp.sum(jnp.square(X / 2.0), axis=1)
+
+        return -lik - prior_x - prior_logsigma
+
+
     def transform(self, x):
         return jnp.concatenate((jnp.exp(x[:2]), x[2:]))
 
@@ -577,7 +622,7 @@ class Brownian():
         return walk + noise
 
 
-class GermanCredit:
+class GermanCredit(data_store.GroundTruthCovariance, data_store.GroundTruthMoments):
     """ Taken from inference gym.
 
         x = (global scale, local scales, weights)
@@ -595,17 +640,14 @@ class GermanCredit:
         We use a log transform for the scale parameters.
     """
 
+    labels = data_store.lazy(lambda self: data_store.dataset('gc_labels'))
+    features = data_store.lazy(lambda self: data_store.dataset('gc_features'))
+
     def __init__(self):
         
         self.name = 'GermanCredit'
         self.ndims = 51 #global scale + 25 local scales + 25 weights
         
-
-        self.labels = jnp.load(dirr + 'data/gc_labels.npy')
-        self.features = jnp.load(dirr + 'data/gc_features.npy')
-
-        self.E_x, self.E_x2, self.Var_x2, self.cov, self.inv_cov = load_cov(self.name)
-        
         
     def transform(self, x):
         return jnp.concatenate((jnp.exp(x[:26]), x[26:]))
@@ -627,6 +669,19 @@ class GermanCredit:
 
         return -(lik + pr + transform)
 
+    def batched_logdensity_fn(self, X):
+
+        scales = jnp.exp(X[:, :26])
+        pr = jnp.sum(0.5 * scales + 0.5 * X[:, :26], axis=1) + 0.5 * jnp.sum(jnp.square(X[:, 26:]), axis=1)
+        transform = -jnp.sum(X[:, :26], axis=1)
+
+        # likelihood: the logits of all the chains with one matrix-matrix product, shape (num_chains, num_data)
+        weights = scales[:, :1] * scales[:, 1:26] * X[:, 26:]
+        logits = weights @ self.features.T
+        lik = jnp.sum(self.labels * jnp.logaddexp(0., -logits) + (1-self.labels)* jnp.logaddexp(0., logits), axis=1)
+
+        return -(lik + pr + transform)
+
     def sample_init(self, key):
         weights = jax.random.normal(key, shape = (25, ))
         return jnp.concatenate((jnp.zeros(26), weights))
@@ -637,19 +692,43 @@ class GermanCredit:
 class ItemResponseTheory:
     """ Taken from the inference gym."""
 
-    def __init__(self):
+    mask = data_store.lazy(lambda self: data_store.dataset('irt_mask'))
+    labels = data_store.lazy(lambda self: data_store.dataset('irt_labels'))
+    E_x2 = data_store.lazy(lambda self: self.bundled_moments()[0])
+    Var_x2 = data_store.lazy(lambda self: self.bundled_moments()[1])
+
+    def __init__(self, sparse= False, observations= None, students= 400, questions= 100):
+        """Args:
+            sparse: store only the observed (student, question, label) triples and evaluate the likelihood with gathers,
+                    such that the cost scales with the number of observations instead of with students x questions.
+            observations: (student, question, label) integer arrays of the observed triples, to use a different (larger, sparser) dataset than the bundled one.
+                    The shape of the dataset is then given by students and questions, and the likelihood is always sparse.
+                    Ground truth moments are only available for the bundled dataset.
+        """
         
         self.name = 'ItemResponseTheory'
-        self.ndims = 501
         
-        self.students, self.questions = 400, 100
+        self.bundled = observations is None
+        
+        if observations is None:
+            self.students, self.questions = 400, 100
+            #self.E_x, self.E_x2, self.Var_x2, self.cov, self.inv_cov = load_cov(self.name)
+
+            if sparse:
+                student_index, question_index = np.nonzero(np.asarray(self.mask))
+                observations = (student_index, question_index, np.asarray(self.labels)[student_index, question_index])
+        
+        else:
+            self.students, self.questions = students, questions
+            sparse = True
 
-        self.mask = jnp.load(dirr + 'data/irt_mask.npy')
-        self.labels = jnp.load(dirr + 'data/irt_labels.npy')
+        self.ndims = self.students + 1 + self.questions
 
-        E_x2, Var_x2 = jnp.load(dirr + 'ground_truth/' + self.name + '/moments.npy')
-        self.E_x2, self.Var_x2 = E_x2, Var_x2
-        #self.E_x, self.E_x2, self.Var_x2, self.cov, self.inv_cov = load_cov(self.name)
+        if sparse:
+            self.student_index = jnp.asarray(observations[0], dtype=jnp.int32)
+            self.question_index = jnp.asarray(observations[1], dtype=jnp.int32)
+            self.observed_labels = jnp.asarray(observations[2], dtype=float)
+            self.logdensity_fn = self.logdensity_fn_sparse
         
         self.transform = lambda x: x
 
@@ -672,6 +751,52 @@ class ItemResponseTheory:
         return -lik - pr
 
 
+    def logdensity_fn_sparse(self, x):
+        """same as logdensity_fn, but only the observed pairs are evaluated"""
+
+        students = x[:self.students]
+        mean = x[self.students]
+        questions = x[self.students + 1:]
+
+        # prior
+        pr = 0.5 * (jnp.square(mean - 0.75) + jnp.sum(jnp.square(students)) + jnp.sum(jnp.square(questions)))
+
+        # likelihood: label * log(1 + e^-z) + (1 - label) * log(1 + e^z) = log(1 + e^z) - label * z
+        logits = mean + students[self.student_index] - questions[self.question_index]
+        lik = jnp.sum(jax.nn.softplus(logits) - self.observed_labels * logits)
+
+        return -lik - pr
+
+
+    def batched_logdensity_fn(self, X):
+
+        students = X[:, :self.students]
+        mean = X[:, self.students]
+        questions = X[:, self.students + 1:]
+
+        pr = 0.5 * (jnp.square(mean - 0.75) + jnp.sum(jnp.square(students), axis=1) + jnp.sum(jnp.square(questions), axis=1))
+
+        if hasattr(self, 'student_index'): # sparse
+            logits = mean[:, None] + students[:, self.student_index] - questions[:, self.question_index]
+            lik = jnp.sum(jax.nn.softplus(logits) - self.observed_labels * logits, axis=1)
+        
+        else:
+            # softplus(z) - label * z, summed over the observed pairs. The linear term is a matrix-vector product with the (masked) labels, 
+            # so only the softplus needs the (num_chains, students, questions) logits.
+            logits = mean[:, None, None] + students[:, :, None] - questions[:, None, :]
+            labels = jnp.where(self.mask, self.labels, 0.)
+            linear = mean * jnp.sum(labels) + students @ jnp.sum(labels, axis=1) - questions @ jnp.sum(labels, axis=0)
+            lik = jnp.sum(jnp.where(self.mask, jax.nn.softplus(logits), 0.), axis=(1, 2)) - linear
+
+        return -lik - pr
+
+
+    def bundled_moments(self):
+        if not self.bundled:
+            raise AttributeError('ground truth moments are only available for the bundled dataset')
+        return data_store.moments(self.name)
+
+
     def sample_init(self, key):
         x = jax.random.normal(key, shape = (self.ndims,))
         x = x.at[self.students].add(0.75)
@@ -680,18 +805,17 @@ class ItemResponseTheory:
 
 
 
-class StochasticVolatility():
+class StochasticVolatility(data_store.GroundTruthMoments):
     """Example from https://num.pyro.ai/en/latest/examples/stochastic_volatility.html"""
 
+    SP500_returns = data_store.lazy(lambda self: data_store.dataset('SP500'))
+
     def __init__(self):
         
         self.name = 'StochasticVolatility'
         self.ndims = 2429
         
         self.typical_sigma, self.typical_nu = 0.02, 10.0 # := 1 / lambda
-
-        self.SP500_returns = jnp.load(dirr + 'data/SP500.npy')        
-        self.E_x2, self.Var_x2 = jnp.load(dirr + 'ground_truth/'+self.name+'/moments.npy')
         
 
 
@@ -708,6 +832,18 @@ class StochasticVolatility():
         return -(l1 + l2 + l3)
 
 
+    def batched_logdensity_fn(self, X):
+
+        sigma = jnp.exp(X[:, -2]) * self.typical_sigma
+        nu = jnp.exp(X[:, -1]) * self.typical_nu
+
+        l1 = (jnp.exp(X[:, -2]) - X[:, -2]) + (jnp.exp(X[:, -1]) - X[:, -1])
+        l2 = (self.ndims - 2) * jnp.log(sigma) + 0.5 * (jnp.square(X[:, 0]) + jnp.sum(jnp.square(X[:, 1:-2] - X[:, :-3]), axis=1)) / jnp.square(sigma)
+        l3 = jnp.sum(nlogp_StudentT(self.SP500_returns, nu[:, None], jnp.exp(X[:, :-2])), axis=1)
+
+        return -(l1 + l2 + l3)
+
+
     def transform(self, x):
         """transforms to the variables which are used by numpyro"""
 
@@ -752,6 +888,7 @@ class MixedLogit():
         beta_true_repeat = jnp.repeat(beta_true, self.nsessions, axis=0)
 
         self.x = jax.random.normal(key_x, (nobs, self.nbeta))
+        self.session_index = jnp.repeat(jnp.arange(self.nind), self.nsessions) # individual of each observation
         self.y = 1 * jax.random.bernoulli(key_logit, (jax.nn.sigmoid(jax.vmap(lambda vec1, vec2: jnp.dot(vec1, vec2))(self.x, beta_true_repeat))))
 
         self.d = self.nbeta + self.nbeta + (self.nbeta * (self.nbeta-1) // 2) + self.nbeta * self.nind # mu, tau, omega_chol, and (beta for each i)
@@ -766,10 +903,10 @@ class MixedLogit():
     def corrchol_to_reals(self,x):
         '''Converts a Cholesky-correlation (lower-triangular) matrix to a vector of unconstrained reals'''
         dim = x.shape[0]
-        z = jnp.zeros((dim, dim))
-        for i in range(dim):
-            for j in range(i):
-                z = z.at[i, j].set(x[i,j] / jnp.sqrt(1.0 - jnp.sum(x[i, :j] ** 2.0)))
+        lower = jnp.tril(jnp.ones((dim, dim), dtype=bool), -1)
+        # z[i, j] = x[i, j] / sqrt(1 - sum_{k < j} x[i, k]^2)
+        remaining = 1.0 - (jnp.cumsum(jnp.square(x), axis=1) - jnp.square(x))
+        z = jnp.where(lower, x / jnp.sqrt(jnp.where(lower, remaining, 1.0)), 0.0)
         z_lower_triang = z[jnp.tril_indices(dim, -1)]
         y = 0.5 * (jnp.log(1.0 + z_lower_triang) - jnp.log(1.0 - z_lower_triang))
 
@@ -784,13 +921,10 @@ class MixedLogit():
         z = jnp.zeros((dim, dim))
         z = z.at[jnp.tril_indices(dim, -1)].set(jnp.tanh(y))
 
-        x = jnp.zeros((dim, dim))
-        for i in range(dim):
-            for j in range(i+1):
-                if i == j:
-                    x = x.at[i, j].set(jnp.sqrt(1.0 - jnp.sum(x[i, :j] ** 2.0)))
-                else:
-                    x = x.at[i, j].set(z[i,j] * jnp.sqrt(1.0 - jnp.sum(x[i, :j] ** 2.0)))
+        # stick breaking along the rows: x[i, j] = z[i, j] sqrt(1 - sum_{k < j} x[i, k]^2) = z[i, j] sqrt(prod_{k < j} (1 - z[i, k]^2)), and x[i, i] takes what is left
+        remaining = jnp.cumprod(1.0 - jnp.square(z), axis=1)
+        remaining = jnp.concatenate((jnp.ones((dim, 1)), remaining[:, :-1]), axis=1)
+        x = (z + jnp.eye(dim)) * jnp.sqrt(remaining)
         return x
 
 
@@ -805,16 +939,19 @@ class MixedLogit():
         beta = pars[dim2:].reshape(self.nind, self.nbeta)
 
         omega_chol = self.reals_to_corrchol(omega_chol_realvec)
-        omega = jnp.dot(omega_chol, jnp.transpose(omega_chol))
         tau = jnp.exp(log_tau)
-        tau_diagmat = jnp.diag(tau)
-        sigma = jnp.dot(tau_diagmat, jnp.dot(omega, tau_diagmat))
 
-        beta_repeat = jnp.repeat(beta, self.nsessions, axis=0)
+        # logits of all the observations: the beta of each observation's individual is gathered with the precomputed session index (its gradient is a segment sum over the sessions)
+        logits = jnp.sum(self.x * beta[self.session_index], axis=1)
 
-        log_lik = jnp.sum(self.y * jax.nn.log_sigmoid(jax.vmap(lambda vec1, vec2: jnp.dot(vec1, vec2))(self.x, beta_repeat)) + (1 - self.y) * jax.nn.log_sigmoid(-jax.vmap(lambda vec1, vec2: jnp.dot(vec1, vec2))(self.x, beta_repeat)))
+        # y log s(z) + (1 - y) log s(-z) = log s(z) - (1 - y) z
+        log_lik = jnp.sum(jax.nn.log_sigmoid(logits) - (1 - self.y) * logits)
 
-        log_density_beta_popdist = -0.5 * self.nind * jnp.log(jnp.linalg.det(sigma)) - 0.5 * jnp.sum(jax.vmap(lambda vec, mat: jnp.dot(vec, jnp.linalg.solve(mat, vec)), in_axes=(0, None))(beta - mu, sigma))
+        # sigma = diag(tau) omega diag(tau) has the Cholesky factor diag(tau) omega_chol, so no determinant or solve of sigma is needed
+        sigma_chol = tau[:, None] * omega_chol
+        log_det_sigma = 2 * jnp.sum(jnp.log(jnp.diag(sigma_chol)))
+        whitened = jax.scipy.linalg.solve_triangular(sigma_chol, jnp.transpose(beta - mu), lower=True)
+        log_density_beta_popdist = -0.5 * self.nind * log_det_sigma - 0.5 * jnp.sum(jnp.square(whitened))
 
         muMinusPriorMean = mu - self.prior_mean_mu
         log_prior_mu = -0.5 * jnp.log(jnp.linalg.det(self.prior_var_mu)) - 0.5 * jnp.dot(muMinusPriorMean, jnp.linalg.solve(self.prior_var_mu, muMinusPriorMean))
@@ -866,6 +1003,16 @@ class MixedLogit():
 
 
 
+def dct_diagonal(eigs):
+    """diagonal of C^T diag(eigs) C, where C is the orthonormal DCT-II matrix, in O(d log d):
+        (C^T diag(eigs) C)_nn = mean(eigs) + sum_{k > 0} eigs_k cos(pi k (2n + 1) / d) / d, and the sum is the real part of the 2d-point FFT of eigs at the odd frequencies."""
+
+    d = len(eigs)
+    F = jnp.fft.fft(eigs, 2 * d)
+    return (jnp.sum(eigs) + jnp.real(F[1::2]) - eigs[0]) / d
+
+
+
 def nlogp_StudentT(x, df, scale):
     y = x / scale
     z = (
@@ -911,16 +1058,15 @@ def construct_block_diagonal(a11, a22, a12, num):
 
 
 def load_cov(name, cov_only= False):
+    """eagerly loads the ground truth (the models load it lazily, see benchmarks/data_store.py)"""
     
-    cov_data = np.load(dirr + 'ground_truth/' + name + '/cov.npz')
-    E_x = jnp.array(cov_data['x_avg'])
-    cov = jnp.array(cov_data['cov'])
-    inv_cov = jnp.linalg.inv(cov)
+    E_x, cov = data_store.covariance(name)
+    E_x, cov, inv_cov = jnp.asarray(E_x), jnp.asarray(cov), jnp.asarray(data_store.inv_cov(name))
 
     if cov_only:
         return E_x, cov, inv_cov 
     else:       
-        E_x2, Var_x2 = jnp.load(dirr + 'ground_truth/' + name + '/moments.npy')
-        return E_x, E_x2, Var_x2, cov, inv_cov
+        E_x2, Var_x2 = data_store.moments(name)
+        return E_x, jnp.asarray(E_x2), jnp.asarray(Var_x2), cov, inv_cov
     
     
@@ -1,5 +1,6 @@
 
 
+import copy
 import pickle
 import warnings
 import jax
@@ -23,6 +24,7 @@ class Phi4:
         self.ndims = L**2
         self.L = L
         self.lam = lam
+        self.lattice_shape = (L, L)
 
         # import os
         # print(os.getcwd(), "foo")
@@ -72,6 +74,7 @@ class U1:
 
         self.ndims = 2 * Lt*Lx
         self.Lt, self.Lx, self.beta = Lt, Lx, beta
+        self.lattice_shape = (2, Lt, Lx)
         self.beta = beta
         self.unflatten = lambda links_flattened: links_flattened.reshape(2, Lt, Lx)
         self.locs = jnp.array([[i//Lx, i%Lx] for i in range(Lt*Lx)]) #the set of all possible lattice sites
@@ -106,4 +109,51 @@ class U1:
         # the result is the same as using [jnp.real(jnp.average(polyakov * jnp.roll(jnp.conjugate(polyakov), -n))) for n in range(self.Lx)], but it is computed faster by the fft
         return jnp.real(jnp.fft.ifft(jnp.square(jnp.abs(jnp.fft.fft(polyakov))))[1:1+self.Lx//2]) / self.Lx # fft based autocorrelation, we only store 1:1+Lx//2 (as the autocorrelation is then periodic)
 
-    
+
+
+# Fourier preconditioning of the lattice models.
+#
+# The fields are (nearly) translation invariant, so their covariance is (nearly) diagonal in Fourier space, with very different variances of the long and short wavelength modes.
+# A diagonal mass matrix cannot capture this, but a mass matrix which is diagonal in Fourier space can, and it is applied with the fft in O(d log d).
+# The samplers only support diagonal mass matrices, so instead the model is written in the variables y = A^-1 x, where A = F^-1 diag(sqrt(spectrum)) F:
+# sampling y with the identity mass matrix is the same as sampling x with the inverse mass matrix A A^T = F^-1 diag(spectrum) F.
+#
+#     model = fourier_preconditioned(Phi4(L=256, lam=1.), spectrum) # spectrum from free_field_spectrum or averaged fourier_power, see sampling_algorithms.unadjusted_mclmc_fourier
+#
+# The fft is taken over the last two axes of model.lattice_shape (the other axes, e.g. the link directions of U1, are separate fields).
+
+
+def fourier_power(model, x):
+    """|fft(x)|^2 / number of sites, shape model.lattice_shape. Its expected value is the variance of each Fourier mode."""
+
+    field = x.reshape(model.lattice_shape)
+    return jnp.square(jnp.abs(jnp.fft.fft2(field))) / (field.shape[-1] * field.shape[-2])
+
+
+def free_field_spectrum(lattice_shape, m2):
+    """variance of the Fourier modes of the free scalar field with action 1/2 phi (-laplace + m2) phi: 1 / (m2 + 4 sin^2(k_0/2) + 4 sin^2(k_1/2))"""
+
+    k0 = 2 * jnp.pi * jnp.fft.fftfreq(lattice_shape[-2])
+    k1 = 2 * jnp.pi * jnp.fft.fftfreq(lattice_shape[-1])
+    laplace = 4 * jnp.square(jnp.sin(k0 / 2))[:, None] + 4 * jnp.square(jnp.sin(k1 / 2))[None, :]
+    return jnp.broadcast_to(1. / (m2 + laplace), lattice_shape)
+
+
+def fourier_preconditioned(model, spectrum):
+    """shallow copy of the lattice model in the variables y = A^-1 x (see above). transform, E_x2 and Var_x2 are the same as for the original model.
+    spectrum: positive variances of the Fourier modes, shape model.lattice_shape, symmetric under k -> -k (as is the power spectrum of a real field)"""
+
+    shape = model.lattice_shape
+    num_modes = shape[-1] // 2 + 1 # real fft
+    scale = jnp.sqrt(spectrum)[..., :num_modes]
+
+    apply = lambda x, factor: jnp.fft.irfft2(factor * jnp.fft.rfft2(x.reshape(shape)), s=shape[-2:]).reshape(-1)
+    to_x = lambda y: apply(y, scale)
+    to_y = lambda x: apply(x, 1. / scale)
+
+    preconditioned = copy.copy(model)
+    preconditioned.logdensity_fn = lambda y: model.logdensity_fn(to_x(y)) # the Jacobian is constant
+    preconditioned.transform = lambda y: model.transform(to_x(y))
+    preconditioned.sample_init = lambda key: to_y(model.sample_init(key))
+    preconditioned.to_x, preconditioned.to_y = to_x, to_y
+    return preconditioned
@@ -1,5 +1,7 @@
 
+import copy
 import sys
+import time
 
 sys.path.append("./")
 sys.path.append("../blackjax")
@@ -24,10 +26,15 @@ from benchmarks.sampling_algorithms import (
     unadjusted_mclmc_tuning,
 )
 
-from benchmarks.sampling_algorithms import adjusted_mclmc_no_tuning, unadjusted_mclmc_no_tuning
+from benchmarks.sampling_algorithms import adjusted_mclmc_no_tuning, unadjusted_mclmc_no_tuning, RecordedBias, StoppedBias
 import jax
 import jax.numpy as jnp
 import numpy as np
+from benchmarks.tuning_cache import cached_tuning
+from benchmarks.compilation import aot_compile, signature
+from benchmarks.parallel import shard_chains
+from benchmarks.batching import with_batched_logdensity
+from benchmarks.eval_counter import counting
 from blackjax.adaptation.adjusted_mclmc_adaptation import adjusted_mclmc_make_L_step_size_adaptation
 from blackjax.adaptation.mclmc_adaptation import make_L_step_size_adaptation
 
@@ -55,44 +62,52 @@ def grads_to_low_error(err_t, grad_evals_per_step=1, low_error=0.01):
     """Uses the error of the expectation values to compute the effective sample size neff
     b^2 = 1/neff"""
 
-    cutoff_reached = err_t[-1] < low_error
+    cutoff_reached = err_t[..., -1] < low_error
     crossing =  find_crossing(err_t, low_error) * grad_evals_per_step
     # jax.debug.print("crossing {x}", x=crossing)
     return crossing, cutoff_reached
 
 
 def calculate_ess(err_t, grad_evals_per_step, num_tuning_steps, neff=100):
+    """err_t: error history of shape (..., num_steps), the leading axes can be anything (grid cells, seeds, samplers, ...). Jittable, see ess_of_traces."""
 
-    grads_to_low, cutoff_reached = grads_to_low_error(
-        err_t, grad_evals_per_step, 1.0 / neff
-    )
-
-    full_grads_to_low = grads_to_low 
+    return ess_from_crossing(find_crossing(err_t, 1.0 / neff), err_t[..., -1], grad_evals_per_step, neff)
     # + num_tuning_steps * grad_evals_per_step
 
-    return (
-        (neff / full_grads_to_low) * cutoff_reached,
-        full_grads_to_low * (1 / cutoff_reached),
-        cutoff_reached,
-    )
 
+def ess_from_crossing(crossing, final_err, grad_evals_per_step, neff=100):
+    """same as calculate_ess, but from the crossing (see find_crossing) and the final error instead of the whole error history (see BiasRecording)
 
-def find_crossing(array, cutoff):
-    """the smallest M such that array[m] < cutoff for all m > M"""
+    Returns:
+        ess, grads_to_low, cutoff_reached. ess = 0 and grads_to_low = inf if the error is still above 1/neff at the end,
+        ess = grads_to_low = nan if it was never above 1/neff (crossing = -1), such that the ESS can not be measured.
+    """
 
-    b = array > cutoff
-    indices = jnp.argwhere(b)
-    if indices.shape[0] == 0:
-        print("\n\n\nNO CROSSING FOUND!!!\n\n\n", array, cutoff)
-        return -1
+    cutoff_reached = final_err < 1.0 / neff
+    grads_to_low = jnp.where(crossing < 0, jnp.nan, crossing * grad_evals_per_step)
+    return (neff / grads_to_low) * cutoff_reached, grads_to_low * (1 / cutoff_reached), cutoff_reached
 
-    return jnp.max(indices) + 1
+
+@jax.jit
+def ess_of_traces(err_t, grad_evals_per_step, neff=100):
+    """calculate_ess for many error histories at once, on the device, e.g. ess_of_traces(bias, grads) with bias of shape (num_samplers, num_seeds, num_cells, num_steps).
+    grad_evals_per_step has to broadcast against err_t.shape[:-1]."""
+
+    return calculate_ess(err_t, grad_evals_per_step, 0, neff)
+
+
+def find_crossing(array, cutoff):
+    """the smallest M such that array[..., m] < cutoff for all m >= M, computed along the last axis.
+    Jittable and vmappable: M = -1 if the array is below the cutoff everywhere and M = array.shape[-1] if it does not cross it."""
+
+    steps = jnp.arange(1, array.shape[-1] + 1)
+    return jnp.max(jnp.where(array > cutoff, steps, -1), axis=-1)
 
 
 def cumulative_avg(samples):
     return jnp.cumsum(samples, axis=0) / jnp.arange(1, samples.shape[0] + 1)[:, None]
 
-def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type, num_steps, num_chains, pvmap):
+def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type, num_steps, num_chains, pvmap, tuning_cache=None):
     """Args:
       func(x, y) = (score, extra_results),
       where score is the scalar that we would like to maximize (e.g. ESS averaged over the chains)
@@ -144,13 +159,14 @@ def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type,
 
         (
             blackjax_state_after_tuning,
-            blackjax_sampler_params) = adjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000)
-
-        def func(L, step_size, key):
-
-                        ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _ = benchmark(
-                            model=model,
-                            sampler=adjusted_mclmc_no_tuning(
+            blackjax_sampler_params, _) = cached_tuning(
+                tuning_cache, model, 
+                {'sampler': 'adjusted_mclmc', 'integrator': integrator_type, 'target_acc_rate': target_acc_rate, 'preconditioning': False, 'L_proposal_factor': L_proposal_factor, 'random_trajectory_length': random_trajectory_length, 'num_steps': num_steps, 'num_tuning_steps': 5000}, 
+                tune_key,
+                lambda: adjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000))
+
+        # L and step_size are traced, such that the entire grid can be evaluated in one program (see benchmark_grid)
+        sampler_fn = lambda L, step_size: adjusted_mclmc_no_tuning(
                                 integrator_type=integrator_type,
                                 initial_state=blackjax_state_after_tuning,
                                 inverse_mass_matrix=blackjax_sampler_params.inverse_mass_matrix,
@@ -158,20 +174,16 @@ def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type,
                                 step_size=step_size,
                                 L_proposal_factor=L_proposal_factor,
                                 return_ess_corr=False,
-                                num_tuning_steps=1000, # doesn't matter what is passed here
-                            ),
-                            key=key,
-                            n=num_steps,
-                            batch=num_chains,
-                            pvmap=pvmap,
-                        )
-
-                        return ess, (params.L.mean(), params.step_size.mean())
+                            )
 
 
     elif sampler_type=='mclmc':
 
-        (blackjax_state_after_tuning, blackjax_sampler_params) = unadjusted_mclmc_tuning(
+        (blackjax_state_after_tuning, blackjax_sampler_params, _) = cached_tuning(
+            tuning_cache, model, 
+            {'sampler': 'mclmc', 'integrator': integrator_type, 'preconditioning': False, 'num_steps': num_steps, 'num_tuning_steps': 5000}, 
+            tune_key,
+            lambda: unadjusted_mclmc_tuning(
                     initial_position=initial_position,
                     num_steps=num_steps,
                     rng_key=tune_key,
@@ -180,13 +192,9 @@ def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type,
                     diagonal_preconditioning=False,
                     num_windows=2,
                     num_tuning_steps=5000
-                )
+                ))
         
-        def func(L, step_size, key):
-
-            ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _ = benchmark(
-                model=model,
-                sampler=unadjusted_mclmc_no_tuning(
+        sampler_fn = lambda L, step_size: unadjusted_mclmc_no_tuning(
                     integrator_type=integrator_type,
                     initial_state=blackjax_state_after_tuning,
                     inverse_mass_matrix=blackjax_sampler_params.inverse_mass_matrix,
@@ -195,14 +203,7 @@ def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type,
                     # L_proposal_factor=L_proposal_factor,
                     return_ess_corr=False,
                     num_tuning_steps=1000, # doesn't matter what is passed here
-                ),
-                key=key,
-                n=num_steps,
-                batch=num_chains,
-                pvmap=pvmap,
-            )
-
-            return ess, (params.L.mean(), params.step_size.mean())
+                )
     
     elif sampler_type=='adjusted_hmc':
 
@@ -230,7 +231,11 @@ def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type,
 
         (
             blackjax_state_after_tuning,
-            blackjax_sampler_params) = adjusted_mclmc_tuning( initial_position, num_steps, rng_key=tune_key, logdensity_fn=model.logdensity_fn,diagonal_preconditioning=False, target_acc_rate=0.9, kernel=kernel, frac_tune1=0.1, frac_tune2=0.1, frac_tune3=0.1,  params=None, max='avg', num_windows=2,tuning_factor=1.3)
+            blackjax_sampler_params, _) = cached_tuning(
+                tuning_cache, model, 
+                {'sampler': 'adjusted_hmc', 'integrator': integrator_type, 'target_acc_rate': 0.9, 'preconditioning': False, 'random_trajectory_length': random_trajectory_length, 'num_steps': num_steps, 'frac_tune1': 0.1, 'frac_tune2': 0.1}, 
+                tune_key,
+                lambda: adjusted_mclmc_tuning( initial_position, num_steps, rng_key=tune_key, logdensity_fn=model.logdensity_fn,diagonal_preconditioning=False, target_acc_rate=0.9, kernel=kernel, frac_tune1=0.1, frac_tune2=0.1, frac_tune3=0.1,  params=None, max='avg', num_windows=2,tuning_factor=1.3))
         
     else:
         raise Exception("sampler not recognized")
@@ -248,7 +253,13 @@ def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type,
         # func(2,1,jax.random.PRNGKey(1))
         # jax.debug.print("passed test")
         # print([[(xx, yy, keys[i,j]) for (i, yy) in enumerate(Z[:, 1])] for (j,xx) in enumerate(Z[:, 0])])
-        Results = [[func(xx[0], yy[0], keys[i,j]) for (i, yy) in enumerate(Z[:, 1])] for (j,xx) in enumerate(Z[:, 0])]
+
+        # all grid points are evaluated at once. Results[j][i] is the result at (x, y) = (Z[j, 0], Z[i, 1]), computed with the key keys[i, j]
+        X, Y = jnp.meshgrid(jnp.array(Z[:, 0]).reshape(grid_size), jnp.array(Z[:, 1]).reshape(grid_size), indexing='ij')
+        grid_keys = jnp.swapaxes(keys, 0, 1).reshape(grid_size**2, *keys.shape[2:])
+        out = benchmark_grid(model, sampler_fn, (X.reshape(-1), Y.reshape(-1)), grid_keys, n=num_steps, batch=num_chains, pvmap=pvmap)
+        out = [(ess, (params.L.mean(), params.step_size.mean())) for (ess, ess_avg, ess_corr, params, *_) in out]
+        Results = [out[j * grid_size: (j+1) * grid_size] for j in range(grid_size)]
         Scores = [
             [Results[i][j][0] for j in range(grid_size)] for i in range(grid_size)
         ]
@@ -300,7 +311,7 @@ def grid_search(model, key, grid_size, num_iter, sampler_type, integrator_type,
 
     return [state[0][0], state[0][1], *results], initial_edge, blackjax_state_after_tuning
 
-def grid_search_langevin_mams(model, key, grid_size, num_iter, integrator_type, num_steps, num_chains, pvmap):
+def grid_search_langevin_mams(model, key, grid_size, num_iter, integrator_type, num_steps, num_chains, pvmap, tuning_cache=None):
     """Args:
       func(x, y) = (score, extra_results),
       where score is the scalar that we would like to maximize (e.g. ESS averaged over the chains)
@@ -349,7 +360,11 @@ def grid_search_langevin_mams(model, key, grid_size, num_iter, integrator_type,
 
     (
         blackjax_state_after_tuning,
-        blackjax_sampler_params) = adjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000)
+        blackjax_sampler_params, _) = cached_tuning(
+            tuning_cache, model, 
+            {'sampler': 'adjusted_mclmc', 'integrator': integrator_type, 'target_acc_rate': target_acc_rate, 'preconditioning': False, 'L_proposal_factor': jnp.inf, 'random_trajectory_length': random_trajectory_length, 'num_steps': num_steps, 'num_tuning_steps': 5000}, 
+            tune_key,
+            lambda: adjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000))
 
     def func(L, L_proposal_factor, key, st, prms):
 
@@ -460,7 +475,7 @@ def grid_search_langevin_mams(model, key, grid_size, num_iter, integrator_type,
     return [state[0][0], state[0][1], *results], initial_edge, blackjax_state_after_tuning
 
 
-def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, key, grid_size, opt='max', grid_iterations=2,L_proposal_factor=1.25):
+def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, key, grid_size, opt='max', grid_iterations=2,L_proposal_factor=1.25, tuning_cache=None, pvmap=shard_chains):
 
     da_key, bench_key, init_pos_key, fast_tune_key = jax.random.split(key, 4)
     initial_position = model.sample_init(init_pos_key)
@@ -493,7 +508,11 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
 
         (
             blackjax_state_after_tuning,
-            blackjax_sampler_params) = adjusted_mclmc_tuning( initial_position, num_steps, fast_tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000)
+            blackjax_sampler_params, _) = cached_tuning(
+                tuning_cache, model, 
+                {'sampler': sampler, 'integrator': integrator_type, 'target_acc_rate': target_acc_rate, 'preconditioning': False, 'L_proposal_factor': jnp.inf, 'random_trajectory_length': random_trajectory_length, 'num_steps': num_steps, 'num_tuning_steps': 5000}, 
+                fast_tune_key,
+                lambda: adjusted_mclmc_tuning( initial_position, num_steps, fast_tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000))
     
     elif sampler=='adjusted_mclmc':
 
@@ -523,12 +542,20 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
 
         (
             blackjax_state_after_tuning,
-            blackjax_sampler_params) = adjusted_mclmc_tuning( initial_position, num_steps, fast_tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000)
+            blackjax_sampler_params, _) = cached_tuning(
+                tuning_cache, model, 
+                {'sampler': sampler, 'integrator': integrator_type, 'target_acc_rate': target_acc_rate, 'preconditioning': False, 'L_proposal_factor': L_proposal_factor, 'random_trajectory_length': random_trajectory_length, 'num_steps': num_steps, 'num_tuning_steps': 5000}, 
+                fast_tune_key,
+                lambda: adjusted_mclmc_tuning( initial_position, num_steps, fast_tune_key, model.logdensity_fn, False, target_acc_rate, kernel, frac_tune3=0.0, params=None, max='avg', num_windows=2, tuning_factor=1.3, num_tuning_steps=5000))
 
 
     elif sampler=='mclmc':
 
-        (blackjax_state_after_tuning, blackjax_sampler_params) = unadjusted_mclmc_tuning(
+        (blackjax_state_after_tuning, blackjax_sampler_params, _) = cached_tuning(
+            tuning_cache, model, 
+            {'sampler': 'mclmc', 'integrator': integrator_type, 'preconditioning': False, 'num_steps': num_steps, 'num_tuning_steps': 5000}, 
+            fast_tune_key,
+            lambda: unadjusted_mclmc_tuning(
                     initial_position=initial_position,
                     num_steps=num_steps,
                     rng_key=fast_tune_key,
@@ -537,7 +564,7 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
                     diagonal_preconditioning=False,
                     num_windows=2,
                     num_tuning_steps=5000
-                )
+                ))
     
     elif sampler=='adjusted_hmc':
 
@@ -565,7 +592,11 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
 
         (
             blackjax_state_after_tuning,
-            blackjax_sampler_params) = adjusted_mclmc_tuning( initial_position, num_steps, rng_key=fast_tune_key, logdensity_fn=model.logdensity_fn,diagonal_preconditioning=False, target_acc_rate=0.9, kernel=kernel, frac_tune3=0.1,  params=None, max='avg', num_windows=2,tuning_factor=1.3, num_tuning_steps=5000)
+            blackjax_sampler_params, _) = cached_tuning(
+                tuning_cache, model, 
+                {'sampler': 'adjusted_hmc', 'integrator': integrator_type, 'target_acc_rate': 0.9, 'preconditioning': False, 'random_trajectory_length': random_trajectory_length, 'num_steps': num_steps, 'num_tuning_steps': 5000}, 
+                fast_tune_key,
+                lambda: adjusted_mclmc_tuning( initial_position, num_steps, rng_key=fast_tune_key, logdensity_fn=model.logdensity_fn,diagonal_preconditioning=False, target_acc_rate=0.9, kernel=kernel, frac_tune3=0.1,  params=None, max='avg', num_windows=2,tuning_factor=1.3, num_tuning_steps=5000))
         
     else:
         raise Exception(f"sampler {sampler} not recognized")
@@ -673,6 +704,7 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
                     bench_key_per_iter,
                     n=num_steps,
                     batch=num_chains,
+                    pvmap=pvmap,
                 )
             
             elif sampler=='adjusted_mclmc':
@@ -693,6 +725,7 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
                     bench_key_per_iter,
                     n=num_steps,
                     batch=num_chains,
+                    pvmap=pvmap,
                 )
             
             elif sampler=='adjusted_hmc':
@@ -711,6 +744,7 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
                     bench_key_per_iter,
                     n=num_steps,
                     batch=num_chains,
+                    pvmap=pvmap,
                 )
 
             elif sampler=='mclmc':
@@ -729,6 +763,7 @@ def grid_search_only_L(model, sampler, num_steps, num_chains, integrator_type, k
                     bench_key_per_iter,
                     n=num_steps,
                     batch=num_chains,
+                    pvmap=pvmap,
                 )
 
             else:
@@ -814,45 +849,220 @@ def grid_search_only_stepsize(L, model, num_steps, num_chains, integrator_type,
     return step_size_grid[iopt], ESS[iopt], ESS_AVG[iopt], ESS_CORR_MAX[iopt], ESS_CORR_AVG[iopt], RATE[iopt]
 
 
-def benchmark(model, sampler, key, n=10000, batch=None, pvmap=jax.pmap):
-
+def benchmark(model, sampler, key, n=10000, batch=None, pvmap=shard_chains, tuning_cache=None, timings=None, eval_counter=None, early_stopping=None, bias_recording=None):
+    """pvmap: maps a function over the chains, jax.pmap (one chain per device), jax.vmap or shard_chains (any number of chains per device, see benchmarks/parallel.py)
+       tuning_cache: folder of the on-disk tuning cache (see benchmarks/tuning_cache.py). 
+        If given and the sampler has a separate tuning stage (sampler.tune), the tuning results of all the chains are loaded from the cache or computed and stored.
+       timings: if a dictionary is given, the cost of the run on the hardware is stored in it (times in seconds):
+            tuning_compile_time, sampling_compile_time, compile_time (the sum),
+            compile_start ('cold' if compiled from scratch, 'warm' if loaded from the persistent compilation cache),
+            tuning_time, sampling_time (excluding compilation; tuning_time is None if the tuning was loaded from the cache or if the sampler does not have a separate tuning stage, in which case it is included in sampling_time),
+            wall_time (everything),
+            grads_per_second (gradient evaluations per second during sampling, summed over the chains),
+            tuning_grads_per_second (the same during tuning, from the number of integrator steps of the tuning; None if there is no separate tuning_time),
+            ess_per_second (ESS per gradient * grads_per_second, i.e. effective samples per second of all the chains together)
+       eval_counter: an EvalCounter(batch) (see benchmarks/eval_counter.py). If given, the log density and gradient evaluations of each chain are counted in the compiled program,
+        separately for the 'tuning' (if it is not loaded from the cache) and the 'sampling' stage.
+       early_stopping: an EarlyStopping (see benchmarks/sampling_algorithms.py). If given, the sampling stops once the bias has crossed the ESS threshold for good, 
+        instead of running all n steps. The chains have to be mapped with named axes, see EarlyStopping.
+       bias_recording: a BiasRecording (see benchmarks/sampling_algorithms.py). If given, the bias is only kept at the checkpoints (the returned err_t_mean_avg, err_t_mean_max are at the checkpoints),
+        which saves memory for long runs. The ESS is the same."""
+
+    tic_total = time.time()
+
+    model = with_batched_logdensity(model) # the chains are evaluated together if the model has a batched_logdensity_fn
 
     d = get_num_latents(model)
     if batch is None:
         batch = np.ceil(1000 / d).astype(int)
+
+    if early_stopping is not None or bias_recording is not None:
+        # read by with_only_statistics. The median over the chains leaves out the copies with which pvmap pads the chains.
+        model = copy.copy(model)
+        model.early_stopping = None if early_stopping is None else early_stopping._replace(num_chains=int(batch))
+        model.bias_recording = None if bias_recording is None else bias_recording._replace(num_chains=int(batch))
     key, init_key = jax.random.split(key, 2)
     keys = jax.random.split(key, batch)
 
     init_keys = jax.random.split(init_key, batch)
     init_pos = pvmap(model.sample_init)(init_keys)  # [batch_size, dim_model]
 
-    params, grad_calls_per_traj, acceptance_rate, expectation, ess_corr, num_tuning_steps, tuning_integrator_steps = pvmap(
-        lambda pos, key: sampler(
-            model=model, num_steps=n, initial_position=pos, key=key
+    # the programs are compiled ahead of time, such that the compile time is not mixed with the run time
+    stages = {}
+
+    def compile_and_run(fn, *args, stage):
+        compiled, compile_time, start = aot_compile(fn, *args, name=f"{model.name} {stage}")
+        tic = time.time()
+        output = jax.block_until_ready(compiled(*args))
+        stages[stage] = {'compile_time': compile_time, 'time': time.time() - tic, 'start': start}
+        if eval_counter is not None:
+            output, counts = output
+            eval_counter.add(stage, counts)
+        return output
+
+    def chain(fn):
+        """fn(model, *args) of a single chain as a function of *args. With an eval_counter it also returns the evaluation counts of the chain"""
+        if eval_counter is None:
+            return lambda *args: fn(model, *args)
+        return lambda *args: counting(fn)(model, *args)
+
+    # samplers with a separate tuning stage are run in two programs, such that the tuning and the sampling are timed separately
+    if hasattr(sampler, 'tune'):
+        tuning_result = cached_tuning(
+            tuning_cache, model, {**sampler.tuning_config, 'num_steps': n, 'num_chains': batch}, key,
+            lambda: compile_and_run(pvmap(chain(lambda model, pos, key: sampler.tune(model=model, num_steps=n, initial_position=pos, key=key))), init_pos, keys, stage='tuning')
         )
-    )(init_pos, keys)
-    avg_grad_calls_per_traj = jnp.nanmean(grad_calls_per_traj, axis=0)
+
+        run = pvmap(chain(
+            lambda model, pos, key, tuning_result: sampler.run(
+                model=model, num_steps=n, initial_position=pos, key=key, tuning_result=tuning_result
+            )
+        ))
+        outputs = compile_and_run(run, init_pos, keys, tuning_result, stage='sampling')
+
+    else:
+        # the tuning (if any) is counted as sampling
+        outputs = compile_and_run(pvmap(chain(
+            lambda model, pos, key: sampler(
+                model=model, num_steps=n, initial_position=pos, key=key
+            )
+        )), init_pos, keys, stage='sampling')
 
     jax.debug.print("finished running sampler; now collecting results")
 
-    num_tuning_steps = jnp.mean(num_tuning_steps, axis=0)
+    results = collect_results(*outputs)
+
+    if timings is not None:
+        tuning, sampling = stages.get('tuning'), stages['sampling']
+        timings['tuning_compile_time'] = tuning['compile_time'] if tuning else 0.0
+        timings['sampling_compile_time'] = sampling['compile_time']
+        timings['compile_time'] = timings['tuning_compile_time'] + timings['sampling_compile_time']
+        timings['compile_start'] = 'warm' if all(stage['start'] == 'warm' for stage in stages.values()) else 'cold'
+        timings['tuning_time'] = tuning['time'] if tuning else None
+        timings['sampling_time'] = sampling['time']
+        timings['wall_time'] = time.time() - tic_total
+        # with early stopping fewer than n steps were done
+        timings['grads_per_second'] = (jnp.sum(steps_done(outputs[3], n) * jnp.nan_to_num(outputs[1])) / sampling['time']).item()
+        timings['ess_per_second'] = results[0] * timings['grads_per_second']
+        timings['tuning_grads_per_second'] = (jnp.sum(outputs[6]) * calls_per_integrator_step(sampler.tuning_config['integrator']) / tuning['time']).item() if tuning else None
+        print(f"{model.name}: compile {timings['compile_time']:.2f}s ({timings['compile_start']}), tuning {timings['tuning_time']}s ({timings['tuning_grads_per_second']} grads/s), sampling {timings['sampling_time']:.2f}s, {timings['grads_per_second']:.3g} grads/s, {timings['ess_per_second']:.3g} ESS/s")
+
+    return results
+
+
+def benchmark_sweep(model, sampler_fn, n=10000, batch=None, pvmap=shard_chains):
+    """Compiles the benchmark once for a whole hyperparameter sweep (bayesian optimization, wandb, ...).
+        The hyperparameters are runtime arguments of the compiled program instead of constants of the sampler closure,
+        so the sampler is compiled once per (model, sampler_fn, n, batch) and per shape of the hyperparameters, not once per proposal.
+
+    Args:
+        sampler_fn: function (*hyperparameters) -> sampler, e.g. lambda L, step_size: adjusted_mclmc_no_tuning(..., L=L, step_size=step_size)
+
+    Returns:
+        function run(key, *hyperparameters) with the same output as benchmark(model, sampler_fn(*hyperparameters), key, n, batch, pvmap).
+        run.num_compilations is the number of times the sampler has been compiled.
+    """
+
+    d = get_num_latents(model)
+    if batch is None:
+        batch = np.ceil(1000 / d).astype(int)
+
+    def chain(init_key, key, *hyperparameters):
+        run.num_compilations += 1 # only executed when jax traces the function, i.e. when it compiles
+        return sampler_fn(*hyperparameters)(
+            model=model, num_steps=n, initial_position=model.sample_init(init_key), key=key
+        )
+
+    compiled = {} # signature of the hyperparameters -> compiled program
+
+    def run(key, *hyperparameters):
+
+        # the same random keys as benchmark
+        key, init_key = jax.random.split(key, 2)
+        keys = jax.random.split(key, batch)
+        init_keys = jax.random.split(init_key, batch)
+
+        # python floats would be weakly typed and give a different signature than arrays
+        hyperparameters = [jnp.asarray(h, dtype=float) for h in hyperparameters]
+
+        if signature(hyperparameters) not in compiled:
+            program = pvmap(chain, in_axes=(0, 0) + (None,) * len(hyperparameters))
+            compiled[signature(hyperparameters)], _, _ = aot_compile(program, init_keys, keys, *hyperparameters, name=f"{model.name} sweep")
+        outputs = compiled[signature(hyperparameters)](init_keys, keys, *hyperparameters)
+
+        return collect_results(*outputs)
+
+    run.num_compilations = 0
+
+    return run
+
+
+def benchmark_grid(model, sampler_fn, grid, keys, n=10000, batch=None, pvmap=shard_chains):
+    """Same as benchmark, but for many values of the sampler hyperparameters at once. 
+        The grid points are an extra batch axis which is vmapped on each device, alongside the chains, so the whole grid is a single compiled program.
+
+    Args:
+        sampler_fn: function (*hyperparameters) -> sampler, e.g. lambda L, step_size: adjusted_mclmc_no_tuning(..., L=L, step_size=step_size)
+        grid: tuple of arrays of shape (num_cells, ), one for each hyperparameter
+        keys: random keys, one for each grid point
+
+    Returns:
+        list with the output of benchmark(model, sampler_fn(*cell), key) for each grid point
+    """
+
+    d = get_num_latents(model)
+    if batch is None:
+        batch = np.ceil(1000 / d).astype(int)
+    num_cells = len(grid[0])
+
+    # the same random keys as benchmark would use for each grid point
+    split_keys = jax.vmap(lambda key: jax.random.split(key, 2))(keys)
+    chain_keys = jax.vmap(lambda key: jax.random.split(key, batch))(split_keys[:, 0])
+    init_keys = jax.vmap(lambda key: jax.random.split(key, batch))(split_keys[:, 1])
+    init_pos = jax.vmap(jax.vmap(model.sample_init))(init_keys)  # [num_cells, batch_size, dim_model]
+
+    def chain(pos, key):
+        """a single chain for all the grid points"""
+        return jax.vmap(lambda pos, key, *hyperparameters: sampler_fn(*hyperparameters)(
+            model=model, num_steps=n, initial_position=pos, key=key
+        ))(pos, key, *grid)
+
+    outputs = pvmap(chain)(jnp.swapaxes(init_pos, 0, 1), jnp.swapaxes(chain_keys, 0, 1)) # [batch_size, num_cells, ...]
+
+    jax.debug.print("finished running sampler on the grid; now collecting results")
+
+    return [collect_results(*jax.tree_util.tree_map(lambda x: x[:, i], outputs)) for i in range(num_cells)]
+
+
+def steps_done(expectation, n):
+    """number of sampling steps which each chain actually did: n, unless the run was stopped early"""
+    if isinstance(expectation, (RecordedBias, StoppedBias)):
+        return expectation.num_steps
+    return n
+
+
+def collect_results(params, grad_calls_per_traj, acceptance_rate, expectation, ess_corr, num_tuning_steps=0, tuning_integrator_steps=0):
+    """Combines the outputs of the individual chains. Samplers without tuning do not return the last two outputs."""
+
+    avg_grad_calls_per_traj = jnp.nanmean(grad_calls_per_traj, axis=0)
+
+    num_tuning_steps = jnp.mean(num_tuning_steps)
     # jax.debug.print("{x} num tuning steps", x=num_tuning_steps)
 
-    err_t_mean_avg = jnp.median(expectation[:, :, 0], axis=0)
-    jax.debug.print("err_t_mean_avg shape {x}", x=err_t_mean_avg.shape)
-    esses_avg, grads_to_low_avg, _ = calculate_ess(
-        err_t_mean_avg, 
-        grad_evals_per_step=avg_grad_calls_per_traj,
-        num_tuning_steps=num_tuning_steps
-    )
+    if isinstance(expectation, RecordedBias):
+        # only the bias at the checkpoints was kept, the crossings were found during the run
+        err_t_mean_avg, err_t_mean_max = jnp.median(expectation.values, axis=0).T
+        (esses_avg, esses_max), (grads_to_low_avg, grads_to_low_max), _ = ess_from_crossing(
+            expectation.crossing[0], jnp.array([err_t_mean_avg[-1], err_t_mean_max[-1]]), avg_grad_calls_per_traj)
 
-    err_t_mean_max = jnp.median(expectation[:, :, 1], axis=0)
-    jax.debug.print("err_t_mean_max shape {x}", x=err_t_mean_max.shape)
-    esses_max, grads_to_low_max, _ = calculate_ess(
-        err_t_mean_max, 
-        grad_evals_per_step=avg_grad_calls_per_traj,
-        num_tuning_steps=num_tuning_steps
-    )
+    else:
+        if isinstance(expectation, StoppedBias):
+            expectation = expectation.values
+
+        # both components of the bias (average and max over the parameters) at once
+        err_t_mean_avg, err_t_mean_max = jnp.median(expectation, axis=0).T
+        (esses_avg, esses_max), (grads_to_low_avg, grads_to_low_max), _ = ess_of_traces(
+            jnp.stack([err_t_mean_avg, err_t_mean_max]), avg_grad_calls_per_traj)
 
     # if not jnp.isinf(jnp.mean(ess_corr)):
 
@@ -876,4 +1086,4 @@ def benchmark(model, sampler, key, n=10000, batch=None, pvmap=jax.pmap):
 
     # return esses_max, esses_avg.item(), jnp.mean(1/ess_corr).item(), params, jnp.mean(acceptance_rate, axis=0), step_size_over_da
     jax.debug.print("results collected")
-    return esses_max.item(), esses_avg.item(), ess_corr, params, jnp.mean(acceptance_rate, axis=0), grads_to_low_max, err_t_mean_avg, err_t_mean_max, tuning_integrator_steps.mean().item()
+    return esses_max.item(), esses_avg.item(), ess_corr, params, jnp.mean(acceptance_rate, axis=0), grads_to_low_max, err_t_mean_avg, err_t_mean_max, jnp.mean(tuning_integrator_steps).item()
@@ -0,0 +1,54 @@
+import math
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+from jax.sharding import Mesh, PartitionSpec as P
+
+try:
+    from jax import shard_map
+    shard_map_kwargs = {'check_vma': False}
+except ImportError:
+    from jax.experimental.shard_map import shard_map
+    shard_map_kwargs = {'check_rep': False}
+
+
+def shard_chains(fn, in_axes=0, devices=None):
+    """Drop-in replacement for jax.pmap(fn, in_axes) for running independent chains, which works for any number of chains and devices.
+
+    The chains are split in equal groups, one for each of the available devices, and vmapped within a device (shard_map over a 1d mesh of the devices).
+    If the number of chains is not a multiple of the number of devices, the last chain is repeated to fill the last group and the copies are dropped from the output.
+    There is thus no need to fake devices with XLA_FLAGS=--xla_force_host_platform_device_count: on a single cpu all the chains are simply vmapped.
+    Collectives over all the chains (e.g. jax.lax.all_gather) can use the axis names ('chains', 'chain_lanes'): 'chains' are the devices, 'chain_lanes' the chains within a device.
+
+    Args:
+        fn: function of a single chain
+        in_axes: 0 or None for each argument (or a single value for all), as in jax.vmap. Arguments with None are shared by all chains.
+        devices: the devices to use, by default all local devices (see benchmarks/scheduler.py for running several benchmarks at once on different devices)
+
+    Returns:
+        jitted function with the same signature as fn, but with an additional leading (chain) axis for the mapped arguments and the outputs
+    """
+
+    devices = jax.local_devices() if devices is None else list(devices)
+    mesh = Mesh(np.array(devices), ('chains',))
+
+    def mapped(*args):
+        axes = in_axes if isinstance(in_axes, (tuple, list)) else (in_axes,) * len(args)
+        num_chains = next(jax.tree_util.tree_leaves(arg)[0].shape[0] for arg, axis in zip(args, axes) if axis == 0)
+        num_padded = math.ceil(num_chains / len(devices)) * len(devices)
+
+        pad = lambda x: jnp.concatenate([x, jnp.repeat(x[-1:], num_padded - num_chains, axis=0)]) if num_padded > num_chains else x
+        args = [jax.tree_util.tree_map(pad, arg) if axis == 0 else arg for arg, axis in zip(args, axes)]
+
+        output = shard_map(
+            jax.vmap(fn, in_axes=tuple(axes), axis_name='chain_lanes'),
+            mesh=mesh,
+            in_specs=tuple(P('chains') if axis == 0 else P() for axis in axes),
+            out_specs=P('chains'),
+            **shard_map_kwargs,
+        )(*args)
+
+        return jax.tree_util.tree_map(lambda x: x[:num_chains], output)
+
+    return jax.jit(mapped)
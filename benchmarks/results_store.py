@@ -0,0 +1,180 @@
+import datetime
+import glob
+import hashlib
+import os
+import shutil
+import uuid
+
+
+# Append-only columnar store of benchmark results, replacing the per-model csv files in results/.
+#
+# The store is a parquet dataset, partitioned by model and sampler (hive layout: folder/model=.../sampler=.../*.parquet).
+# Every call to append writes new files and never modifies existing ones, so several jobs can write to the same store at once.
+# All rows have the same schema (see schema); fields which a run does not produce are null.
+#
+# Usage:
+#     append('results/store', [{'model': 'Gaussian', 'sampler': 'nuts', 'ESS': 0.1, ...}])
+#     df = query('results/store', columns=['sampler', 'ESS'], model='Gaussian', integrator='mclachlan')
+#
+# requires pyarrow
+
+
+def schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("model", pa.string()),
+        ("dims", pa.int64()),
+        ("sampler", pa.string()),
+        ("integrator", pa.string()),
+        ("tuning", pa.string()),
+        ("key_index", pa.int64()),
+        ("config", pa.string()), # identifies the configuration, see benchmark.config_id
+        ("config_hash", pa.string()),
+        ("L", pa.float64()),
+        ("step_size", pa.float64()),
+        ("acc_rate", pa.float64()),
+        ("preconditioning", pa.bool_()),
+        ("inv_L_prop", pa.float64()),
+        ("ess_avg", pa.float64()),
+        ("ess_corr_avg", pa.float64()),
+        ("ess_corr_min", pa.float64()),
+        ("ess_corr_inv_mean", pa.float64()),
+        ("num_steps", pa.int64()),
+        ("num_chains", pa.int64()),
+        ("worst", pa.string()),
+        ("num_windows", pa.int64()),
+        ("num_tuning_steps", pa.int64()),
+        ("tuning_integrator_steps", pa.float64()),
+        ("ESS", pa.float64()),
+        ("bias_avg", pa.list_(pa.float32())), # median bias over the chains at every step (at the checkpoints with a BiasRecording), only for rows from metrics.benchmark
+        ("bias_max", pa.list_(pa.float32())),
+        ("wall_time", pa.float64()), # seconds, see metrics.benchmark
+        ("compile_time", pa.float64()),
+        ("tuning_compile_time", pa.float64()),
+        ("sampling_compile_time", pa.float64()),
+        ("tuning_time", pa.float64()),
+        ("sampling_time", pa.float64()),
+        ("grads_per_second", pa.float64()),
+        ("tuning_grads_per_second", pa.float64()),
+        ("ess_per_second", pa.float64()),
+        ("compile_start", pa.string()), # 'cold': compiled from scratch, 'warm': loaded from the persistent compilation cache
+        ("created", pa.timestamp("s")),
+    ])
+
+
+def config_hash(config):
+    return hashlib.sha256(str(config).encode()).hexdigest()[:16]
+
+
+def coerce(row, fields):
+    """row with the values converted to the types of the schema and the missing fields set to None"""
+
+    import pyarrow as pa
+
+    def convert(value, type):
+        if value is None:
+            return None
+        if hasattr(value, 'item') and not pa.types.is_list(type):
+            value = value.item()
+        if pa.types.is_string(type):
+            return str(value)
+        if pa.types.is_floating(type):
+            return float(value)
+        if pa.types.is_integer(type):
+            return int(value)
+        if pa.types.is_boolean(type):
+            return bool(value)
+        if pa.types.is_list(type):
+            return [float(x) for x in (value.tolist() if hasattr(value, 'tolist') else value)] # one transfer for jax arrays
+        return value
+
+    return {field.name: convert(row.get(field.name), field.type) for field in fields}
+
+
+def append(folder, rows):
+    """writes the rows (list of dictionaries with keys from the schema) as new files of the store"""
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fields = schema()
+    now = datetime.datetime.now().replace(microsecond=0)
+    rows = [coerce({'created': now, 'config_hash': config_hash(row.get('config')), **row}, fields) for row in rows]
+    table = pa.Table.from_pylist(rows, schema=fields)
+
+    ds.write_dataset(
+        table, folder, format='parquet',
+        partitioning=partitioning(),
+        basename_template=uuid.uuid4().hex + '-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+def partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fields = schema()
+    return ds.partitioning(pa.schema([fields.field('model'), fields.field('sampler')]), flavor='hive')
+
+
+def dataset(folder):
+    import pyarrow.dataset as ds
+
+    return ds.dataset(folder, format='parquet', schema=schema(), partitioning=partitioning())
+
+
+def query(folder, columns=None, filter=None, **equal):
+    """pandas DataFrame of the rows which satisfy the filter (a pyarrow expression) and have the given values of the columns in equal, e.g. query(folder, model='Gaussian', key_index=3).
+        Only the files of the matching partitions and the requested columns are read."""
+
+    import pyarrow.dataset as ds
+
+    if not os.path.isdir(folder):
+        df = schema().empty_table().to_pandas()
+        return df if columns is None else df[columns]
+
+    for name, value in equal.items():
+        condition = ds.field(name) == value
+        filter = condition if filter is None else filter & condition
+
+    return dataset(folder).to_table(columns=columns, filter=filter).to_pandas()
+
+
+def completed_configs(folder, model, key_index):
+    """set of configurations of the model with this key_index which are already in the store"""
+    return set(query(folder, columns=['config'], model=model.name, dims=model.ndims, key_index=key_index)['config'])
+
+
+def compact(folder):
+    """rewrites the store with one file per partition. Appending a single row at a time leaves many small files, which makes queries slow.
+        Should not run while other jobs are writing to the store."""
+
+    import pyarrow.dataset as ds
+
+    folder = folder.rstrip('/')
+    table = dataset(folder).to_table()
+
+    # leftovers of an interrupted compaction
+    shutil.rmtree(folder + '.compact', ignore_errors=True)
+    shutil.rmtree(folder + '.old', ignore_errors=True)
+
+    ds.write_dataset(table, folder + '.compact', format='parquet', partitioning=partitioning())
+    os.replace(folder, folder + '.old')
+    os.replace(folder + '.compact', folder)
+    shutil.rmtree(folder + '.old')
+
+
+def import_csv(folder, pattern='results/*results*.csv'):
+    """adds the rows of the old csv result files to the store. Columns which are not in the csv files are null, the config is the name of the file."""
+
+    import pandas as pd
+
+    for path in sorted(glob.glob(pattern)):
+        df = pd.read_csv(path)
+        df = df.astype(object).where(df.notna(), None)
+        rows = [{**row, 'config': os.path.basename(path) + ':' + str(i)} for i, row in enumerate(df.to_dict('records'))]
+        if rows:
+            append(folder, rows)
+        print(f"imported {len(rows)} rows from {path}")
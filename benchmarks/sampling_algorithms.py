@@ -1,5 +1,7 @@
+import hashlib
 import math
-from typing import Callable, Union
+import numpy as np
+from typing import Callable, NamedTuple, Union
 from chex import PRNGKey
 import jax
 import jax.numpy as jnp
@@ -32,6 +34,8 @@ from jax.flatten_util import ravel_pytree
 from blackjax.diagnostics import effective_sample_size
 from blackjax.base import SamplingAlgorithm
 
+from benchmarks.lattice import fourier_power, fourier_preconditioned
+
 
 def calls_per_integrator_step(c):
     if c == "velocity_verlet":
@@ -136,8 +140,236 @@ map_integrator_type_to_integrator = {
 }
 
 
+class BatchMeansState(NamedTuple):
+    """Running statistics for the batch means estimate of the effective sample size.
+    Only O(d) numbers are stored, no matter how long the chain is."""
+
+    count: int  # number of samples seen so far
+    mean: jax.Array  # running mean of x
+    m2: jax.Array  # running sum of squared deviations of x from the mean
+    batch_sum: jax.Array  # sum of x over the current (incomplete) batch
+    num_batches: int  # number of completed batches
+    batch_mean_mean: jax.Array  # running mean of the batch means
+    batch_mean_m2: jax.Array  # running sum of squared deviations of the batch means
+
+
+def batch_size_for(num_steps):
+    """standard choice: sqrt(n) batches of sqrt(n) samples"""
+    return max(1, int(math.sqrt(num_steps)))
+
+
+def online_ess_init(x):
+    zeros = jnp.zeros_like(ravel_pytree(x)[0])
+    return BatchMeansState(jnp.array(0), zeros, zeros, zeros, jnp.array(0), zeros, zeros)
+
+
+def online_ess_update(ess_state, x, batch_size):
+    """Welford update of the sample moments and of the moments of the batch means."""
+
+    x = ravel_pytree(x)[0]
+    count = ess_state.count + 1
+    delta = x - ess_state.mean
+    mean = ess_state.mean + delta / count
+    m2 = ess_state.m2 + delta * (x - mean)
+
+    batch_sum = ess_state.batch_sum + x
+    batch_complete = (count % batch_size) == 0
+
+    batch_mean = batch_sum / batch_size
+    num_batches = ess_state.num_batches + 1
+    delta_batch = batch_mean - ess_state.batch_mean_mean
+    batch_mean_mean = ess_state.batch_mean_mean + delta_batch / num_batches
+    batch_mean_m2 = ess_state.batch_mean_m2 + delta_batch * (batch_mean - batch_mean_mean)
+
+    return BatchMeansState(
+        count=count,
+        mean=mean,
+        m2=m2,
+        batch_sum=jnp.where(batch_complete, jnp.zeros_like(batch_sum), batch_sum),
+        num_batches=jnp.where(batch_complete, num_batches, ess_state.num_batches),
+        batch_mean_mean=jnp.where(batch_complete, batch_mean_mean, ess_state.batch_mean_mean),
+        batch_mean_m2=jnp.where(batch_complete, batch_mean_m2, ess_state.batch_mean_m2),
+    )
+
+
+def online_ess(ess_state):
+    """ESS per dimension = num_batches * Var[x] / Var[batch means]"""
+
+    var_x = ess_state.m2 / (ess_state.count - 1)
+    var_batch_means = ess_state.batch_mean_m2 / (ess_state.num_batches - 1)
+    return ess_state.num_batches * var_x / var_batch_means
+
+
+def with_online_ess(alg, state_transform, batch_size):
+    """Wraps a sampling algorithm such that its state also carries a BatchMeansState of state_transform(state)."""
+
+    def init(state):
+        return state, online_ess_init(state_transform(state))
+
+    def step(rng_key, state_and_ess):
+        state, ess_state = state_and_ess
+        state, info = alg.step(rng_key, state)
+        return (state, online_ess_update(ess_state, state_transform(state), batch_size)), info
+
+    return SamplingAlgorithm(init, step)
+
+
+class EarlyStopping(NamedTuple):
+    """Stop the run once the bias has crossed 1/neff for good, instead of running all num_steps.
+
+    The bias (median over the chains, both the average and the max over the dimensions) is checked after every block of block_size steps.
+    The run stops once it has been below 1/neff for the last (margin - 1) * M steps, where M is the number of steps it took to cross the threshold, or after num_steps.
+    The median requires communication between the chains: axis_names are the names of the axes over which the chains are mapped
+    (the default are the axes of benchmarks.parallel.shard_chains, with jax.pmap or jax.vmap pass axis_name='chains' to them and use axis_names=('chains', )).
+    num_chains: the number of chains which are actually run. shard_chains pads the chains with copies of the last one, these are left out of the median. None means all lanes are chains (set by metrics.benchmark).
+    """
+
+    block_size: int = 1000
+    neff: float = 100
+    margin: float = 2.0
+    axis_names: tuple = ('chains', 'chain_lanes')
+    num_chains: int = None
+
+
+def median_over_chains(x, axis_names, num_chains=None):
+    """median of x over all the chains, the first num_chains lanes (in the order of the axes) if num_chains is given"""
+    for name in reversed(axis_names):
+        x = jax.lax.all_gather(x, name)
+    x = x.reshape(-1, *x.shape[len(axis_names):])
+    if num_chains is not None:
+        x = x[:num_chains] # the padding of shard_chains is at the end
+    return jnp.median(x, axis=0)
+
+
+def run_in_blocks(alg, initial_state, key, num_steps, transform, early_stopping, last_above_fn=None):
+    """Same as run_inference_algorithm with a transform which returns (bias, info), but in a while loop over scans of early_stopping.block_size steps, which terminates early (see EarlyStopping).
+
+    The output has the same shape as if all num_steps were done: the bias of the remaining steps is the last bias which was computed 
+    (so that the crossing and the final bias are unchanged), the info of the remaining steps is nan (use jnp.nanmean to average it).
+    The number of steps which were actually done is returned as a third output.
+
+    last_above_fn: if the crossing is tracked in the state (see with_recorded_bias), function state -> last step at which the median bias was above 1/neff. 
+        The transform then returns None and only the final state is returned.
+    """
+
+    block_size = min(early_stopping.block_size, num_steps)
+    num_blocks = -(-num_steps // block_size)
+    cutoff = 1.0 / early_stopping.neff
+
+    def one_step(state, key):
+        state, info = alg.step(key, state)
+        return state, transform(state, info)
+
+    trace_shape = jax.eval_shape(one_step, initial_state, key)[1]
+    history = jax.tree_util.tree_map(lambda x: jnp.zeros((num_blocks * block_size, ) + x.shape, x.dtype), trace_shape)
+
+    def block(carry):
+        state, history, b, last_above = carry
+        state, trace = jax.lax.scan(one_step, state, jax.random.split(jax.random.fold_in(key, b), block_size))
+        history = jax.tree_util.tree_map(lambda h, t: jax.lax.dynamic_update_slice_in_dim(h, t, b * block_size, axis=0), history, trace)
+
+        if last_above_fn is not None:
+            last_above = last_above_fn(state)
+        else:
+            # last step (in this block) at which the median bias was above the cutoff
+            above = jnp.any(median_over_chains(trace[0], early_stopping.axis_names, early_stopping.num_chains) > cutoff, axis=1)
+            last_above = jnp.where(jnp.any(above), b * block_size + jnp.max(jnp.where(above, jnp.arange(block_size), -1)) + 1, last_above)
+
+        return state, history, b + 1, last_above
+
+    def cond(carry):
+        _, _, b, last_above = carry
+        return (b < num_blocks) & ((b == 0) | (b * block_size < early_stopping.margin * last_above))
+
+    state, history, b, _ = jax.lax.while_loop(cond, block, (initial_state, history, jnp.array(0), jnp.array(0)))
+
+    steps_done = b * block_size # the last block is done in full, so this can exceed num_steps
+    if last_above_fn is not None:
+        return state, None, steps_done
+
+    done = jnp.arange(num_blocks * block_size) < steps_done
+    bias, info = history
+    bias = jnp.where(done[:, None], bias, bias[steps_done - 1])[:num_steps]
+    info = jax.tree_util.tree_map(lambda x: jnp.where(done.reshape(-1, *[1] * (x.ndim - 1)), x, jnp.nan)[:num_steps], info)
+
+    return state, (bias, info), steps_done
+
+
+class StoppedBias(NamedTuple):
+    """bias of a chain which was stopped early with EarlyStopping (without BiasRecording)"""
+
+    values: jax.Array  # bias at every step, shape (num_steps, 2), after the stop it is the last bias which was computed
+    num_steps: jax.Array  # number of steps which were actually done
+
+
+class BiasRecording(NamedTuple):
+    """Keep the bias only at some checkpoints instead of at every step: O(len(checkpoints)) instead of O(num_steps) memory per chain.
+
+    The ESS is still exact: the median of the bias over the chains is computed at every step, and the last step at which it was above 1/neff
+    (the crossing, as find_crossing would return it) is kept. This requires communication between the chains, see axis_names in EarlyStopping.
+    neff has to be the one with which the ESS is computed (100 in metrics.collect_results).
+    checkpoints: steps (0-indexed) at which the bias of each chain is recorded, by default num_checkpoints log-spaced steps. The last step is always included.
+    num_chains: as in EarlyStopping.
+    """
+
+    checkpoints: tuple = None
+    num_checkpoints: int = 100
+    neff: float = 100
+    axis_names: tuple = ('chains', 'chain_lanes')
+    num_chains: int = None
+
+
+class RecordedBias(NamedTuple):
+    """bias of a chain recorded with BiasRecording"""
+
+    checkpoints: jax.Array  # steps at which the bias was recorded, shape (num_checkpoints, )
+    values: jax.Array  # bias at the checkpoints, shape (num_checkpoints, 2)
+    crossing: jax.Array  # crossing of 1/neff by the median over the chains of the bias, for the two components of the bias (same for all chains)
+    num_steps: jax.Array  # number of steps which were actually done (fewer than requested after an early stop)
+
+
+def checkpoints_for(num_steps, recording):
+    if recording.checkpoints is None:
+        checkpoints = np.geomspace(1, num_steps, recording.num_checkpoints).astype(int) - 1
+    else:
+        checkpoints = np.array(recording.checkpoints)
+    return np.unique(np.append(checkpoints[checkpoints < num_steps], num_steps - 1))
+
+
+def with_recorded_bias(alg, bias_fn, checkpoints, recording):
+    """Wraps a sampling algorithm such that its state also carries (number of steps, crossing, bias at the checkpoints, running mean of the info, last bias)."""
+
+    cutoff = 1.0 / recording.neff
+
+    def init(state):
+        info_shape = jax.eval_shape(alg.step, jax.random.key(0), state)[1]
+        info_mean = jax.tree_util.tree_map(lambda x: jnp.zeros(x.shape), info_shape)
+        return state, (jnp.array(0), -jnp.ones(2, dtype=int), jnp.zeros((len(checkpoints), 2)), info_mean, jnp.zeros(2))
+
+    def step(rng_key, state_and_record):
+        state, (t, last_above, values, info_mean, _) = state_and_record
+        state, info = alg.step(rng_key, state)
+        bias = bias_fn(state, info)
+
+        last_above = jnp.where(median_over_chains(bias, recording.axis_names, recording.num_chains) > cutoff, t + 1, last_above)
+        values = jnp.where((checkpoints == t)[:, None], bias, values)
+        info_mean = jax.tree_util.tree_map(lambda m, x: m + (x.astype(m.dtype) - m) / (t + 1), info_mean, info)
+
+        return (state, (t + 1, last_above, values, info_mean, bias)), info
+
+    return SamplingAlgorithm(init, step)
+
+
 # produce a kernel that only stores the average values of the bias for E[x_2] and Var[x_2]
-def with_only_statistics(model, alg, initial_state, key, num_steps, incremental_value_transform=None, return_history=True):
+# if return_ess_corr, the autocorrelation based ESS (per step) is accumulated in the same pass with batch means
+# early_stopping: an EarlyStopping, by default taken from model.early_stopping (set by metrics.benchmark), None to run all num_steps
+# bias_recording: a BiasRecording, by default taken from model.bias_recording. If given, the bias history is a RecordedBias and the info is averaged over the steps
+def with_only_statistics(model, alg, initial_state, key, num_steps, incremental_value_transform=None, return_history=True, return_ess_corr=False, early_stopping=None, bias_recording=None):
+
+    if early_stopping is None:
+        early_stopping = getattr(model, 'early_stopping', None)
+    if bias_recording is None:
+        bias_recording = getattr(model, 'bias_recording', None)
 
     if incremental_value_transform is None:
         incremental_value_transform=lambda x: jnp.array(
@@ -151,34 +383,74 @@ def with_only_statistics(model, alg, initial_state, key, num_steps, incremental_
                 ]
             )
 
-    memory_efficient_sampling_alg, transform = store_only_expectation_values(
-        sampling_algorithm=alg,
-        state_transform=lambda state: jnp.array([
-            model.transform(state.position) ** 2, 
+    statistics = lambda state: jnp.array([
+            model.transform(state.position) ** 2,
             model.transform(state.position),
             model.transform(state.position) ** 4,
-            ]),
+            ])
+
+    if return_ess_corr:
+        alg = with_online_ess(alg, lambda state: model.transform(state.position), batch_size_for(num_steps))
+        state_transform = lambda state_and_ess: statistics(state_and_ess[0])
+    else:
+        state_transform = statistics
+
+    memory_efficient_sampling_alg, transform = store_only_expectation_values(
+        sampling_algorithm=alg,
+        state_transform=state_transform,
         incremental_value_transform=incremental_value_transform,
     )
 
     if not return_history:
         transform = lambda x, y: None
 
-    out =  run_inference_algorithm(
-        rng_key=key,
-        initial_state=memory_efficient_sampling_alg.init(initial_state),
-        inference_algorithm=memory_efficient_sampling_alg,
-        num_steps=num_steps,
-        transform=transform,
-        progress_bar=True,
-    )
+    initial_state = memory_efficient_sampling_alg.init(alg.init(initial_state) if return_ess_corr else initial_state)
+
+    if bias_recording is not None and return_history:
+        checkpoints = jnp.array(checkpoints_for(num_steps, bias_recording))
+        recorded_alg = with_recorded_bias(memory_efficient_sampling_alg, lambda state, info: transform(state, info)[0], checkpoints, bias_recording)
+        if early_stopping is not None:
+            final_state, _, _ = run_in_blocks(recorded_alg, recorded_alg.init(initial_state), key, num_steps, lambda x, y: None, early_stopping, last_above_fn=lambda state: jnp.max(state[1][1]))
+        else:
+            final_state, _ = run_inference_algorithm(
+                rng_key=key,
+                initial_state=recorded_alg.init(initial_state),
+                inference_algorithm=recorded_alg,
+                num_steps=num_steps,
+                transform=lambda x, y: None,
+                progress_bar=True,
+            )
+        state, (t, crossing, values, info_mean, last_bias) = final_state
+        # checkpoints after an early stop get the last bias
+        values = jnp.where((checkpoints >= t)[:, None], last_bias, values)
+        out = (state, (RecordedBias(checkpoints, values, crossing, t), info_mean))
+
+    elif early_stopping is not None and return_history:
+        state, (bias, info), steps_done = run_in_blocks(memory_efficient_sampling_alg, initial_state, key, num_steps, transform, early_stopping)
+        out = (state, (StoppedBias(bias, steps_done), info))
+    else:
+        out =  run_inference_algorithm(
+            rng_key=key,
+            initial_state=initial_state,
+            inference_algorithm=memory_efficient_sampling_alg,
+            num_steps=num_steps,
+            transform=transform,
+            progress_bar=True,
+        )
+
+    if return_ess_corr:
+        ess_state = out[0][0][1]
+        ess_corr = jnp.mean(online_ess(ess_state)) / ess_state.count
+    else:
+        ess_corr = jnp.inf
+
     if not return_history:
         # transform = lambda x, y: None
         # print("out shape", incremental_value_transform(out[0][1][1]).shape)
-        return incremental_value_transform(out[0][1][1]), None
+        return incremental_value_transform(out[0][1][1]), None, ess_corr
     else:
         # print("out shape", out[1][0].shape)
-        return out[1]
+        return out[1][0], out[1][1], ess_corr
     # jax.debug.print("out {x}", x=out)
     # print("out shape", out[1][1].shape)
     # return out
@@ -199,16 +471,7 @@ def unadjusted_mclmc_no_tuning(initial_state, integrator_type, step_size, L, inv
         )
 
         
-        expectations = with_only_statistics(model, alg, initial_state, fast_key, num_steps)[0]
-
-
-        ess_corr = jax.lax.cond(not return_ess_corr, lambda: jnp.inf, lambda: jnp.mean(effective_sample_size(jax.vmap(lambda x: ravel_pytree(x)[0])(run_inference_algorithm(
-            rng_key=slow_key,
-            initial_state=initial_state,
-            inference_algorithm=alg,
-            num_steps=num_steps,
-            transform=lambda state, _: (model.transform(state.position)),
-            progress_bar=False)[1])[None, ...]))/num_steps)
+        expectations, _, ess_corr = with_only_statistics(model, alg, initial_state, fast_key, num_steps, return_ess_corr=return_ess_corr)
 
         return (
             MCLMCAdaptationState(L=L, step_size=step_size, inverse_mass_matrix=inverse_mass_matrix),
@@ -253,18 +516,7 @@ def adjusted_mclmc_no_tuning(
         # jax.debug.print("running inference algorithm {x}", x=(L,step_size, inverse_mass_matrix))
 
         # jax.debug.print("num_steps {x}", x=num_steps)
-        results = with_only_statistics(model, alg, initial_state, fast_key, num_steps)
-        expectations, info = results[0], results[1]
-
-
-       
-        ess_corr = jax.lax.cond(not return_ess_corr, lambda: jnp.inf, lambda: jnp.mean(effective_sample_size(jax.vmap(lambda x: ravel_pytree(x)[0])(run_inference_algorithm(
-            rng_key=slow_key,
-            initial_state=initial_state,
-            inference_algorithm=alg,
-            num_steps=num_steps,
-            transform=lambda state, _: (model.transform(state.position)),
-            progress_bar=False)[1])[None, ...]))/num_steps)
+        expectations, info, ess_corr = with_only_statistics(model, alg, initial_state, fast_key, num_steps, return_ess_corr=return_ess_corr)
         
         # ess_corr = lambda: jnp.mean(effective_sample_size(jax.vmap(lambda x: ravel_pytree(x)[0])(run_inference_algorithm(
         #     rng_key=slow_key,
@@ -281,7 +533,7 @@ def adjusted_mclmc_no_tuning(
         return (
             MCLMCAdaptationState(L=L, step_size=step_size, inverse_mass_matrix=inverse_mass_matrix),
             num_steps_per_traj * calls_per_integrator_step(integrator_type),
-            info.acceptance_rate.mean(),
+            jnp.nanmean(info.acceptance_rate),
             expectations, 
             ess_corr,
         )
@@ -322,7 +574,8 @@ def unadjusted_mclmc_tuning(initial_position, num_steps, rng_key, logdensity_fn,
         
     )
 
-def adjusted_mclmc_tuning(initial_position, num_steps, rng_key, logdensity_fn,  diagonal_preconditioning, target_acc_rate, kernel, frac_tune3=0.1, params=None, max='avg', num_windows=1,  tuning_factor=1.0, num_tuning_steps=500):
+def adjusted_mclmc_tuning(initial_position, num_steps, rng_key, logdensity_fn,  diagonal_preconditioning, target_acc_rate, kernel, frac_tune3=0.1, params=None, max='avg', num_windows=1,  tuning_factor=1.0, num_tuning_steps=500, frac_tune1=None, frac_tune2=None):
+    # frac_tune1, frac_tune2: fractions of num_steps for the first two tuning stages, by default num_tuning_steps are split between them
 
 
     init_key, tune_key = jax.random.split(rng_key, 2)
@@ -333,8 +586,8 @@ def adjusted_mclmc_tuning(initial_position, num_steps, rng_key, logdensity_fn,
         random_generator_arg=init_key,
     )
 
-    frac_tune1 = num_tuning_steps / (2*num_steps)
-    frac_tune2 = num_tuning_steps / (2*num_steps)
+    frac_tune1 = num_tuning_steps / (2*num_steps) if frac_tune1 is None else frac_tune1
+    frac_tune2 = num_tuning_steps / (2*num_steps) if frac_tune2 is None else frac_tune2
     frac_tune3 = 0 # num_tuning_steps / (0.3*num_steps)
     
 
@@ -368,18 +621,22 @@ def adjusted_mclmc_tuning(initial_position, num_steps, rng_key, logdensity_fn,
 
 def unadjusted_mclmc(integrator_type, preconditioning, frac_tune3=0.1, return_ess_corr=False, num_windows=1, num_tuning_steps = 2000):
 
-    def s(model, num_steps, initial_position, key):
+    # the sampler is split in the tuning and the sampling stage, such that the tuning results can be cached (see benchmarks/tuning_cache.py)
+    def tune(model, num_steps, initial_position, key):
 
         tune_key, run_key = jax.random.split(key, 2)
 
-        
-        
+        return unadjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, integrator_type, preconditioning, frac_tune3, num_windows=num_windows, num_tuning_steps=num_tuning_steps)
+
+    def run(model, num_steps, initial_position, key, tuning_result):
+
+        tune_key, run_key = jax.random.split(key, 2)
 
         (
             blackjax_state_after_tuning,
             blackjax_mclmc_sampler_params,
             num_tuning_integrator_steps
-        ) = unadjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, integrator_type, preconditioning, frac_tune3, num_windows=num_windows, num_tuning_steps=num_tuning_steps)
+        ) = tuning_result
 
         # num_tuning_steps = (0.1 + 0.1) * num_windows * num_steps + frac_tune3 * num_steps
 
@@ -409,6 +666,91 @@ def unadjusted_mclmc(integrator_type, preconditioning, frac_tune3=0.1, return_es
             num_tuning_integrator_steps,
         )
 
+    def s(model, num_steps, initial_position, key):
+        return run(model, num_steps, initial_position, key, tune(model, num_steps, initial_position, key))
+
+    s.tune, s.run = tune, run
+    s.tuning_config = {'sampler': 'mclmc', 'integrator': integrator_type, 'preconditioning': preconditioning, 'frac_tune3': frac_tune3, 'num_windows': num_windows, 'num_tuning_steps': num_tuning_steps}
+
+    return s
+
+
+
+def estimate_fourier_spectrum(model, initial_position, num_steps, rng_key, integrator_type, num_tuning_steps):
+    """variance of each Fourier mode of a lattice model, averaged over num_tuning_steps steps of unadjusted MCLMC (tuned without preconditioning).
+    Returns the spectrum, the last position and the number of integrator steps used."""
+
+    tune_key, run_key = jax.random.split(rng_key, 2)
+    state, params, num_tuning_integrator_steps = unadjusted_mclmc_tuning(initial_position, num_steps, tune_key, model.logdensity_fn, integrator_type, False, num_tuning_steps=num_tuning_steps)
+
+    alg = blackjax.mclmc(
+        model.logdensity_fn,
+        L=params.L,
+        step_size=params.step_size,
+        inverse_mass_matrix=params.inverse_mass_matrix,
+        integrator=map_integrator_type_to_integrator["mclmc"][integrator_type],
+    )
+
+    def step(carry, key):
+        state, power = carry
+        state, _ = alg.step(key, state)
+        return (state, power + fourier_power(model, state.position) / num_tuning_steps), None
+
+    (state, spectrum), _ = jax.lax.scan(step, (state, jnp.zeros(model.lattice_shape)), jax.random.split(run_key, num_tuning_steps))
+
+    # modes which did not move at all would give an infinite mass
+    spectrum = jnp.maximum(spectrum, 1e-8 * jnp.max(spectrum))
+
+    return spectrum, state.position, num_tuning_integrator_steps + num_tuning_steps
+
+
+def unadjusted_mclmc_fourier(integrator_type, spectrum=None, frac_tune3=0.1, return_ess_corr=False, num_tuning_steps=2000):
+    """unadjusted MCLMC on a lattice model (see benchmarks/lattice.py), with a mass matrix which is diagonal in Fourier space.
+    spectrum: the inverse mass matrix in Fourier space, shape model.lattice_shape, e.g. lattice.free_field_spectrum. 
+        If None, it is estimated in the tuning: the power spectrum is averaged over a short run without preconditioning (estimate_fourier_spectrum).
+    The step size and L are then tuned on the preconditioned model."""
+
+    def tune(model, num_steps, initial_position, key):
+
+        tune_key, run_key = jax.random.split(key, 2)
+        spectrum_key, tune_key = jax.random.split(tune_key, 2)
+
+        if spectrum is None:
+            tuned_spectrum, position, num_spectrum_integrator_steps = estimate_fourier_spectrum(model, initial_position, num_steps, spectrum_key, integrator_type, num_tuning_steps)
+        else:
+            tuned_spectrum, position, num_spectrum_integrator_steps = jnp.asarray(spectrum), initial_position, 0
+
+        preconditioned = fourier_preconditioned(model, tuned_spectrum)
+        state, params, num_tuning_integrator_steps = unadjusted_mclmc_tuning(preconditioned.to_y(position), num_steps, tune_key, preconditioned.logdensity_fn, integrator_type, False, frac_tune3, num_tuning_steps=num_tuning_steps)
+
+        return state, params, num_tuning_integrator_steps + num_spectrum_integrator_steps, tuned_spectrum
+
+    def run(model, num_steps, initial_position, key, tuning_result):
+
+        state, params, num_tuning_integrator_steps, tuned_spectrum = tuning_result
+        tune_key, run_key = jax.random.split(key, 2)
+
+        # the states are in the preconditioned variables, the expectation values are computed with model.transform of the original variables
+        outputs = unadjusted_mclmc_no_tuning(
+            state,
+            integrator_type,
+            params.step_size,
+            params.L,
+            params.inverse_mass_matrix,
+            num_tuning_steps,
+            return_ess_corr=return_ess_corr,
+        )(fourier_preconditioned(model, tuned_spectrum), num_steps, initial_position, run_key)
+
+        # estimating the spectrum takes 2 * num_tuning_steps more steps: the tuning without preconditioning and the run which averages the power spectrum
+        return (*outputs, num_tuning_steps * (3 if spectrum is None else 1), num_tuning_integrator_steps)
+
+    def s(model, num_steps, initial_position, key):
+        return run(model, num_steps, initial_position, key, tune(model, num_steps, initial_position, key))
+
+    s.tune, s.run = tune, run
+    s.tuning_config = {'sampler': 'mclmc_fourier', 'integrator': integrator_type, 'frac_tune3': frac_tune3, 'num_tuning_steps': num_tuning_steps,
+                       'spectrum': 'estimated' if spectrum is None else hashlib.sha1(np.asarray(spectrum).tobytes()).hexdigest()}
+
     return s
 
 
@@ -432,9 +774,15 @@ def adjusted_mclmc(
     
     # jax.debug.print("frac tun 3 {x}", x=frac_tune3)
     
-    
+    if target_acc_rate is None:
+        new_target_acc_rate = target_acceptance_rate_of_order[
+            integrator_order(integrator_type)
+        ]
+    else:
+        new_target_acc_rate = target_acc_rate
 
-    def s(model, num_steps, initial_position, key):
+    # the sampler is split in the tuning and the sampling stage, such that the tuning results can be cached (see benchmarks/tuning_cache.py)
+    def tune(model, num_steps, initial_position, key):
 
         tune_key, run_key = jax.random.split(key, 2)
 
@@ -459,34 +807,19 @@ def adjusted_mclmc(
             L_proposal_factor=L_proposal_factor,
         )
 
+        return adjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, preconditioning, new_target_acc_rate, kernel, frac_tune3, params=params, max=max, num_windows=num_windows, tuning_factor=tuning_factor,num_tuning_steps=num_tuning_steps)
 
-        if target_acc_rate is None:
-            new_target_acc_rate = target_acceptance_rate_of_order[
-                integrator_order(integrator_type)
-            ]
-        else:
-            new_target_acc_rate = target_acc_rate
+    def run(model, num_steps, initial_position, key, tuning_result):
+
+        tune_key, run_key = jax.random.split(key, 2)
 
-        
         (
             blackjax_state_after_tuning,
-            blackjax_mclmc_sampler_params, num_tuning_integrator_steps) = adjusted_mclmc_tuning( initial_position, num_steps, tune_key, model.logdensity_fn, preconditioning, new_target_acc_rate, kernel, frac_tune3, params=params, max=max, num_windows=num_windows, tuning_factor=tuning_factor,num_tuning_steps=num_tuning_steps)
-
+            blackjax_mclmc_sampler_params, num_tuning_integrator_steps) = tuning_result
 
         
         # num_tuning_steps = (frac_tune1 + frac_tune2 ) * num_windows * num_steps + frac_tune3 * num_steps
         # jax.debug.print("num_tuning_steps {x}", x=num_tuning_steps)
-
-        # return adjusted_mclmc_no_tuning(
-        #     blackjax_state_after_tuning,
-        #     integrator_type,
-        #     blackjax_mclmc_sampler_params.step_size,
-        #     blackjax_mclmc_sampler_params.L,
-        #     blackjax_mclmc_sampler_params.inverse_mass_matrix,
-        #     L_proposal_factor,
-        #     return_ess_corr=return_ess_corr,
-        #     random_trajectory_length=random_trajectory_length,
-        # )(model, num_steps, initial_position, run_key)
     
         (
             new_params,
@@ -516,6 +849,12 @@ def adjusted_mclmc(
             num_tuning_integrator_steps
             )
 
+    def s(model, num_steps, initial_position, key):
+        return run(model, num_steps, initial_position, key, tune(model, num_steps, initial_position, key))
+
+    s.tune, s.run = tune, run
+    s.tuning_config = {'sampler': 'adjusted_mclmc', 'integrator': integrator_type, 'target_acc_rate': new_target_acc_rate, 'preconditioning': preconditioning, 'L_proposal_factor': L_proposal_factor, 
+                       'params': params, 'max': max, 'num_windows': num_windows, 'random_trajectory_length': random_trajectory_length, 'tuning_factor': tuning_factor, 'num_tuning_steps': num_tuning_steps}
 
     return s
 
@@ -824,7 +1163,8 @@ def adjusted_hmc(
 def nuts(integrator_type, preconditioning, return_ess_corr=False, return_samples=False,incremental_value_transform=None, num_tuning_steps = 2000, return_history=True, target_acc_rate=0.8):
 
 
-    def s(model, num_steps, initial_position, key):
+    # the sampler is split in the tuning and the sampling stage, such that the tuning results can be cached (see benchmarks/tuning_cache.py)
+    def tune(model, num_steps, initial_position, key):
         # num_tuning_steps = num_steps // 5
         
 
@@ -858,6 +1198,17 @@ def nuts(integrator_type, preconditioning, return_ess_corr=False, return_samples
             # print(params)
             # raise Exception
 
+        return state, params, nuts_info.num_integration_steps.sum()
+
+    def run(model, num_steps, initial_position, key, tuning_result):
+
+        integrator = map_integrator_type_to_integrator["hmc"][integrator_type]
+
+        rng_key, warmup_key = jax.random.split(key, 2)
+
+        state, params, num_tuning_integrator_steps = tuning_result
+        params = dict(params)
+
         # jax.debug.print("GAP\n\n\n\n\n\n")
 
         alg = blackjax.nuts(
@@ -869,17 +1220,7 @@ def nuts(integrator_type, preconditioning, return_ess_corr=False, return_samples
 
         fast_key, slow_key = jax.random.split(rng_key, 2)
 
-        results = with_only_statistics(model, alg, state, fast_key, num_steps, incremental_value_transform=incremental_value_transform, return_history=return_history)
-        expectations, info = results[0], results[1]
-
-
-        ess_corr = jax.lax.cond(not return_ess_corr, lambda: jnp.inf, lambda: jnp.mean(effective_sample_size(jax.vmap(lambda x: ravel_pytree(x)[0])(run_inference_algorithm(
-            rng_key=slow_key,
-            initial_state=state,
-            inference_algorithm=alg,
-            num_steps=num_steps,
-            transform=lambda state, _: (model.transform(state.position)),
-            progress_bar=False)[1])[None, ...]))/num_steps)
+        expectations, info, ess_corr = with_only_statistics(model, alg, state, fast_key, num_steps, incremental_value_transform=incremental_value_transform, return_history=return_history, return_ess_corr=return_ess_corr)
 
         
 
@@ -903,20 +1244,26 @@ def nuts(integrator_type, preconditioning, return_ess_corr=False, return_samples
                 num_tuning_steps,
             )
         
-        params["L"] = info.num_integration_steps.mean()*params["step_size"]
+        params["L"] = jnp.nanmean(info.num_integration_steps)*params["step_size"]
         
 
         return (
             params,
-            info.num_integration_steps.mean()
+            jnp.nanmean(info.num_integration_steps)
             * calls_per_integrator_step(integrator_type),
-            info.acceptance_rate.mean(),
+            jnp.nanmean(info.acceptance_rate),
             expectations, 
             ess_corr,
             num_tuning_steps,
-            nuts_info.num_integration_steps.sum(),
+            num_tuning_integrator_steps,
         )
 
+    def s(model, num_steps, initial_position, key):
+        return run(model, num_steps, initial_position, key, tune(model, num_steps, initial_position, key))
+
+    s.tune, s.run = tune, run
+    s.tuning_config = {'sampler': 'nuts', 'integrator': integrator_type, 'target_acc_rate': target_acc_rate, 'preconditioning': preconditioning, 'num_tuning_steps': num_tuning_steps}
+
     return s
 
 
@@ -937,16 +1284,7 @@ def unadjusted_underdamped_langevin_no_tuning(initial_state, integrator_type, st
             integrator=map_integrator_type_to_integrator["hmc"][integrator_type],
         )
 
-        expectations = with_only_statistics(model, alg, initial_state, fast_key, num_steps)[0]
-
-
-        ess_corr = jax.lax.cond(not return_ess_corr, lambda: jnp.inf, lambda: jnp.mean(effective_sample_size(jax.vmap(lambda x: ravel_pytree(x)[0])(run_inference_algorithm(
-            rng_key=slow_key,
-            initial_state=initial_state,
-            inference_algorithm=alg,
-            num_steps=num_steps,
-            transform=lambda state, _: (model.transform(state.position)),
-            progress_bar=False)[1])[None, ...]))/num_steps)
+        expectations, _, ess_corr = with_only_statistics(model, alg, initial_state, fast_key, num_steps, return_ess_corr=return_ess_corr)
 
         return (
             MCLMCAdaptationState(L=L, step_size=step_size, inverse_mass_matrix=inverse_mass_matrix),
@@ -1048,18 +1386,7 @@ def adjusted_hmc_no_tuning(
 
         fast_key, slow_key = jax.random.split(key, 2)
 
-        results = with_only_statistics(model, alg, initial_state, fast_key, num_steps)
-        expectations, info = results[0], results[1]
-
-
-       
-        ess_corr = jax.lax.cond(not return_ess_corr, lambda: jnp.inf, lambda: jnp.mean(effective_sample_size(jax.vmap(lambda x: ravel_pytree(x)[0])(run_inference_algorithm(
-            rng_key=slow_key,
-            initial_state=initial_state,
-            inference_algorithm=alg,
-            num_steps=num_steps,
-            transform=lambda state, _: (model.transform(state.position)),
-            progress_bar=False)[1])[None, ...]))/num_steps)
+        expectations, info, ess_corr = with_only_statistics(model, alg, initial_state, fast_key, num_steps, return_ess_corr=return_ess_corr)
         
         # ess_corr = lambda: jnp.mean(effective_sample_size(jax.vmap(lambda x: ravel_pytree(x)[0])(run_inference_algorithm(
         #     rng_key=slow_key,
@@ -1077,7 +1404,7 @@ def adjusted_hmc_no_tuning(
             # todo fix
             MCLMCAdaptationState(L=L, step_size=step_size, inverse_mass_matrix=inverse_mass_matrix),
             num_steps_per_traj * calls_per_integrator_step(integrator_type),
-            info.acceptance_rate.mean(),
+            jnp.nanmean(info.acceptance_rate),
             expectations, 
             ess_corr,
             num_tuning_steps,
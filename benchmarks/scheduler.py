@@ -0,0 +1,85 @@
+import threading
+import time
+from typing import Callable, NamedTuple
+
+import jax
+import numpy as np
+
+
+# Runs a list of independent benchmark jobs concurrently, on disjoint groups of devices.
+#
+# Running the configurations one after the other leaves most of the devices (or cores) idle while a small model runs.
+# Here each worker thread owns a group of devices and repeatedly takes the most expensive job which is left (longest processing time first),
+# so that the large models start first and the small ones fill the gaps. Jax releases the GIL while a compiled program runs,
+# so the programs of different workers run at the same time.
+#
+# A job writes its own results (e.g. with benchmark.ResultsTable.add), so the output is the same as with a sequential run, only the order of the rows differs.
+# Note that wall and compile times (see metrics.benchmark) of concurrent jobs include the time spent waiting for the cores used by the other workers.
+
+
+class Job(NamedTuple):
+    """name: printed in the progress report, e.g. the config of the row (see benchmark.config_id)
+    cost: estimated cost, only the order matters (see estimated_cost)
+    run: function devices -> None, runs the benchmark on the given devices and stores its results
+    """
+
+    name: str
+    cost: float
+    run: Callable
+
+
+def estimated_cost(model, num_steps, num_chains):
+    return model.ndims * num_steps * num_chains
+
+
+def device_groups(num_workers, devices=None):
+    """splits the devices in num_workers groups. If there are more workers than devices, the workers share the devices."""
+
+    devices = jax.local_devices() if devices is None else devices
+    if num_workers <= len(devices):
+        return [list(group) for group in np.array_split(np.array(devices, dtype=object), num_workers)]
+    return [[devices[i % len(devices)]] for i in range(num_workers)]
+
+
+def run_jobs(jobs, num_workers=1, devices=None):
+    """Runs the jobs on num_workers workers. With num_workers=1, the jobs run in the given order on all the devices, as a plain loop would."""
+
+    if num_workers == 1:
+        for job in jobs:
+            job.run(jax.local_devices() if devices is None else devices)
+        return
+
+    queue = sorted(jobs, key=lambda job: -job.cost)
+    lock = threading.Lock()
+    errors = []
+    total, done = len(queue), [0]
+
+    def worker(group):
+        while True:
+            with lock:
+                if not queue or errors:
+                    return
+                job = queue.pop(0)
+
+            print(f"starting {job.name} on {group}")
+            tic = time.time()
+            try:
+                job.run(group)
+            except Exception as e:
+                with lock:
+                    errors.append((job.name, e))
+                return
+
+            with lock:
+                done[0] += 1
+                print(f"finished {job.name} in {time.time() - tic:.1f}s ({done[0]}/{total} jobs)")
+
+    threads = [threading.Thread(target=worker, args=(group, )) for group in device_groups(num_workers, devices)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        name, e = errors[0]
+        raise Exception(f"job {name} failed") from e
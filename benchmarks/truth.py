@@ -1,9 +1,15 @@
+import json
+import math
+import os
+import time
+from typing import NamedTuple
+
 import jax
 import jax.numpy as jnp
 import blackjax
 import numpy as np
-import os
 from benchmarks.inference_models import *
+from benchmarks.parallel import shard_chains
 
 
 ### compute the "ground truth" chains, i.e. very long NUTS chains
@@ -44,10 +50,179 @@ def cov_matrix(model, samples):
     
 
 
+### streaming version: many chains in parallel, the samples are never stored
+#
+#     ground_truth(Brownian(), num_steps= 10**5, folder= 'truth_checkpoints/Brownian', num_chains= 128)
+#
+# runs num_chains NUTS chains (each with its own window adaptation) and accumulates the moments of model.transform(x) online, at every step:
+#   - for each chain, the mean and the sum of squared deviations of x and of x^2 (Welford), from which R-hat and Var[x^2] are computed,
+#   - the covariance of all the samples, with the samples of all the chains at a step merged in one rank-num_chains update (Chan et al.).
+# Every steps_per_checkpoint steps, the chain states and the accumulator are saved in the folder and the largest R-hat is printed.
+# If the run is interrupted, calling ground_truth again with the same folder continues from the last checkpoint.
+# At the end, the results are written to ground_truth/model.name/moments.npy and cov.npz (see load_cov and benchmarks/data_store.py).
+#
+# The accumulators are numerically stable, but use jax_enable_x64 for runs of ~10^7 samples.
+
+
+class Accumulator(NamedTuple):
+    n: jax.Array # number of steps (samples per chain)
+    chain_mean: jax.Array # (num_chains, d) mean of x in each chain
+    chain_m2: jax.Array # (num_chains, d) sum of squared deviations from the mean of x in each chain
+    chain_mean_sq: jax.Array # same for x^2
+    chain_m2_sq: jax.Array
+    M2: jax.Array # (d, d) sum of (x - E_x)(x - E_x)^T over all the samples, None if covariance= False
+
+
+def init_accumulator(num_chains, d, covariance= True):
+    zeros = jnp.zeros((num_chains, d))
+    return Accumulator(jnp.zeros(()), zeros, zeros, zeros, zeros, jnp.zeros((d, d)) if covariance else None)
+
+
+def welford(n, mean, m2, x):
+    delta = x - mean
+    mean = mean + delta / n
+    return mean, m2 + delta * (x - mean)
+
+
+def update(acc, X):
+    """adds X = the samples of all the chains at one step, shape (num_chains, d)"""
+
+    n = acc.n + 1
+    chain_mean, chain_m2 = welford(n, acc.chain_mean, acc.chain_m2, X)
+    chain_mean_sq, chain_m2_sq = welford(n, acc.chain_mean_sq, acc.chain_m2_sq, jnp.square(X))
+
+    M2 = acc.M2
+    if M2 is not None:
+        # merge the num_chains new samples with all the previous ones
+        k = X.shape[0]
+        n_before, n_after = acc.n * k, n * k
+        batch_mean = jnp.average(X, axis= 0)
+        D = X - batch_mean[None, :]
+        delta = batch_mean - jnp.average(acc.chain_mean, axis= 0)
+        M2 = M2 + D.T @ D + jnp.outer(delta, delta) * (n_before * k / n_after)
+
+    return Accumulator(n, chain_mean, chain_m2, chain_mean_sq, chain_m2_sq, M2)
+
+
+def moments(acc):
+    """E_x, E_x2, Var_x2 and the covariance matrix (None if it was not accumulated) of all the samples"""
+
+    num_samples = acc.n * acc.chain_mean.shape[0]
+    E_x = jnp.average(acc.chain_mean, axis= 0)
+    E_x2 = jnp.average(acc.chain_mean_sq, axis= 0)
+    # within chain + between chain sum of squares
+    Var_x2 = (jnp.sum(acc.chain_m2_sq, axis= 0) + acc.n * jnp.sum(jnp.square(acc.chain_mean_sq - E_x2[None, :]), axis= 0)) / num_samples
+    cov = None if acc.M2 is None else acc.M2 / num_samples
+    return E_x, E_x2, Var_x2, cov
+
+
+def rhat(n, chain_mean, chain_m2):
+    """Gelman-Rubin R-hat of each parameter"""
+
+    W = jnp.average(chain_m2, axis= 0) / (n - 1) # within chain variance
+    B = jnp.var(chain_mean, axis= 0, ddof= 1) # between chain variance / n
+    return jnp.sqrt(((n - 1) / n * W + B) / W)
+
+
+def max_rhat(acc):
+    """largest R-hat of x and of x^2"""
+    return jnp.max(rhat(acc.n, acc.chain_mean, acc.chain_m2)), jnp.max(rhat(acc.n, acc.chain_mean_sq, acc.chain_m2_sq))
+
+
+def save_checkpoint(path, steps, tree):
+    np.savez(path + '.tmp.npz', np.asarray(steps), *[np.asarray(x) for x in jax.tree_util.tree_leaves(tree)])
+    os.replace(path + '.tmp.npz', path)
+
+
+def load_checkpoint(path, shapes):
+    """steps, tree with the structure of shapes"""
+    data = np.load(path)
+    leaves = [jnp.asarray(data[f'arr_{i+1}']) for i in range(len(jax.tree_util.tree_leaves(shapes)))]
+    return int(data['arr_0']), jax.tree_util.tree_unflatten(jax.tree_util.tree_structure(shapes), leaves)
+
+
+def ground_truth(model, num_steps, folder, num_chains= 128, steps_per_checkpoint= 10**4, num_warmup= 2000, covariance= True, key= jax.random.key(0), pvmap= shard_chains, save= True):
+    """Args:
+        num_steps: number of steps of each chain after the warmup (rounded up to a multiple of steps_per_checkpoint)
+        folder: where the checkpoints are saved
+        covariance: also accumulate the covariance matrix (memory d x d)
+        pvmap: maps a function over the chains, see metrics.benchmark
+        save: write the results to ground_truth/model.name/
+    Returns:
+        E_x, E_x2, Var_x2, cov (None if covariance= False), history of the largest R-hat of x and x^2 at the checkpoints
+    """
+    
+    integrator = blackjax.mcmc.integrators.velocity_verlet
+    warmup_key, key = jax.random.split(key)
+    num_segments = math.ceil(num_steps / steps_per_checkpoint)
+
+    def warmup(key):
+        warmup_key, init_key = jax.random.split(key)
+        warmup = blackjax.window_adaptation(blackjax.nuts, model.logdensity_fn, integrator=integrator, target_acceptance_rate= 0.95)
+        (state, params), _ = warmup.run(warmup_key, model.sample_init(init_key), num_warmup)
+        return state, params
+
+    def step(key, state, params):
+        nuts = blackjax.nuts(logdensity_fn= model.logdensity_fn, step_size=params['step_size'], inverse_mass_matrix= params['inverse_mass_matrix'], integrator=integrator)
+        return nuts.step(key, state)[0]
+
+    chain_step = pvmap(step)
+
+    @jax.jit
+    def segment(states, params, acc, key):
+        def body(carry, key):
+            states, acc = carry
+            states = chain_step(jax.random.split(key, num_chains), states, params)
+            return (states, update(acc, jax.vmap(model.transform)(states.position))), None
+
+        return jax.lax.scan(body, (states, acc), jax.random.split(key, steps_per_checkpoint))[0]
+
+    warmup_keys = jax.random.split(warmup_key, num_chains)
+    d = jax.eval_shape(lambda k: model.transform(model.sample_init(k)), warmup_keys[0]).shape[0]
+    
+    os.makedirs(folder, exist_ok= True)
+    path = os.path.join(folder, 'checkpoint.npz')
+    metadata = {'model': model.name, 'num_chains': num_chains, 'steps_per_checkpoint': steps_per_checkpoint, 'covariance': covariance}
+    if os.path.exists(path):
+        with open(os.path.join(folder, 'run.json')) as f:
+            saved = json.load(f)
+        if saved != metadata:
+            raise Exception(f"{folder} contains a checkpoint of a different run: {saved}, now running {metadata}. Use a different folder or delete it.")
+        shapes = (jax.eval_shape(pvmap(warmup), warmup_keys), init_accumulator(num_chains, d, covariance))
+        steps, ((states, params), acc) = load_checkpoint(path, shapes)
+        print(f'resuming from step {steps}')
+    else:
+        with open(os.path.join(folder, 'run.json'), 'w') as f:
+            json.dump(metadata, f)
+        states, params = pvmap(warmup)(warmup_keys)
+        acc, steps = init_accumulator(num_chains, d, covariance), 0
+    
+    history = []
+    for i in range(steps // steps_per_checkpoint, num_segments):
+        tic = time.time()
+        states, acc = segment(states, params, acc, jax.random.fold_in(key, i))
+        steps = (i + 1) * steps_per_checkpoint
+        save_checkpoint(path, steps, ((states, params), acc))
+        
+        history.append([float(r) for r in max_rhat(acc)])
+        print(f'{steps}/{num_segments * steps_per_checkpoint} steps ({time.time() - tic:.1f}s), max R-hat: x {history[-1][0]:.4f}, x^2 {history[-1][1]:.4f}')
+
+    E_x, E_x2, Var_x2, cov = moments(acc)
+    
+    if save:
+        os.makedirs(dir_ground_truth + model.name, exist_ok= True)
+        np.save(dir_ground_truth + model.name + '/moments.npy', np.array([E_x2, Var_x2]))
+        if cov is not None:
+            np.savez(dir_ground_truth + model.name + '/cov.npz', x_avg = E_x, cov= cov)
+
+    return E_x, E_x2, Var_x2, cov, np.array(history)
+
+
+
 if __name__ == '__main__':
     
+    jax.config.update('jax_enable_x64', True)
     model = Funnel_with_Data(d= 101, sigma= 1.)
-    samples = nuts(model, num_steps= 10**7)
-    cov_matrix(model, samples)
+    ground_truth(model, num_steps= 10**7 // 128, folder= 'truth_checkpoints/' + model.name, num_chains= 128)
     
     
\ No newline at end of file
@@ -0,0 +1,101 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+
+import jax
+import numpy as np
+
+
+# On-disk store of tuning results, so that reruns and parameter sweeps do not have to redo thousands of tuning steps.
+#
+# An entry is identified by the model (name, ndims), the tuning configuration (sampler, integrator, target acceptance rate, preconditioning, number of steps, ...)
+# and the random key that was used for tuning. It holds whatever the tuning function returned,
+# typically (state after tuning, MCLMCAdaptationState, number of tuning integrator steps).
+# Each entry also stores a hash of the model's source code and of the parameters of the instance (e.g. the eigenvalues of a Gaussian, lam of Phi4):
+# if the model definition changes, the entry is discarded and the tuning is redone.
+# A model can define model.cache_key to choose itself which parameters identify it.
+
+# attributes which metrics.benchmark sets on its copy of the model, they do not change the target
+run_options = ('early_stopping', 'bias_recording')
+
+
+def instance_parameters(model):
+    """public attributes of the model instance which are not functions. The lazily loaded data (see data_store.py) is left out, it is identified by the name."""
+
+    lazy = {name for cls in type(model).__mro__ for name, attr in vars(cls).items() if isinstance(attr, functools.cached_property)}
+    return {name: value for name, value in vars(model).items()
+            if not name.startswith('_') and not callable(value) and name not in lazy and name not in run_options}
+
+
+def to_bytes(value):
+    if isinstance(value, dict):
+        return b''.join(to_bytes(k) + to_bytes(v) for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return b'(' + b','.join(to_bytes(v) for v in value) + b')'
+    if isinstance(value, (np.ndarray, jax.Array)):
+        value = np.asarray(jax.device_get(value))
+        return (str(value.dtype) + str(value.shape)).encode() + value.tobytes()
+    return repr(value).encode()
+
+
+def model_hash(model):
+    """hash of the model definition (source code of its class + name + dimensionality + model.cache_key, or the instance parameters if the model does not define it)"""
+
+    try:
+        source = inspect.getsource(type(model))
+    except (OSError, TypeError):
+        source = type(model).__qualname__
+    parameters = model.cache_key if hasattr(model, 'cache_key') else instance_parameters(model)
+    return hashlib.sha256((source + model.name + str(model.ndims)).encode() + to_bytes(parameters)).hexdigest()
+
+
+def key_to_seed(key):
+    """hex string of the raw bits of a jax random key (works for both the old uint32 keys and the new typed keys)"""
+
+    if jax.dtypes.issubdtype(key.dtype, jax.dtypes.prng_key):
+        key = jax.random.key_data(key)
+    return jax.device_get(key).tobytes().hex()
+
+
+def entry_path(folder, model, config, key):
+    config = dict(sorted(config.items()))
+    digest = hashlib.sha256((repr(config) + key_to_seed(key)).encode()).hexdigest()[:16]
+    return os.path.join(folder, f"{model.name}{model.ndims}_{digest}.pkl")
+
+
+def cached_tuning(folder, model, config, key, tune):
+    """Returns tune() if the cache is disabled (folder is None) or there is no valid entry. Otherwise returns the stored result.
+
+    Args:
+        folder: directory of the cache. If None, caching is disabled.
+        model: the target, used for the name, ndims and the model hash.
+        config: a dictionary which describes the tuning, e.g. {'sampler': 'adjusted_mclmc', 'integrator': 'mclachlan', 'target_acc_rate': 0.9, 'preconditioning': False, 'num_steps': 10000}
+        key: the random key of the tuning
+        tune: function with no arguments that does the tuning
+    """
+
+    if folder is None:
+        return tune()
+
+    os.makedirs(folder, exist_ok=True)
+    path = entry_path(folder, model, config, key)
+    current_hash = model_hash(model)
+
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+        if entry['model_hash'] == current_hash:
+            print(f"loaded tuning for {model.name} from {path}")
+            return entry['result']
+        print(f"model {model.name} changed since the tuning was cached, retuning")
+
+    result = tune()
+
+    # write to a temporary file first, such that an interrupted job does not leave a corrupted entry
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump({'model_hash': current_hash, 'config': config, 'result': jax.device_get(result)}, f)
+    os.replace(path + '.tmp', path)
+
+    return result
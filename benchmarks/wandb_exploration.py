@@ -26,7 +26,7 @@ from benchmarks.sampling_algorithms import (
 # os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count=" + str(128)
 # num_cores = jax.local_device_count()
 
-from metrics import benchmark
+from metrics import benchmark_sweep
 from benchmarks.sampling_algorithms import (
 
     adjusted_hmc,
@@ -66,29 +66,33 @@ initial_state = blackjax.mcmc.adjusted_mclmc.init(
 
 # Todo: q for wilka: different key
 
+# one compiled sampler per integrator: L and step_size are runtime arguments, so the trials of the sweep do not recompile
+samplers = {}
+
 def objective(config):
 
     tune_key, key = jax.random.split(jax.random.PRNGKey(0), 2)
 
-    ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _ = benchmark(
-                            model=model,
-                            sampler=adjusted_mclmc_no_tuning(
-                                integrator_type=config.integrator_type,
-                                initial_state=initial_state,
-                                inverse_mass_matrix=1.,
-                                L=config.L,
-                                random_trajectory_length=False,
-                                step_size=config.step_size,
-                                L_proposal_factor=2.0,
-                                return_ess_corr=False,
-                                num_tuning_steps=0, # doesn't matter what is passed here
-                            ),
-                            key=key,
-                            n=n,
-                            batch=num_chains,
-                            pvmap=jax.vmap,
-                        )
+    integrator_type = config.integrator_type
+    if integrator_type not in samplers:
+        samplers[integrator_type] = benchmark_sweep(
+            model=model,
+            sampler_fn=lambda L, step_size: adjusted_mclmc_no_tuning(
+                integrator_type=integrator_type,
+                initial_state=initial_state,
+                inverse_mass_matrix=1.,
+                L=L,
+                random_trajectory_length=False,
+                step_size=step_size,
+                L_proposal_factor=2.0,
+                return_ess_corr=False,
+            ),
+            n=n,
+            batch=num_chains,
+            pvmap=jax.vmap,
+        )
 
+    ess, ess_avg, ess_corr, params, acceptance_rate, grads_to_low_avg, _, _, _ = samplers[integrator_type](key, config.L, config.step_size)
 
     score = ess
     return score
@@ -98,7 +102,7 @@ name = "brownian"
 def main():
     wandb.init(project=name)
     score = objective(wandb.config)
-    wandb.log({"score": score})
+    wandb.log({"score": score, "num_compilations": samplers[wandb.config.integrator_type].num_compilations})
 
 # 2: Define the search space
 sweep_configuration = {
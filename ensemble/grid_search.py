@@ -1,7 +1,8 @@
-
-
 from itertools import product
 import os, sys, inspect
+import json
+import multiprocessing
+import traceback
 import pandas as pd
 
 
@@ -18,11 +19,92 @@ def subdir(values):
     for val in values:
         file += str(val) + '_'
     return file[:-1] + '/'
-    
 
-def do_grid(func, param_grid, fixed_params=None, verbose= False, extra_word= ''):
+
+def to_python(value):
+    """jax and numpy scalars to python numbers, such that the results can be stored as json and sent between processes"""
+    return value.item() if hasattr(value, 'item') else value
+
+
+def result_file(dir, extra_word):
+    return dir + 'result' + extra_word + '.json'
+
+
+def load_result(dir, extra_word):
+    """the result of a combination which was already computed (by this or a previous run), None otherwise"""
+    file = result_file(dir, extra_word)
+    if not os.path.isfile(file):
+        return None
+    with open(file) as f:
+        return json.load(f)
+
+
+def run_combination(func, params, extra_word):
+    """evaluates the function and stores its result in the combination's folder"""
+
+    result_dict = func(**params)
+    if not isinstance(result_dict, dict):
+        raise ValueError("The function must return a dictionary.")
+    result_dict = {k: to_python(v) for k, v in result_dict.items()}
+
+    file = result_file(params['dir'], extra_word)
+    with open(file + '.tmp', 'w') as f:
+        json.dump(result_dict, f)
+    os.replace(file + '.tmp', file)
+
+    return result_dict
+
+
+def worker(func, extra_word, tasks, results):
+    for index, params in iter(tasks.get, None):
+        try:
+            results.put((index, run_combination(func, params, extra_word), None))
+        except Exception:
+            results.put((index, None, traceback.format_exc()))
+
+
+def run_in_processes(func, todo, extra_word, num_workers, worker_env, finished):
+    """runs the combinations in num_workers processes. worker_env: list of environment variables for each worker, e.g. [{'CUDA_VISIBLE_DEVICES': '0'}, {'CUDA_VISIBLE_DEVICES': '1'}]"""
+
+    # spawn rather than fork, jax is not fork-safe
+    context = multiprocessing.get_context('spawn')
+    tasks, results = context.Queue(), context.Queue()
+    for task in todo:
+        tasks.put(task)
+
+    processes = []
+    for i in range(num_workers):
+        env = worker_env[i] if worker_env is not None else {}
+        old_env = {k: os.environ.get(k) for k in env}
+        os.environ.update(env) # the child process inherits the environment at the start
+        process = context.Process(target=worker, args=(func, extra_word, tasks, results))
+        process.start()
+        processes.append(process)
+        for k, v in old_env.items():
+            if v is None:
+                del os.environ[k]
+            else:
+                os.environ[k] = v
+        tasks.put(None) # one stop signal for each worker
+
+    failed = True
+    try:
+        for _ in range(len(todo)):
+            index, result_dict, error = results.get()
+            if error is not None:
+                raise Exception(f"combination {index} failed:\n{error}")
+            finished(index, result_dict)
+        failed = False
+    finally:
+        for process in processes:
+            if failed:
+                process.terminate()
+            process.join()
+
+
+def do_grid(func, param_grid, fixed_params=None, verbose= False, extra_word= '', num_workers= 1, worker_env= None):
     """
-    Perform a grid search over specified parameters for a given function, 
+    Perform a grid search over specified parameters for a given function,
     while keeping other parameters fixed to their default values, and allowing
     for parameters without default values to be specified separately.
 
@@ -30,13 +112,18 @@ def do_grid(func, param_grid, fixed_params=None, verbose= False, extra_word= '')
     - func: The function to evaluate. It must return a dictionary.
     - param_grid: A dictionary where keys are parameter names and values are lists of values to try.
     - fixed_params: A dictionary of parameters that don't have default values, to be fixed across all evaluations.
+    - num_workers: number of combinations which are evaluated at the same time, each in its own process (func has to be picklable, e.g. a module level function).
+    - worker_env: list of num_workers dictionaries of environment variables for the worker processes, e.g. to give each worker its own gpu with CUDA_VISIBLE_DEVICES.
+
+    The result of each combination is stored in its folder, base_dir(param_grid) + subdir(values), and combinations which already have a result there are not computed again.
+    The rows are appended to data.csv as the combinations finish, and at the end data.csv is rewritten with all the rows in the order of the grid.
 
     Returns:
     - A pandas DataFrame where each row represents a parameter combination,
       excluding fixed parameters, with additional columns corresponding to the
       keys of the dictionary returned by the function.
     """
-    
+
     base = base_dir(param_grid)
 
     if not os.path.isdir(base):
@@ -56,35 +143,52 @@ def do_grid(func, param_grid, fixed_params=None, verbose= False, extra_word= '')
     grid_keys = list(param_grid.keys())
     grid_values = list(param_grid.values())
     combinations = list(product(*grid_values))
-    
-    results = []
-    counter = 0
-    for values in combinations:
-        if verbose: print(f'{counter} / {len(combinations)}')
-        counter += 1
+    csv = base + 'data'+extra_word+'.csv'
+
+    all_params = []
+    rows = {}
+    todo = []
+
+    def make_row(params, result_dict):
+        # Prepare a row with the varying parameters and result dictionary values
+        row = {
+            k: params[k] for k in sig.parameters.keys() if k != 'dir'
+        }
+        row.update(result_dict)  # Add the function output dictionary
+        return row
+
+    for index, values in enumerate(combinations):
         # Update parameters for this combination
         params = all_fixed_params.copy()
         params.update(dict(zip(grid_keys, values)))
-        # Evaluate the function with the current parameter set
         dir = base + subdir(values)
         params['dir'] = dir
-        
+        all_params.append(params)
+
         if not os.path.isdir(dir):
             os.mkdir(dir)
 
-        result_dict = func(**params)
-        if not isinstance(result_dict, dict):
-            raise ValueError("The function must return a dictionary.")
-        
-        # Prepare a row with the varying parameters and result dictionary values
-        row = {
-            k: params[k] for k in sig.parameters.keys()
-        }
-        row.update(result_dict)  # Add the function output dictionary
-        results.append(row)
-    
+        cached = load_result(dir, extra_word)
+        if cached is not None:
+            rows[index] = make_row(params, cached)
+        else:
+            todo.append((index, params))
+
+    if verbose and rows: print(f'{len(rows)} / {len(combinations)} already computed')
+
+    def finished(index, result_dict):
+        rows[index] = make_row(all_params[index], result_dict)
+        pd.DataFrame([rows[index]]).to_csv(csv, sep= '\t', index= False, mode= 'a', header= not os.path.isfile(csv))
+        if verbose: print(f'{len(rows)} / {len(combinations)}')
+
+    if num_workers == 1:
+        for index, params in todo:
+            finished(index, run_combination(func, params, extra_word))
+    else:
+        run_in_processes(func, todo, extra_word, num_workers, worker_env, finished)
+
     # Convert results to a pandas DataFrame
-    df = pd.DataFrame(results)
-    df = df.drop(columns= ['dir', ])
-    
-    df.to_csv(base + 'data'+extra_word+'.csv', sep= '\t', index= False)
\ No newline at end of file
+    df = pd.DataFrame([rows[index] for index in range(len(combinations))])
+
+    df.to_csv(csv, sep= '\t', index= False)
+    return df
@@ -14,6 +14,7 @@ sys.path.append('../blackjax/')
 from blackjax.adaptation.ensemble_mclmc import emaus
 from blackjax.mcmc.integrators import velocity_verlet_coefficients, mclachlan_coefficients, omelyan_coefficients
 from benchmarks.inference_models import *
+from benchmarks.batching import with_batched_logdensity
 from ensemble.grid_search import do_grid
 from ensemble.extract_image import imported_plot, third_party_methods
 #os.environ["XLA_FLAGS"] = '--xla_force_host_platform_device_count=128'
@@ -242,7 +243,7 @@ def _main(dir,
         #vec = (target.R.T)[[0, -1], :]
         
         
-        info1, info2, grads_per_step, _acc_prob = emaus(target, num_steps1, num_steps2, chains, mesh, key, 
+        info1, info2, grads_per_step, _acc_prob = emaus(with_batched_logdensity(target), num_steps1, num_steps2, chains, mesh, key, 
                              alpha= alpha, bias_type= bias_type, C= C, power= power, early_stop= early_stop, r_end= r_end,
                              diagonal_preconditioning= diagonal_preconditioning, integrator_coefficients= integrator_coefficients, steps_per_sample= steps_per_sample, acc_prob= acc_prob,
                              ensemble_observables= lambda x: x
@@ -265,7 +266,7 @@ def _main(dir,
 
 mylogspace = lambda a, b, num, decimals=3: np.round(np.logspace(np.log10(a), np.log10(b), num), decimals)
 
-grid = lambda params, fixed_params= None, verbose= True, extra_word= '': do_grid(_main, params, fixed_params=fixed_params, verbose= verbose, extra_word= extra_word)
+grid = lambda params, fixed_params= None, verbose= True, extra_word= '', num_workers= 1, worker_env= None: do_grid(_main, params, fixed_params=fixed_params, verbose= verbose, extra_word= extra_word, num_workers= num_workers, worker_env= worker_env)
 
 
 
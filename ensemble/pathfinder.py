@@ -17,7 +17,8 @@ model_names = [model.name for model in models]
 
 def multi_path_slow(model, num_chains, rng_key= jax.random.key(42)):
     """Count the number of logp calls. 
-    Pathfinder is here run in a for loop which makes it very slow, so this is only intended for counting the number of gradients."""
+    Pathfinder is here run in a for loop which makes it very slow, so this is only intended for counting the number of gradients.
+    (benchmarks/eval_counter.py can not be used here: pathfinder vmaps the log density itself to estimate the ELBO.)"""
 
     print(model.name)
     init_key, run_key, resample_key  = jax.random.split(rng_key, 3)
@@ -11,6 +11,7 @@ sys.path.append('./')
 from blackjax.adaptation.ensemble_mclmc import emaus
 from blackjax.mcmc.integrators import velocity_verlet_coefficients, mclachlan_coefficients, omelyan_coefficients
 from benchmarks.inference_models import *
+from benchmarks.batching import with_batched_logdensity
 from ensemble.grid_search import do_grid
 from ensemble.extract_image import imported_plot, third_party_methods
 #os.environ["XLA_FLAGS"] = '--xla_force_host_platform_device_count=128'
@@ -51,6 +52,7 @@ def _main(dir,
     results = {}
     for t in targets:
         target, num_steps1, num_steps2 = t
+        target = with_batched_logdensity(target) # the chains are evaluated together if the target has a batched_logdensity_fn
         #print(target.name)
         #vec = (target.R.T)[[0, -1], :]
 
@@ -104,7 +106,7 @@ def _main(dir,
 
 mylogspace = lambda a, b, num, decimals=3: np.round(np.logspace(np.log10(a), np.log10(b), num), decimals)
 
-grid = lambda params, fixed_params= None, verbose= True, extra_word= '': do_grid(_main, params, fixed_params=fixed_params, verbose= verbose, extra_word= extra_word)
+grid = lambda params, fixed_params= None, verbose= True, extra_word= '', num_workers= 1, worker_env= None: do_grid(_main, params, fixed_params=fixed_params, verbose= verbose, extra_word= extra_word, num_workers= num_workers, worker_env= worker_env)
 
 
 
@@ -15,9 +15,14 @@ import os, sys
 sys.path.append('../blackjax/')
 import blackjax
 from blackjax.mcmc.integrators import isokinetic_velocity_verlet
-from blackjax.util import run_inference_algorithm, store_only_expectation_values, thinning
 
 from benchmarks.inference_models import *
+from benchmarks.covariance_bias import CovarianceBias, covariance_bias
+
+
+def covariance_config(model):
+    # the full d x d covariance matrix of each chain does not fit in memory for large d, estimate the bias from a sketch instead
+    return CovarianceBias(method= 'sketch') if model.ndims > 1000 else CovarianceBias()
 
 
 
@@ -55,37 +60,17 @@ def _sample(model, sampling_alg, num_steps, burn_in_steps, num_thinning, step_si
     
     alg, initial_state = sampling_alg(init_key, step_size, model, L)
     
-    def frobenious(cov):
-        """directly convert the covariance matrix expectation values to the bias scalar (to save memory)"""
-        residual = jnp.eye(model.ndims) - model.inv_cov @ cov
-        return jnp.average(jnp.diag(residual @ residual))
-    
-    def xixj(state):
-        """expectation values to compute: E[x_i x_j]"""
-        x = model.transform(state.position) - model.E_x
-        return jnp.outer(x, x)
-    
-    # transform the kernel to save memory
-    memory_efficient_sampling_alg, transform = store_only_expectation_values(
-        sampling_algorithm= alg,
-        state_transform= xixj,
-        exp_vals_transform= frobenious,
-        burn_in = burn_in_steps
+    # bias of the covariance matrix, computed from the running average of (x - E_x)(x - E_x)^T at the saved steps
+    b, info = covariance_bias(
+        model= model,
+        alg= alg,
+        initial_state= initial_state,
+        key= run_key,
+        num_checkpoints= num_steps,
+        steps_per_checkpoint= num_thinning,
+        burn_in= burn_in_steps,
+        config= covariance_config(model)
     )
-    
-    thinned_memory_efficient_sampling_alg = thinning(memory_efficient_sampling_alg, num_thinning)
-    
-    initial_state = thinned_memory_efficient_sampling_alg.init(initial_state)
-    
-    # run the algorithm
-    b, info = run_inference_algorithm(
-        rng_key=run_key,
-        initial_state=initial_state,
-        inference_algorithm=thinned_memory_efficient_sampling_alg,
-        num_steps=num_steps,
-        transform=transform,
-        progress_bar=False,
-    )[1]
 
     eevpd = jnp.std(info.energy_change)**2 / model.ndims
     return b, eevpd
@@ -0,0 +1,93 @@
+import sys
+
+sys.path.append("./")
+sys.path.append("../blackjax")
+
+import jax
+import jax.numpy as jnp
+import pytest
+
+from typing import NamedTuple
+
+from benchmarks.covariance_bias import CovarianceBias, covariance_bias, exact_accumulator, sketch_accumulator
+from benchmarks.inference_models import Gaussian
+
+
+# the accumulators are fed with samples X whose second moment X^T X / k is exactly scale * the true covariance, such that the bias is known: 
+# Tr[(I - scale I)^2] / d = (1 - scale)^2
+
+gaussians = {
+    'diagonal': lambda: Gaussian(ndims=50, condition_number=100.),
+    'dense': lambda: Gaussian(ndims=50, condition_number=100., numpy_seed=0),
+}
+
+
+def samples(model, scale):
+    cov = jnp.diag(model.cov) if model.cov.ndim == 1 else model.cov
+    return jnp.sqrt(scale * model.ndims) * jnp.linalg.cholesky(cov).T # X^T X / ndims = scale * cov
+
+
+@pytest.mark.parametrize('name', list(gaussians))
+@pytest.mark.parametrize('scale', [1., 2.])
+def test_exact(name, scale):
+    model = gaussians[name]()
+    init, update, bias = exact_accumulator(model)
+    assert jnp.allclose(bias(update(init(), samples(model, scale), model.ndims)), (1 - scale)**2, atol=1e-3)
+
+
+@pytest.mark.parametrize('name', list(gaussians))
+@pytest.mark.parametrize('scale', [1., 2.])
+def test_sketch(name, scale):
+    model = gaussians[name]()
+    init, update, bias = sketch_accumulator(model, rank=16, key=jax.random.key(0))
+    assert jnp.allclose(bias(update(init(), samples(model, scale), model.ndims)), (1 - scale)**2, atol=1e-3)
+
+
+def test_no_precision():
+    model = Gaussian(ndims=50, numpy_seed=0, rotation='dct')
+    with pytest.raises(Exception, match='inv_cov'):
+        exact_accumulator(model)
+    with pytest.raises(Exception, match='inv_cov'):
+        sketch_accumulator(model, rank=16, key=jax.random.key(0))
+
+
+@pytest.mark.parametrize('name', list(gaussians))
+def test_sketch_general(name):
+    """samples with a general full rank second moment and rank < ndims probes: the Hutchinson estimate has a relative error of ~ 5% here, the tolerance is 20%"""
+
+    model = gaussians[name]()
+    cov = jnp.diag(model.cov) if model.cov.ndim == 1 else model.cov
+    X = jax.random.normal(jax.random.key(3), (400, model.ndims)) @ jnp.linalg.cholesky(cov).T
+
+    init, update, bias = exact_accumulator(model)
+    exact = bias(update(init(), X, X.shape[0]))
+    init, update, bias = sketch_accumulator(model, rank=16, key=jax.random.key(0))
+    sketch = bias(update(init(), X, X.shape[0]))
+
+    assert exact > 0.1 # not trivially exact
+    assert jnp.allclose(sketch, exact, rtol=0.2)
+
+
+class IIDState(NamedTuple):
+    position: jax.Array
+    num_steps: jax.Array
+
+
+@pytest.mark.parametrize('method', ['exact', 'sketch'])
+def test_burn_in(method):
+    """the burn-in steps are part of num_checkpoints * steps_per_checkpoint, and their samples are not used"""
+
+    model = gaussians['dense']()
+    burn_in = 250
+
+    class IID:
+        """independent samples from the model, far away during the burn-in"""
+        def step(key, state):
+            x = jnp.where(state.num_steps < burn_in, 100., 1.) * jax.random.multivariate_normal(key, model.E_x, model.cov)
+            return IIDState(x, state.num_steps + 1), state.num_steps + 1
+
+    b, num_steps = covariance_bias(model, IID, IIDState(jnp.zeros(model.ndims), 0), jax.random.key(1), num_checkpoints=10, steps_per_checkpoint=500,
+                                   burn_in=burn_in, config=CovarianceBias(method=method, block_size=100, rank=16))
+
+    assert num_steps[-1] == 10 * 500
+    assert b[-1] < 0.05 # ~ ndims / (number of samples after the burn-in)
@@ -0,0 +1,54 @@
+import sys
+
+sys.path.append("./")
+sys.path.append("../blackjax")
+
+import jax
+import jax.numpy as jnp
+import pytest
+
+from benchmarks.batching import with_batched_logdensity
+from benchmarks.eval_counter import EvalCounter, counting
+from benchmarks.inference_models import GermanCredit
+from benchmarks.parallel import shard_chains
+
+
+# each chain does a different number of gradient steps in a while loop (as in nuts), followed by a fixed number of log density evaluations
+
+num_value_calls = 3
+
+
+def chain(model, num_grad_calls, x):
+
+    def gradient_step(carry):
+        i, x = carry
+        _, g = jax.value_and_grad(model.logdensity_fn)(x)
+        return i + 1, x + 1e-3 * g
+
+    _, x = jax.lax.while_loop(lambda carry: carry[0] < num_grad_calls, gradient_step, (0, x))
+
+    def value_step(x, _):
+        return x, model.logdensity_fn(x)
+
+    return jax.lax.scan(value_step, x, None, length=num_value_calls)
+
+
+@pytest.mark.parametrize('pvmap', [jax.vmap, shard_chains])
+@pytest.mark.parametrize('batched', [False, True])
+def test_counts(pvmap, batched):
+    model = GermanCredit()
+    if batched:
+        model = with_batched_logdensity(model)
+
+    num_grad_calls = jnp.array([1, 4, 7, 0, 5])
+    x = jax.vmap(model.sample_init)(jax.random.split(jax.random.key(0), len(num_grad_calls)))
+
+    counter = EvalCounter(len(num_grad_calls))
+    for stage in ['tuning', 'sampling', 'sampling']:
+        _, counts = pvmap(lambda n, x: counting(chain)(model, n, x))(num_grad_calls, x)
+        counter.add(stage, counts)
+
+    result = counter.result()
+    assert result['tuning']['grad'].tolist() == num_grad_calls.tolist()
+    assert result['tuning']['value'].tolist() == [num_value_calls] * len(num_grad_calls)
+    assert result['sampling']['grad'].tolist() == (2 * num_grad_calls).tolist()
@@ -0,0 +1,73 @@
+import math
+import sys
+
+sys.path.append("./")
+sys.path.append("../blackjax")
+
+import jax
+import jax.numpy as jnp
+import pytest
+
+from benchmarks.lattice import Phi4, fourier_power, fourier_preconditioned, free_field_spectrum
+
+
+class FreeField:
+    """free scalar field with action 1/2 phi (-laplace + m2) phi on a periodic lattice"""
+
+    def __init__(self, lattice_shape, m2):
+        self.name = 'FreeField'
+        self.lattice_shape = lattice_shape
+        self.ndims = math.prod(lattice_shape)
+        self.m2 = m2
+        self.transform = lambda x: x
+        self.sample_init = lambda key: jax.random.normal(key, shape=(self.ndims, ))
+
+    def logdensity_fn(self, x):
+        phi = x.reshape(self.lattice_shape)
+        laplace = sum(jnp.roll(phi, 1, axis) + jnp.roll(phi, -1, axis) - 2 * phi for axis in (0, 1))
+        return -0.5 * jnp.sum(phi * (self.m2 * phi - laplace))
+
+
+shapes = [(8, 8), (6, 5)]
+
+
+@pytest.mark.parametrize('shape', shapes)
+def test_roundtrip(shape):
+    model = FreeField(shape, 0.5)
+    preconditioned = fourier_preconditioned(model, free_field_spectrum(shape, 0.5))
+    x = jax.random.normal(jax.random.key(0), (model.ndims, ))
+
+    assert jnp.allclose(preconditioned.to_x(preconditioned.to_y(x)), x, atol=1e-5)
+    assert jnp.allclose(preconditioned.to_y(preconditioned.to_x(x)), x, atol=1e-5)
+
+
+def test_roundtrip_phi4():
+    preconditioned = fourier_preconditioned(Phi4(L=8, lam=1.), free_field_spectrum((8, 8), 1.))
+    x = jax.random.normal(jax.random.key(0), (64, ))
+    assert jnp.allclose(preconditioned.to_x(preconditioned.to_y(x)), x, atol=1e-5)
+
+
+@pytest.mark.parametrize('shape', shapes)
+def test_free_field_is_isotropic(shape):
+    """with the exact spectrum, the free field is a standard normal in the preconditioned variables"""
+
+    model = FreeField(shape, 0.5)
+    preconditioned = fourier_preconditioned(model, free_field_spectrum(shape, 0.5))
+    y = jax.random.normal(jax.random.key(1), (3, model.ndims))
+
+    logdensity, grad = jax.vmap(jax.value_and_grad(preconditioned.logdensity_fn))(y)
+    assert jnp.allclose(logdensity, -0.5 * jnp.sum(jnp.square(y), axis=1), rtol=1e-4)
+    assert jnp.allclose(grad, -y, atol=1e-4)
+
+
+def test_fourier_power():
+    """the average power spectrum of free field samples is the free field spectrum"""
+
+    shape = (8, 8)
+    model = FreeField(shape, 0.5)
+    spectrum = free_field_spectrum(shape, 0.5)
+    preconditioned = fourier_preconditioned(model, spectrum)
+
+    x = jax.vmap(preconditioned.to_x)(jax.random.normal(jax.random.key(2), (20000, model.ndims)))
+    power = jnp.mean(jax.vmap(lambda x: fourier_power(model, x))(x), axis=0)
+    assert jnp.allclose(power / spectrum, 1., atol=0.1)
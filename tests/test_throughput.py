@@ -0,0 +1,153 @@
+import inspect
+import sys
+
+sys.path.append("./")
+sys.path.append("../blackjax")
+
+import jax
+import jax.numpy as jnp
+import pytest
+
+import blackjax
+from benchmarks import inference_models, lattice
+from benchmarks.inference_models import (
+    Banana,
+    BiModal,
+    BiModalEqual,
+    Brownian,
+    Cauchy,
+    Funnel,
+    Funnel_with_Data,
+    Gaussian,
+    GermanCredit,
+    HardConvex,
+    ItemResponseTheory,
+    MixedLogit,
+    Rosenbrock,
+    StochasticGaussian,
+    StochasticVolatility,
+)
+from benchmarks.lattice import Phi4, U1, fourier_preconditioned, free_field_spectrum
+from benchmarks.sampling_algorithms import map_integrator_type_to_integrator, unadjusted_mclmc_no_tuning
+from benchmarks.batching import with_batched_logdensity
+
+
+# Performance regression suite (pytest-benchmark). Times the compiled programs only: everything is compiled and run once before the timing starts.
+#
+#     make set-bench      # save the current timings as the baseline (in .benchmarks/)
+#     make compare-bench  # compare against the last saved baseline, fails if the mean time of any benchmark got worse by more than 2%
+#
+# The gradient benchmarks evaluate num_chains gradients per call, so gradients per second = num_chains * operations per second (also stored in extra_info).
+
+
+num_chains = 128
+
+# every target, with the settings used in the benchmarks. The models are only constructed in the test which uses them (some are large or load data).
+# The sizes are kept small enough for the regular test run (make test), which also runs this file.
+models = {
+    'StochasticGaussian': lambda: StochasticGaussian(ndims=100),
+    'Gaussian': lambda: Gaussian(ndims=100),
+    'Gaussian_dct': lambda: Gaussian(ndims=10000, condition_number=100., numpy_seed=0, rotation='dct'),
+    'Banana': lambda: Banana(),
+    'Cauchy': lambda: Cauchy(d=100),
+    'HardConvex': lambda: HardConvex(d=100, kappa=100.),
+    'BiModal': lambda: BiModal(),
+    'BiModalEqual': lambda: BiModalEqual(d=50, mu=5.),
+    'Funnel': lambda: Funnel(),
+    'Funnel_with_Data': lambda: Funnel_with_Data(),
+    'Rosenbrock': lambda: Rosenbrock(),
+    'Brownian': lambda: Brownian(),
+    'GermanCredit': lambda: GermanCredit(),
+    'ItemResponseTheory': lambda: ItemResponseTheory(),
+    'ItemResponseTheory_sparse': lambda: ItemResponseTheory(sparse=True),
+    'StochasticVolatility': lambda: StochasticVolatility(),
+    'MixedLogit': lambda: MixedLogit(),
+    'Phi4': lambda: Phi4(L=16, lam=1.),
+    'U1': lambda: U1(Lt=16, Lx=16),
+    'Phi4_fourier': lambda: fourier_preconditioned(Phi4(L=64, lam=1.), free_field_spectrum((64, 64), 1.)),
+}
+
+# entries of models which benchmark a target with another layout or parametrization, rather than a separate class
+variants = {'Gaussian_dct', 'ItemResponseTheory_sparse', 'Phi4_fourier'}
+
+
+def timed(benchmark, fn, *args):
+    """benchmark of the compiled fn(*args), waiting for the result"""
+
+    jax.block_until_ready(fn(*args))  # compile
+    return benchmark(lambda: jax.block_until_ready(fn(*args)))
+
+
+def initial_positions(model):
+    return jax.vmap(model.sample_init)(jax.random.split(jax.random.key(0), num_chains))
+
+
+def test_all_models_are_benchmarked():
+    targets = {name for module in (inference_models, lattice) for name, c in inspect.getmembers(module, inspect.isclass) if c.__module__ == module.__name__}
+    assert targets | variants == set(models), f"add the new targets to models: {targets - set(models)}"
+
+
+@pytest.mark.parametrize('make_model', list(models.values()), ids=list(models))
+def test_gradient(benchmark, make_model):
+    """jitted value_and_grad of the log density, vmapped over the chains"""
+
+    model = make_model()
+    grad = jax.jit(jax.vmap(jax.value_and_grad(model.logdensity_fn)))
+
+    benchmark.extra_info.update(ndims=model.ndims, num_chains=num_chains)
+    timed(benchmark, grad, initial_positions(model))
+    if benchmark.stats is not None: # None with --benchmark-disable
+        benchmark.extra_info['grads_per_second'] = num_chains / benchmark.stats.stats.mean
+
+
+@pytest.mark.parametrize('make_model', list(models.values()), ids=list(models))
+def test_batched_gradient(benchmark, make_model):
+    """as test_gradient, but the chains are evaluated together with the model's batched_logdensity_fn"""
+
+    model = make_model()
+    if not hasattr(model, 'batched_logdensity_fn'):
+        pytest.skip(f"{model.name} has no batched_logdensity_fn")
+    positions = initial_positions(model)
+    grad = jax.jit(jax.vmap(jax.value_and_grad(with_batched_logdensity(model).logdensity_fn)))
+
+    value, g = grad(positions)
+    value_ref, g_ref = jax.vmap(jax.value_and_grad(model.logdensity_fn))(positions)
+    assert jnp.allclose(value, value_ref, rtol=1e-4) and jnp.allclose(g, g_ref, rtol=1e-4, atol=1e-4)
+
+    benchmark.extra_info.update(ndims=model.ndims, num_chains=num_chains)
+    timed(benchmark, grad, positions)
+    if benchmark.stats is not None:
+        benchmark.extra_info['grads_per_second'] = num_chains / benchmark.stats.stats.mean
+
+
+@pytest.mark.parametrize('kind, integrator_type', [(kind, integrator_type) for kind in map_integrator_type_to_integrator for integrator_type in map_integrator_type_to_integrator[kind]])
+def test_integrator_step(benchmark, kind, integrator_type):
+    """one step of the kernel with a single integrator step, vmapped over the chains"""
+
+    model = Gaussian(ndims=100)
+    integrator = map_integrator_type_to_integrator[kind][integrator_type]
+    positions = initial_positions(model)
+    keys = jax.random.split(jax.random.key(1), num_chains)
+
+    if kind == 'mclmc':
+        alg = blackjax.mclmc(model.logdensity_fn, L=10., step_size=1., integrator=integrator)
+        states = jax.vmap(lambda x, key: blackjax.mcmc.mclmc.init(position=x, logdensity_fn=model.logdensity_fn, rng_key=key))(positions, keys)
+    else:
+        alg = blackjax.hmc(model.logdensity_fn, step_size=0.5, inverse_mass_matrix=jnp.ones(model.ndims), num_integration_steps=1, integrator=integrator)
+        states = jax.vmap(alg.init)(positions)
+
+    timed(benchmark, jax.jit(jax.vmap(alg.step)), keys, states)
+
+
+def test_mclmc_run(benchmark):
+    """a short unadjusted MCLMC run, with the expectation values computed on the fly (as in metrics.benchmark)"""
+
+    model = Gaussian(ndims=100)
+    num_steps = 1000
+    initial_state = blackjax.mcmc.mclmc.init(position=model.sample_init(jax.random.key(0)), logdensity_fn=model.logdensity_fn, rng_key=jax.random.key(1))
+    sampler = unadjusted_mclmc_no_tuning(initial_state, 'mclachlan', step_size=1., L=10., inverse_mass_matrix=1., num_tuning_steps=0)
+
+    run = jax.jit(jax.vmap(lambda key: sampler(model=model, num_steps=num_steps, initial_position=initial_state.position, key=key)))
+
+    benchmark.extra_info.update(num_steps=num_steps, num_chains=num_chains)
+    timed(benchmark, run, jax.random.split(jax.random.key(2), num_chains))